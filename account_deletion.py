@@ -0,0 +1,333 @@
+"""Background deletion of user accounts.
+
+Deleting a user's row through the ORM loads their messages, follows and
+likes before the cascades run, so deleting a prolific account that way
+takes seconds and holds locks on the busiest tables. Instead,
+``request_deletion`` only marks the account (``users.deleted_at``), which
+hides it everywhere at once, and records a ``DeletionJob``. The job then
+purges the account's rows in phases, at most ``ACCOUNT_PURGE_BATCH_SIZE``
+rows per transaction, adjusting other users' and messages' counters batch
+by batch:
+
+    likes_given       the user's likes, and those messages' like counts
+    likes_received    likes of the user's messages, and the likers' counts
+    following         the user's follows, and the followed users' counts
+    followers         follows of the user, and the followers' counts
+    timelines         the user's timeline and their messages on others'
+    messages          the user's messages and their feed scores
+    account           search index, timeline marker and the user's row
+
+Each batch commits together with the job's progress, so a job that is
+interrupted (a crash, a deploy) resumes where it stopped. A runner claims a
+job with a lease, so that two runners never purge the same account at once.
+
+Jobs are started from a background thread as soon as the account is
+deleted; ``flask purge-deleted`` runs any unfinished ones (e.g. from cron).
+
+None of these functions but ``run_job`` commit.
+
+Config (defaults set by ``init_app``):
+
+    ACCOUNT_PURGE_BATCH_SIZE      rows deleted per transaction (1000)
+    ACCOUNT_PURGE_PAUSE           seconds between batches (0.05)
+    ACCOUNT_PURGE_LEASE           seconds a runner holds a job between
+                                  batches (60)
+    ACCOUNT_PURGE_IN_BACKGROUND   purge from a thread straight after the
+                                  deletion, rather than leaving jobs for
+                                  ``flask purge-deleted`` (True)
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, select, tuple_
+
+from models import (db, DeletionJob, Follows, Likes, Message, Timeline,
+                    TimelineEntry, User)
+import message_scores
+import user_search
+
+logger = logging.getLogger('warbler.account_deletion')
+
+users = User.__table__
+messages = Message.__table__
+follows = Follows.__table__
+likes = Likes.__table__
+entries = TimelineEntry.__table__
+timelines = Timeline.__table__
+jobs = DeletionJob.__table__
+
+
+def init_app(app):
+    app.config.setdefault('ACCOUNT_PURGE_BATCH_SIZE', 1000)
+    app.config.setdefault('ACCOUNT_PURGE_PAUSE', 0.05)
+    app.config.setdefault('ACCOUNT_PURGE_LEASE', 60)
+    app.config.setdefault('ACCOUNT_PURGE_IN_BACKGROUND', True)
+
+
+def request_deletion(user):
+    """Hide `user`'s account and queue the purge of its rows.
+
+    Returns the new DeletionJob; the caller commits, then ``start``s it.
+    """
+
+    user.deleted_at = datetime.utcnow()
+    user_search.unindex_user(user.id)
+
+    job = DeletionJob(user_id=user.id, phase=PHASES[0][0])
+    db.session.add(job)
+    return job
+
+
+##############################################################################
+# Phases
+#
+# Each deletes up to `limit` rows of one kind and returns (rows deleted,
+# whether the phase is done).
+
+
+def _decrement(column, counts):
+    """Lower `column` of users by their count in `counts` (a Counter)."""
+
+    by_amount = defaultdict(list)
+    for user_id, n in counts.items():
+        by_amount[n].append(user_id)
+
+    for n, user_ids in sorted(by_amount.items()):
+        db.session.execute(users.update()
+                           .where(users.c.id.in_(user_ids))
+                           .values({column: users.c[column] - n}))
+
+
+def purge_likes_given(user_id, limit):
+    rows = db.session.execute(
+        select([likes.c.id, likes.c.message_id])
+        .where(likes.c.user_id == user_id)
+        .order_by(likes.c.id)
+        .limit(limit)).fetchall()
+
+    if rows:
+        db.session.execute(messages.update()
+                           .where(messages.c.id.in_([m for _, m in rows]))
+                           .values(likes_count=messages.c.likes_count - 1))
+        db.session.execute(
+            likes.delete().where(likes.c.id.in_([like for like, _ in rows])))
+
+    return len(rows), len(rows) < limit
+
+
+def purge_likes_received(user_id, limit):
+    rows = db.session.execute(
+        select([likes.c.id, likes.c.user_id])
+        .select_from(likes.join(messages, likes.c.message_id == messages.c.id))
+        .where(messages.c.user_id == user_id)
+        .order_by(likes.c.id)
+        .limit(limit)).fetchall()
+
+    if rows:
+        _decrement('likes_count', Counter(liker for _, liker in rows))
+        db.session.execute(
+            likes.delete().where(likes.c.id.in_([like for like, _ in rows])))
+
+    return len(rows), len(rows) < limit
+
+
+def _purge_follows(own, other, counter, user_id, limit):
+    """Delete follows whose `own` column is the user, lowering `counter`
+    of the users in their `other` column."""
+
+    other_ids = [other_id for (other_id,) in db.session.execute(
+        select([other])
+        .where(own == user_id)
+        .order_by(other)
+        .limit(limit))]
+
+    if other_ids:
+        _decrement(counter, Counter(other_ids))
+        db.session.execute(follows.delete()
+                           .where(own == user_id)
+                           .where(other.in_(other_ids)))
+
+    return len(other_ids), len(other_ids) < limit
+
+
+def purge_following(user_id, limit):
+    return _purge_follows(follows.c.user_following_id,
+                          follows.c.user_being_followed_id,
+                          'followers_count', user_id, limit)
+
+
+def purge_followers(user_id, limit):
+    return _purge_follows(follows.c.user_being_followed_id,
+                          follows.c.user_following_id,
+                          'following_count', user_id, limit)
+
+
+def purge_timelines(user_id, limit):
+    keys = db.session.execute(
+        select([entries.c.user_id, entries.c.message_id])
+        .where(or_(entries.c.author_id == user_id, entries.c.user_id == user_id))
+        .limit(limit)).fetchall()
+
+    if keys:
+        db.session.execute(entries.delete().where(
+            tuple_(entries.c.user_id, entries.c.message_id)
+            .in_([tuple(key) for key in keys])))
+
+    return len(keys), len(keys) < limit
+
+
+def purge_messages(user_id, limit):
+    message_ids = [message_id for (message_id,) in db.session.execute(
+        select([messages.c.id])
+        .where(messages.c.user_id == user_id)
+        .order_by(messages.c.id)
+        .limit(limit))]
+
+    if message_ids:
+        message_scores.remove_messages(message_ids)
+        db.session.execute(
+            messages.delete().where(messages.c.id.in_(message_ids)))
+
+    return len(message_ids), len(message_ids) < limit
+
+
+def purge_account(user_id, limit):
+    user_search.unindex_user(user_id)
+    db.session.execute(timelines.delete().where(timelines.c.user_id == user_id))
+    deleted = db.session.execute(
+        users.delete().where(users.c.id == user_id)).rowcount
+
+    return deleted, True
+
+
+PHASES = [
+    ('likes_given', purge_likes_given),
+    ('likes_received', purge_likes_received),
+    ('following', purge_following),
+    ('followers', purge_followers),
+    ('timelines', purge_timelines),
+    ('messages', purge_messages),
+    ('account', purge_account),
+]
+
+NEXT_PHASE = {name: next_name for (name, _), (next_name, _)
+              in zip(PHASES, PHASES[1:])}
+
+
+##############################################################################
+# Running jobs
+
+
+def _claim(job_id, owner, lease):
+    """Take (or renew) the lease on an unfinished job; returns whether we
+    hold it."""
+
+    now = datetime.utcnow()
+    result = db.session.execute(
+        jobs.update()
+        .where(jobs.c.id == job_id)
+        .where(jobs.c.finished_at.is_(None))
+        .where(or_(jobs.c.claimed_until.is_(None),
+                   jobs.c.claimed_until < now,
+                   jobs.c.claimed_by == owner))
+        .values(claimed_by=owner, claimed_until=now + timedelta(seconds=lease)))
+
+    return result.rowcount == 1
+
+
+def _release(job_id, owner, **values):
+    db.session.execute(jobs.update()
+                       .where(jobs.c.id == job_id)
+                       .where(jobs.c.claimed_by == owner)
+                       .values(claimed_by=None, claimed_until=None, **values))
+    db.session.commit()
+
+
+def run_job(job_id, batch_size=None, max_batches=None):
+    """Purge a job's rows a batch per transaction, until it's finished or
+    `max_batches` have run. Returns whether the job is finished.
+
+    Does nothing (returning False) if another runner holds the job.
+    """
+
+    config = current_app.config
+    batch_size = batch_size or config['ACCOUNT_PURGE_BATCH_SIZE']
+    owner = uuid.uuid4().hex
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        if not _claim(job_id, owner, config['ACCOUNT_PURGE_LEASE']):
+            db.session.rollback()
+            return False
+
+        job = DeletionJob.query.get(job_id)
+
+        try:
+            deleted, done = dict(PHASES)[job.phase](job.user_id, batch_size)
+        except Exception as err:
+            db.session.rollback()
+            _release(job_id, owner, last_error=repr(err))
+            raise
+
+        job.rows_deleted += deleted
+        job.batches += 1
+        job.updated_at = datetime.utcnow()
+
+        if done and job.phase in NEXT_PHASE:
+            job.phase = NEXT_PHASE[job.phase]
+        elif done:
+            job.finished_at = job.updated_at
+            job.claimed_by = job.claimed_until = None
+
+        db.session.commit()
+
+        if job.finished_at is not None:
+            logger.info("Purged user %s: %s rows in %s batches",
+                        job.user_id, job.rows_deleted, job.batches)
+            return True
+
+        batches += 1
+        time.sleep(config['ACCOUNT_PURGE_PAUSE'])
+
+    _release(job_id, owner)
+    return False
+
+
+def run_pending(**options):
+    """Run every unfinished job in turn; returns how many finished."""
+
+    job_ids = [job_id for (job_id,) in (db.session
+                                        .query(DeletionJob.id)
+                                        .filter(DeletionJob.finished_at.is_(None))
+                                        .order_by(DeletionJob.id))]
+
+    return sum(run_job(job_id, **options) for job_id in job_ids)
+
+
+def start(job):
+    """Purge a committed job from a background thread, if configured to."""
+
+    app = current_app._get_current_object()
+
+    if not app.config['ACCOUNT_PURGE_IN_BACKGROUND']:
+        return None
+
+    def purge(job_id):
+        with app.app_context():
+            try:
+                run_job(job_id)
+            except Exception:
+                logger.exception("Purging deletion job %s failed", job_id)
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=purge, args=(job.id,), daemon=True,
+                              name=f'account-purge-{job.id}')
+    thread.start()
+    return thread
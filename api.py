@@ -0,0 +1,195 @@
+"""JSON API helpers: field selection, row queries and serialization.
+
+The ``/api/...`` views in app.py return the same timelines, profiles and
+lists as the HTML pages, for clients that would otherwise scrape them.
+
+Each view loads only the columns its response needs, as plain row tuples
+rather than ORM objects, so building a page of items costs the same per
+item however many fields a model has. Clients pick fields with
+``fields=id,text,user.username`` (``user`` on its own means every user
+field); without it they get ``DEFAULT_MESSAGE_FIELDS`` or
+``DEFAULT_USER_FIELDS``.
+
+Every list is a page of the usual newest-first cursor pagination:
+
+    {"messages": [...], "before": "<cursor>", "next": "/api/...?before=..."}
+
+``before`` and ``next`` are null on the last page.
+
+Responses are serialized with ``orjson`` when it is installed
+(``pip install orjson``), and the standard library otherwise.
+"""
+
+import json
+from collections import OrderedDict
+
+from flask import current_app
+
+from like_counts import like_counts
+from models import db, Likes, Message, User
+
+try:
+    import orjson
+except ImportError:  # the json module does, more slowly
+    orjson = None
+
+USER_FIELDS = OrderedDict([
+    ('id', User.id),
+    ('username', User.username),
+    ('image_url', User.image_url),
+    ('header_image_url', User.header_image_url),
+    ('bio', User.bio),
+    ('location', User.location),
+    ('messages_count', User.messages_count),
+    ('following_count', User.following_count),
+    ('followers_count', User.followers_count),
+    ('likes_count', User.likes_count),
+])
+
+# `liked` (has the viewer liked it?) isn't a column; it's looked up for
+# the whole page at once.
+MESSAGE_FIELDS = OrderedDict(
+    [('id', Message.id),
+     ('text', Message.text),
+     ('timestamp', Message.timestamp),
+     ('likes', Message.likes_count),
+     ('liked', None)] +
+    [(f'user.{name}', column) for name, column in USER_FIELDS.items()])
+
+DEFAULT_USER_FIELDS = list(USER_FIELDS)
+
+DEFAULT_MESSAGE_FIELDS = ['id', 'text', 'timestamp', 'likes',
+                          'user.id', 'user.username', 'user.image_url']
+
+# Columns every message row starts with, whatever fields were asked for:
+# for the cursor, timeline.build, and http_cache validators.
+MESSAGE_BASE = [Message.id.label('id'),
+                Message.timestamp.label('timestamp'),
+                Message.user_id.label('user_id'),
+                User.updated_at.label('user_updated_at')]
+
+
+class FieldError(ValueError):
+    """A `fields` parameter names a field we don't have."""
+
+
+def parse_fields(spec, available, default):
+    """Field names from a ``fields=`` value, in `available`'s order."""
+
+    if not spec:
+        return list(default)
+
+    wanted = set()
+
+    for name in spec.split(','):
+        name = name.strip()
+        prefix = f"{name}."
+        nested = [field for field in available if field.startswith(prefix)]
+
+        if name in available:
+            wanted.add(name)
+        elif nested:
+            wanted.update(nested)
+        elif name:
+            raise FieldError(f"Unknown field: {name}")
+
+    return [field for field in available if field in wanted]
+
+
+def _columns(fields, available):
+    return [available[name].label(f"f{i}") for i, name in enumerate(fields)
+            if available[name] is not None]
+
+
+def message_rows(fields):
+    """Query of message rows (with their authors) for `fields`; hides
+    messages of deleted accounts, like with_authors()."""
+
+    return (db.session
+            .query(*MESSAGE_BASE, *_columns(fields, MESSAGE_FIELDS))
+            .select_from(Message)
+            .join(User, Message.user_id == User.id)
+            .filter(User.deleted_at.is_(None)))
+
+
+def user_row(user_id, fields):
+    """Row of `fields` for an account that hasn't been deleted, or None."""
+
+    return (db.session
+            .query(User.id, *_columns(fields, USER_FIELDS))
+            .filter(User.id == user_id, User.deleted_at.is_(None))
+            .first())
+
+
+def _shape(values, fields):
+    """Dict of `fields` from `values`, nesting "user.x" under "user"."""
+
+    item = {}
+
+    for name, value in zip(fields, values):
+        head, _, tail = name.partition('.')
+        if tail:
+            item.setdefault(head, {})[tail] = value
+        else:
+            item[name] = value
+
+    return item
+
+
+def messages(rows, fields, viewer_id=None):
+    """Dicts of `fields` for message `rows` from message_rows()."""
+
+    columns = [name for name in fields if MESSAGE_FIELDS[name] is not None]
+    skip = len(MESSAGE_BASE)
+    items = [_shape(row[skip:], columns) for row in rows]
+
+    if 'likes' in fields:
+        for item, row in zip(items, rows):
+            item['likes'] += like_counts.pending(row.id)
+
+    if 'liked' in fields:
+        liked = (Likes.liked_among(viewer_id, [row.id for row in rows])
+                 if viewer_id else set())
+        for item, row in zip(items, rows):
+            item['liked'] = row.id in liked
+
+    return items
+
+
+def user(row, fields):
+    """Dict of `fields` for a row from user_row()."""
+
+    return _shape(row[1:], fields)
+
+
+def versions(rows, items):
+    """What a list of message rows changes with, for http_cache.check():
+    their authors' versions, and the likes shown for them."""
+
+    return [(row.id, row.user_updated_at, item.get('likes'), item.get('liked'))
+            for row, item in zip(rows, items)]
+
+
+def _default(obj):
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f"Can't serialize {type(obj).__name__}")
+
+
+def dumps(data):
+    """Compact JSON bytes for `data` (datetimes in ISO 8601)."""
+
+    if orjson is not None:
+        return orjson.dumps(data)
+
+    return json.dumps(data, separators=(',', ':'), default=_default,
+                      ensure_ascii=False).encode('utf-8')
+
+
+def respond(data, status=200):
+    return current_app.response_class(dumps(data), status=status,
+                                      mimetype='application/json')
+
+
+def error(message, status):
+    return respond(dict(error=message), status)
@@ -1,11 +1,34 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import (Flask, render_template, request, flash, redirect, session,
+                   g, abort, url_for, jsonify)
 from flask_debugtoolbar import DebugToolbarExtension
+from sqlalchemy import or_, true
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager
 
 from forms import UserForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Likes, Follows
+from passwords import hasher, PasswordPoolBusy
+import account_deletion
+import api
+import counters
+from identity_cache import IdentityCache, load_user
+import message_scores
+import migrations
+import replicas
+import timeline
+import user_search
+from pagination import (PAGE_SIZE, Page, decode_cursor, older_than, page_of,
+                        paginate)
+from sql_stats import SQLStats
+from pool_stats import PoolStats
+from rate_limit import RateLimiter
+import http_cache
+from assets import Assets, build as build_assets
+from image_proxy import ImageProxy
+from fragment_cache import FragmentCache
+from like_counts import like_counts
 
 CURR_USER_KEY = "curr_user"
 
@@ -20,9 +43,55 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 10000))
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_POOL_WORKERS'] = (
+    int(os.environ['PASSWORD_POOL_WORKERS'])
+    if 'PASSWORD_POOL_WORKERS' in os.environ else None)
+app.config['PASSWORD_POOL_QUEUE'] = int(os.environ.get('PASSWORD_POOL_QUEUE', 32))
+app.config['SQL_STATS_REPORT'] = os.environ.get('SQL_STATS_REPORT') == '1'
+app.config['FRAGMENT_CACHE_URL'] = os.environ.get('FRAGMENT_CACHE_URL')
+app.config['DATABASE_REPLICA_URLS'] = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+app.config['REPLICA_STICKY_SECONDS'] = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+app.config['POOL_STATS_REPORT'] = os.environ.get('POOL_STATS_REPORT') == '1'
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_POOL_MAX_OVERFLOW'] = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+app.config['ACCOUNT_PURGE_BATCH_SIZE'] = int(
+    os.environ.get('ACCOUNT_PURGE_BATCH_SIZE', 1000))
+app.config['ACCOUNT_PURGE_IN_BACKGROUND'] = (
+    os.environ.get('ACCOUNT_PURGE_IN_BACKGROUND', '1') == '1')
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+if 'RATE_LIMIT_DB' in os.environ:
+    app.config['RATE_LIMIT_DB'] = os.environ['RATE_LIMIT_DB']
 toolbar = DebugToolbarExtension(app)
+sql_stats = SQLStats(app)
+pool_stats = PoolStats(app, db)
+rate_limiter = RateLimiter(app, session_key=CURR_USER_KEY)
 
+replicas.init_app(app)
 connect_db(app)
+hasher.init_app(app)
+like_counts.init_app(app)
+account_deletion.init_app(app)
+static_assets = Assets(app)
+images = ImageProxy(app, local_url=static_assets.url)
+http_cache.init_app(app)
+fragments = FragmentCache(app)
+
+user_cache = IdentityCache(maxsize=app.config['USER_CACHE_SIZE'],
+                           ttl=app.config['USER_CACHE_TTL'])
+
+pool_stats.add_report('password_hasher', hasher.stats)
+pool_stats.add_report('rate_limiter', rate_limiter.stats)
+pool_stats.add_report('like_counts', like_counts.stats)
+pool_stats.add_report('image_cache', images.stats)
+pool_stats.add_report('fragment_cache', fragments.stats)
+pool_stats.add_report('user_cache', user_cache.stats)
 
 
 ##############################################################################
@@ -34,7 +103,7 @@ def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = load_user(user_cache, session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -75,6 +144,8 @@ def signup():
                 email=form.email.data,
                 image_url=form.image_url.data or User.image_url.default.arg
             )
+            db.session.flush()
+            user_search.index_user(user)
             db.session.commit()
 
         except IntegrityError:
@@ -100,6 +171,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # authenticate() may have upgraded the password hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -121,41 +194,115 @@ def logout():
 ##############################################################################
 # General user routes:
 
+
+def follow_state(users):
+    """Which of `users` g.user follows, and which follow g.user back.
+
+    Two indexed queries for the whole list, so user cards needn't each
+    ask g.user.is_following().
+    """
+
+    if not g.user:
+        return set(), set()
+
+    user_ids = [user.id for user in users]
+    return (Follows.followed_among(g.user.id, user_ids),
+            Follows.followers_among(g.user.id, user_ids))
+
+
+def get_user_or_404(user_id):
+    """The user with this id; 404 if there's none or they've deleted
+    their account."""
+
+    user = User.query.get_or_404(user_id)
+
+    if user.deleted_at is not None:
+        abort(404)
+
+    return user
+
+
+def active(users):
+    """`users` without those who have deleted their accounts."""
+
+    return [user for user in users if user.deleted_at is None]
+
+
+def viewer_follows(user):
+    """Does g.user follow `user`? (False if logged out or it's them.)"""
+
+    return bool(g.user) and g.user.id != user.id and g.user.is_following(user)
+
+
+def user_versions(users):
+    """What a list of user cards changes with, for http_cache.check()."""
+
+    return [(user.id, user.updated_at) for user in users]
+
+
 @app.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username
+    (or bio/location); results come a page at a time via 'page'.
+
+    Without 'q', lists users in id order a page at a time via 'after'.
     """
 
     search = request.args.get('q')
 
     if not search:
-        users = User.query.all()
+        after = request.args.get('after', 0, type=int)
+        users = (User
+                 .query
+                 .filter(User.id > after, User.deleted_at.is_(None))
+                 .order_by(User.id)
+                 .limit(user_search.PER_PAGE + 1)
+                 .all())
+
+        more = len(users) > user_search.PER_PAGE
+        users = users[:user_search.PER_PAGE]
+        next_url = url_for('list_users', after=users[-1].id) if more else None
+
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = max(request.args.get('page', 1, type=int), 1)
+        users, more = user_search.search_users(search, page)
+        next_url = url_for('list_users', q=search, page=page + 1) if more else None
 
-    return render_template('users/index.html', users=users)
+    following_ids, follower_ids = follow_state(users)
+
+    not_modified = http_cache.check(user_versions(users), following_ids,
+                                    follower_ids, public=True)
+    if not_modified:
+        return not_modified
+
+    return render_template('users/index.html', users=users, next_url=next_url,
+                           following_ids=following_ids, follower_ids=follower_ids)
 
 
 @app.route('/users/<int:user_id>')
 def show_users(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
+    page = user_messages(user_id, get_cursor())
+    messages = page.items
+    is_following = viewer_follows(user)
 
-    print(messages)
+    # the user's row changes with each message posted or deleted
+    not_modified = http_cache.check((user.id, user.updated_at), is_following,
+                                    public=True, last_modified=user.updated_at)
+    if not_modified:
+        return not_modified
 
-    return render_template('users/show.html', user=user, messages=messages)
+    return render_template('users/show.html', user=user, messages=messages,
+                           is_following=is_following,
+                           next_page=next_page_links(page, 'show_users', 'user_feed',
+                                                     user_id=user_id))
 
 
 @app.route('/users/<int:user_id>/following')
@@ -166,9 +313,20 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
+    following = active(user.following)
+    following_ids, follower_ids = follow_state(following)
+    is_following = viewer_follows(user)
 
-    return render_template('users/following.html', user=user)
+    not_modified = http_cache.check((user.id, user.updated_at),
+                                    user_versions(following),
+                                    following_ids, follower_ids, is_following)
+    if not_modified:
+        return not_modified
+
+    return render_template('users/following.html', user=user,
+                           following=following, is_following=is_following,
+                           following_ids=following_ids, follower_ids=follower_ids)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -179,8 +337,20 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = get_user_or_404(user_id)
+    followers = active(user.followers)
+    following_ids, follower_ids = follow_state(followers)
+    is_following = viewer_follows(user)
+
+    not_modified = http_cache.check((user.id, user.updated_at),
+                                    user_versions(followers),
+                                    following_ids, follower_ids, is_following)
+    if not_modified:
+        return not_modified
+
+    return render_template('users/followers.html', user=user,
+                           followers=followers, is_following=is_following,
+                           following_ids=following_ids, follower_ids=follower_ids)
 
 
 @app.route('/users/<int:user_id>/likes')
@@ -191,19 +361,22 @@ def users_liked_messages(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
 
-    user_likes = user.likes
+    page = liked_messages(user_id, get_cursor())
+    messages = page.items
+    is_following = viewer_follows(user)
 
-    messages = (Message
-                .query
-                .filter(Message.id.in_(l.id for l in user_likes))
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
+    # the user's row changes with each like or unlike
+    not_modified = http_cache.check((user.id, user.updated_at),
+                                    message_versions(messages), is_following)
+    if not_modified:
+        return not_modified
 
-    print('****************************', messages)
-    return render_template('users/likes.html', user=user, messages=messages)
+    return render_template('users/likes.html', user=user, messages=messages,
+                           is_following=is_following,
+                           next_page=next_page_links(page, 'users_liked_messages',
+                                                     'likes_feed', user_id=user_id))
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -214,8 +387,12 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
+    followed_user = get_user_or_404(follow_id)
     g.user.following.append(followed_user)
+    db.session.flush()
+    counters.bump(g.user.id, following_count=1)
+    counters.bump(followed_user.id, followers_count=1)
+    timeline.backfill(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -229,8 +406,11 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
+    followed_user = get_user_or_404(follow_id)
     g.user.following.remove(followed_user)
+    counters.bump(g.user.id, following_count=-1)
+    counters.bump(followed_user.id, followers_count=-1)
+    timeline.unfollow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -244,7 +424,7 @@ def profile(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
     form = UserForm(obj=user)
 
     if form.validate_on_submit():
@@ -256,7 +436,9 @@ def profile(user_id):
             user.image_url = form.image_url.data
             user.header_image_url = form.header_image_url.data
             user.bio = form.bio.data
+            user_search.index_user(user)
             db.session.commit()
+            user_cache.invalidate(user.id)
             flash(f'{user.id} has been updated')
             return redirect(f'/users/{user.id}')
     return render_template('users/edit.html', user=user, form=form)
@@ -264,7 +446,11 @@ def profile(user_id):
 
 @app.route('/users/delete', methods=["POST"])
 def delete_user():
-    """Delete user."""
+    """Delete user.
+
+    The account is hidden at once; its rows are purged in the background
+    (see account_deletion.py).
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
@@ -272,8 +458,10 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    job = account_deletion.request_deletion(g.user)
     db.session.commit()
+    user_cache.invalidate(g.user.id)
+    account_deletion.start(job)
 
     return redirect("/signup")
 
@@ -297,6 +485,10 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        counters.bump(g.user.id, messages_count=1)
+        timeline.fan_out(msg)
+        message_scores.add_message(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -308,8 +500,19 @@ def messages_add():
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = (with_authors(Message.query)
+           .filter(Message.id == message_id)
+           .first_or_404())
+    is_following = viewer_follows(msg.user)
+    likes = like_counts.count(msg)
+
+    not_modified = http_cache.check(msg.id, msg.user.updated_at, is_following,
+                                    likes, public=True)
+    if not_modified:
+        return not_modified
+
+    return render_template('messages/show.html', message=msg, likes=likes,
+                           is_following=is_following)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -321,36 +524,417 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    counters.forget_message(msg.id)
+    counters.bump(msg.user_id, messages_count=-1)
+    timeline.remove_message(msg.id)
+    message_scores.remove_messages([msg.id])
     db.session.delete(msg)
     db.session.commit()
+    fragments.invalidate(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
 
+def apply_like(message_id, liked):
+    """Like or unlike a message as g.user, without committing.
+
+    Returns whether anything changed; pass that on to like_counts once
+    committed.
+    """
+
+    if liked:
+        changed = Likes.add(g.user.id, message_id)
+    else:
+        changed = Likes.remove(g.user.id, message_id)
+
+    if changed:
+        counters.bump(g.user.id, likes_count=1 if liked else -1)
+
+    return changed
+
+
 @app.route('/users/add_like/<int:message_id>', methods=["POST"])
 def add_like(message_id):
-    """Add a like to a message"""
+    """Toggle a like on a message (the no-JS form; see api_like)."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
+    if apply_like(message_id, False):
+        delta = -1
+    elif apply_like(message_id, True):
+        delta = 1
+    else:
+        abort(404)
 
-    like = Likes.query.filter(
-        Likes.message_id == msg.id, Likes.user_id == g.user.id).first()
+    db.session.commit()
+    like_counts.add(message_id, delta)
 
-    if like:
-        remove_like = Likes.query.get(like.id)
-        db.session.delete(remove_like)
-        db.session.commit()
+    return redirect('/')
+
+
+@app.route('/api/messages/<int:message_id>/like', methods=["PUT", "DELETE"])
+def api_like(message_id):
+    """Like (PUT) or unlike (DELETE) a message.
+
+    Idempotent: repeating either is harmless. Returns JSON like
+    {"message_id": 5, "liked": true, "likes": 12}.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    liked = request.method == 'PUT'
+    changed = apply_like(message_id, liked)
+    db.session.commit()
+
+    if changed:
+        like_counts.add(message_id, 1 if liked else -1)
+
+    likes = (db.session
+             .query(Message.likes_count)
+             .filter(Message.id == message_id)
+             .scalar())
+
+    if likes is None:
+        return jsonify(error="No such message."), 404
+
+    return jsonify(message_id=message_id, liked=liked,
+                   likes=likes + like_counts.pending(message_id))
+
+##############################################################################
+# Message lists:
+#
+# Every list of messages is paged newest-first by (timestamp, id); the
+# `before` querystring param is an opaque cursor for the next page.
+#
+# Lists load each message's author in the same query (with_authors) and
+# g.user's likes only for the messages shown (liked_ids), so a page costs
+# the same number of queries however many messages it has.
+
+
+def get_cursor():
+    """Read the `before` cursor from the querystring (400 if it's bogus)."""
+
+    token = request.args.get('before')
+
+    if not token:
+        return None
+
+    try:
+        return decode_cursor(token)
+    except ValueError:
+        abort(400)
+
+
+def next_page_links(page, page_endpoint, feed_endpoint, **values):
+    """Links to the page after `page`: a full page and a list fragment."""
+
+    if page.before is None:
+        return None
+
+    return dict(older=url_for(page_endpoint, before=page.before, **values),
+                more=url_for(feed_endpoint, before=page.before, **values))
+
+
+def with_authors(query):
+    """`query` for messages, loading each author in the same SELECT and
+    leaving out messages of deleted accounts."""
+
+    return (query
+            .join(Message.user)
+            .filter(User.deleted_at.is_(None))
+            .options(contains_eager(Message.user)))
+
+
+def message_versions(messages):
+    """What a list of message cards changes with, for http_cache.check()."""
+
+    return [(msg.id, msg.user.updated_at) for msg in messages]
+
+
+def home_versions(page, liked_msg_ids):
+    """What the home timeline changes with: its messages, g.user's likes
+    among them and g.user's own card."""
+
+    return (message_versions(page.items), sorted(liked_msg_ids),
+            g.user.header_image_url, g.user.messages_count,
+            g.user.following_count, g.user.followers_count)
+
+
+def liked_ids(messages):
+    """Ids of those `messages` that g.user has liked."""
+
+    return Likes.liked_among(g.user.id, [msg.id for msg in messages])
+
+
+def home_messages(cursor=None, messages=None):
+    """Page of messages from g.user and the users they follow.
+
+    Messages come from the user's materialized timeline, continuing with
+    followed users' messages queried directly once it runs out; if they
+    don't have one yet, query those directly and build it.
+
+    `messages` is the query loading them: Message objects with their
+    authors by default, or e.g. rows from api.message_rows().
+    """
+
+    if messages is None:
+        messages = with_authors(Message.query)
+
+    following_ids = (db.session
+                     .query(Follows.user_being_followed_id)
+                     .filter(Follows.user_following_id == g.user.id))
+    feed = messages.filter(or_(Message.user_id.in_(following_ids),
+                               Message.user_id == g.user.id))
+
+    keys = timeline.message_keys(g.user.id, cursor, PAGE_SIZE + 1)
+
+    if keys is None:
+        page = paginate(feed, Message.timestamp, Message.id, cursor)
+
+        if cursor is None:
+            try:
+                timeline.build(g.user.id, page.items)
+                db.session.commit()
+            except IntegrityError:
+                # another request built it first
+                db.session.rollback()
+
+        return page
+
+    # message_keys() may have trimmed an overgrown timeline; commit before
+    # loading messages, as committing expires everything loaded so far
+    db.session.commit()
+
+    shown = Message.id.in_([message_id for _, message_id in keys])
+
+    if len(keys) <= PAGE_SIZE:
+        # the timeline has run out; it holds everything newer than its
+        # end, so carry on from there in the same query
+        end = keys[-1] if keys else cursor
+        if end is None:
+            shown = true()
+        else:
+            shown = or_(shown, older_than(Message.timestamp, Message.id, end))
+
+    return page_of(feed
+                   .filter(shown)
+                   .order_by(Message.timestamp.desc(), Message.id.desc())
+                   .limit(PAGE_SIZE + 1)
+                   .all())
+
+
+def top_messages(messages=None):
+    """Best-scored recent messages from g.user and the users they follow
+    (see message_scores.py); a single page, `messages` as for
+    home_messages."""
+
+    if messages is None:
+        messages = with_authors(Message.query)
+
+    message_ids = message_scores.top_message_ids(g.user.id, PAGE_SIZE)
+    rank = {message_id: i for i, message_id in enumerate(message_ids)}
 
+    items = messages.filter(Message.id.in_(message_ids)).all()
+    items.sort(key=lambda msg: rank[msg.id])
+
+    return Page(items, None)
+
+
+def user_messages(user_id, cursor=None, messages=None):
+    """Page of messages written by this user (`messages` as for
+    home_messages)."""
+
+    if messages is None:
+        messages = with_authors(Message.query)
+
+    return paginate(messages
+                    .filter(Message.user_id == user_id),
+                    Message.timestamp, Message.id, cursor)
+
+
+def liked_messages(user_id, cursor=None, messages=None):
+    """Page of messages liked by this user (`messages` as for
+    home_messages)."""
+
+    if messages is None:
+        messages = with_authors(Message.query)
+
+    return paginate((messages
+                     .join(Likes, Likes.message_id == Message.id)
+                     .filter(Likes.user_id == user_id)),
+                    Message.timestamp, Message.id, cursor)
+
+
+@app.route('/feeds/home')
+def home_feed():
+    """Next page of the home timeline, as a list fragment."""
+
+    if not g.user:
+        abort(401)
+
+    page = home_messages(get_cursor())
+    liked_msg_ids = liked_ids(page.items)
+
+    not_modified = http_cache.check(home_versions(page, liked_msg_ids))
+    if not_modified:
+        return not_modified
+
+    return render_template('messages/_items.html',
+                           messages=page.items,
+                           liked_msg_ids=liked_msg_ids,
+                           next_page=next_page_links(page, 'homepage', 'home_feed'))
+
+
+@app.route('/feeds/users/<int:user_id>')
+def user_feed(user_id):
+    """Next page of a user's messages, as a list fragment."""
+
+    page = user_messages(user_id, get_cursor())
+
+    not_modified = http_cache.check(message_versions(page.items), public=True)
+    if not_modified:
+        return not_modified
+
+    return render_template('messages/_items.html',
+                           messages=page.items,
+                           next_page=next_page_links(page, 'show_users', 'user_feed',
+                                                     user_id=user_id))
+
+
+@app.route('/feeds/users/<int:user_id>/likes')
+def likes_feed(user_id):
+    """Next page of a user's liked messages, as a list fragment."""
+
+    if not g.user:
+        abort(401)
+
+    page = liked_messages(user_id, get_cursor())
+
+    not_modified = http_cache.check(message_versions(page.items))
+    if not_modified:
+        return not_modified
+
+    return render_template('messages/_items.html',
+                           messages=page.items,
+                           next_page=next_page_links(page, 'users_liked_messages',
+                                                     'likes_feed', user_id=user_id))
+
+
+##############################################################################
+# JSON API
+#
+# The timeline, profiles and lists above as JSON, built from row tuples of
+# just the requested fields (see api.py). Lists take the same `before`
+# cursor as the pages.
+
+
+def api_list_args():
+    """(fields, cursor) from the querystring; ValueError if either is bogus."""
+
+    fields = api.parse_fields(request.args.get('fields'), api.MESSAGE_FIELDS,
+                              api.DEFAULT_MESSAGE_FIELDS)
+    token = request.args.get('before')
+
+    return fields, decode_cursor(token) if token else None
+
+
+def api_page(page, fields, endpoint, public=False, **values):
+    """JSON response for a page of api.message_rows(), or a 304."""
+
+    items = api.messages(page.items, fields, g.user.id if g.user else None)
+
+    not_modified = http_cache.check(api.versions(page.items, items),
+                                    public=public)
+    if not_modified:
+        return not_modified
+
+    next_url = None
+    if page.before is not None:
+        next_url = url_for(endpoint, before=page.before,
+                           fields=request.args.get('fields'), **values)
+
+    return api.respond(dict(messages=items, before=page.before, next=next_url))
+
+
+@app.route('/api/timeline')
+def api_timeline():
+    """g.user's home timeline (with ?feed=top, ranked as on the homepage)."""
+
+    if not g.user:
+        return api.error("Access unauthorized.", 401)
+
+    try:
+        fields, cursor = api_list_args()
+    except ValueError as err:
+        return api.error(str(err), 400)
+
+    if request.args.get('feed') == 'top':
+        page = top_messages(api.message_rows(fields))
     else:
-        new_like = Likes(message_id=msg.id, user_id=g.user.id)
-        db.session.add(new_like)
-        db.session.commit()
+        page = home_messages(cursor, api.message_rows(fields))
+
+    return api_page(page, fields, 'api_timeline')
+
+
+@app.route('/api/users/<int:user_id>')
+def api_user(user_id):
+    """A user's profile."""
+
+    try:
+        fields = api.parse_fields(request.args.get('fields'), api.USER_FIELDS,
+                                  api.DEFAULT_USER_FIELDS)
+    except ValueError as err:
+        return api.error(str(err), 400)
+
+    row = api.user_row(user_id, fields)
+    if row is None:
+        return api.error("No such user.", 404)
+
+    not_modified = http_cache.check(tuple(row), public=True)
+    if not_modified:
+        return not_modified
+
+    return api.respond(api.user(row, fields))
+
+
+@app.route('/api/users/<int:user_id>/messages')
+def api_user_messages(user_id):
+    """Messages written by a user."""
+
+    try:
+        fields, cursor = api_list_args()
+    except ValueError as err:
+        return api.error(str(err), 400)
+
+    if api.user_row(user_id, []) is None:
+        return api.error("No such user.", 404)
+
+    page = user_messages(user_id, cursor, api.message_rows(fields))
+    return api_page(page, fields, 'api_user_messages', public=True,
+                    user_id=user_id)
+
+
+@app.route('/api/users/<int:user_id>/likes')
+def api_user_likes(user_id):
+    """Messages a user has liked."""
+
+    if not g.user:
+        return api.error("Access unauthorized.", 401)
+
+    try:
+        fields, cursor = api_list_args()
+    except ValueError as err:
+        return api.error(str(err), 400)
+
+    if api.user_row(user_id, []) is None:
+        return api.error("No such user.", 404)
+
+    page = liked_messages(user_id, cursor, api.message_rows(fields))
+    return api_page(page, fields, 'api_user_likes', user_id=user_id)
 
-    return redirect('/')
 
 ##############################################################################
 # Homepage and error pages
@@ -362,38 +946,145 @@ def homepage():
 
     - anon users: no messages
     - logged in: 100 most recent messages of followed_users
+      (older pages via the `before` cursor), or with ?feed=top their
+      best-liked recent messages
     """
     if g.user:
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
-
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        feed = request.args.get('feed')
+        if feed == 'top':
+            page = top_messages()
+        else:
+            page = home_messages(get_cursor())
+        liked_msg_ids = liked_ids(page.items)
 
-        liked_msg_ids = [msg.id for msg in g.user.likes]
+        not_modified = http_cache.check(home_versions(page, liked_msg_ids))
+        if not_modified:
+            return not_modified
 
-        return render_template('home.html', messages=messages, liked_msg_ids=liked_msg_ids)
+        return render_template('home.html', messages=page.items, feed=feed,
+                               liked_msg_ids=liked_msg_ids,
+                               next_page=next_page_links(page, 'homepage', 'home_feed'))
 
     else:
+        not_modified = http_cache.check(public=True)
+        if not_modified:
+            return not_modified
+
         return render_template('home-anon.html')
 
 
+@app.errorhandler(PasswordPoolBusy)
+def password_pool_busy(err):
+    """Too many logins/signups are already hashing: ask the client to retry."""
+
+    return "Too many requests right now; please try again.", 503, {'Retry-After': '1'}
+
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Maintenance commands
+
+
+@app.cli.command('recount')
+def recount_command():
+    """Recompute every user's and message's denormalized counters."""
+
+    counters.recount()
+    counters.recount_likes()
+    db.session.commit()
+
+
+@app.cli.command('purge-deleted')
+def purge_deleted_command():
+    """Purge the rows of deleted accounts, resuming unfinished jobs."""
+
+    finished = account_deletion.run_pending()
+    print(f"Finished {finished} deletion jobs")
+
+
+@app.cli.command('reindex-search')
+def reindex_search_command():
+    """Rebuild the user search index from scratch."""
+
+    user_search.reindex_all()
+    db.session.commit()
+
+
+@app.cli.command('rescore')
+def rescore_command():
+    """Rebuild the top feed's message scores from like counts."""
+
+    scored = message_scores.rebuild()
+    db.session.commit()
+    print(f"Scored {scored} messages")
+
+
+@app.cli.command('prune-scores')
+def prune_scores_command():
+    """Drop scores of messages too old for the top feed."""
+
+    pruned = message_scores.prune()
+    db.session.commit()
+    print(f"Pruned {pruned} scores")
+
+
+@app.cli.command('assets-build')
+def assets_build_command():
+    """Build fingerprinted, compressed copies of the static files."""
+
+    manifest = build_assets(app.static_folder, static_assets.directory)
+    print(f"Built {len(manifest)} assets into {static_assets.directory}")
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations, then rebuild data they affect."""
+
+    applied = migrations.upgrade(db.engine)
+    backfills = {name for m in applied for name in m.backfills}
+
+    if 'recount' in backfills:
+        print("Recounting counters")
+        counters.recount()
+        counters.recount_likes()
+
+    if 'reindex-search' in backfills:
+        print("Rebuilding the search index")
+        user_search.reindex_all()
+
+    if 'rescore' in backfills:
+        print("Rescoring recent messages")
+        message_scores.rebuild()
+
+    db.session.commit()
+
+
+@app.cli.command('db-status')
+def db_status_command():
+    """Show the schema version and any pending migrations."""
+
+    print(f"Schema version: {migrations.current_version(db.engine)} "
+          f"(latest {migrations.latest_version()})")
+
+    for m in migrations.pending(db.engine):
+        print(f"  pending {m.version}: {m.name}")
+
+
+@app.cli.command('db-check-indexes')
+def db_check_indexes_command():
+    """Compare the database's indexes with those declared on the models."""
+
+    report = migrations.check_indexes(db.engine)
 
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
+    for index in report['missing']:
+        print(f"missing    {index['table']}({', '.join(index['columns'])}) "
+              f"{index['name'] or ''} -- used by {index['used_by'] or '?'}")
+    for index in report['undeclared']:
+        print(f"undeclared {index['table']}({', '.join(index['columns'])}) "
+              f"{index['name'] or ''}")
+    for index in report['invalid']:
+        print(f"invalid    {index['name']} (rebuild it)")
+    for index in report['unused']:
+        print(f"unused     {index['table']}.{index['name']}")
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+    if not any(report.values()):
+        print("Indexes match the models.")
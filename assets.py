@@ -0,0 +1,203 @@
+"""Fingerprinted, precompressed static assets for Warbler.
+
+``flask assets-build`` copies every file under ``static/`` into
+``static/dist/`` with a hash of its contents in the name
+(``stylesheets/style.css`` -> ``stylesheets/style.1c9e04d2ab.css``), writes
+gzip (and, if the ``brotli`` package is installed, brotli) variants of the
+text files next to them, and records the names in ``manifest.json``.
+``url(...)`` references between assets -- the stylesheet's background
+images -- are rewritten to the hashed names.
+
+Templates link assets with ``asset_url('stylesheets/style.css')``. That
+gives the hashed file's URL under ``/assets/`` when it has been built, and
+plain ``/static/...`` otherwise, so development needs no build. Stored
+``/static/...`` paths (the default profile images) can be passed as they
+are; other URLs are returned unchanged.
+
+A hashed name never changes contents, so ``/assets/`` files are sent with
+``Cache-Control: immutable`` and a one-year max-age, picking the smallest
+variant the client accepts. Old builds are left in place for pages still
+cached with their names; the manifest is read when the app starts.
+
+Config:
+
+    ASSETS_DIR      where built assets and the manifest live (static/dist)
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import abort, request, safe_join, send_file, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Text formats worth compressing; images are compressed already
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt', '.html'}
+
+# (Content-Encoding, suffix), best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def hashed_name(path, data):
+    stem, ext = posixpath.splitext(path)
+    return f"{stem}.{content_hash(data)}{ext}"
+
+
+def _rewrite_css(path, css, manifest):
+    """Point a stylesheet's url(...)s at hashed names, relative to it."""
+
+    def replace(match):
+        quote, url = match.groups()
+        target = url[len('/static/'):] if url.startswith('/static/') else (
+            posixpath.normpath(posixpath.join(posixpath.dirname(path), url)))
+
+        if target not in manifest:
+            return match.group(0)
+
+        relative = posixpath.relpath(manifest[target], posixpath.dirname(path))
+        return f"url({quote}{relative}{quote})"
+
+    return _CSS_URL.sub(replace, css)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _compress(path, data):
+    """Write .gz/.br variants of `path` where they're smaller."""
+
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data)))
+
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            _write(path + suffix, compressed)
+
+
+def build(static_dir, out_dir):
+    """Build hashed copies of the files in `static_dir` into `out_dir`;
+    returns the manifest (source path -> hashed path)."""
+
+    out_abs = os.path.abspath(out_dir)
+    sources = []
+
+    for directory, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs
+                         if os.path.abspath(os.path.join(directory, d)) != out_abs)
+        for name in sorted(files):
+            full = os.path.join(directory, name)
+            sources.append(os.path.relpath(full, static_dir).replace(os.sep, '/'))
+
+    # stylesheets last, so the files they refer to are already named
+    sources.sort(key=lambda path: (path.endswith('.css'), path))
+    manifest = {}
+
+    for path in sources:
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            data = f.read()
+
+        if path.endswith('.css'):
+            data = _rewrite_css(path, data.decode('utf-8'), manifest).encode('utf-8')
+
+        manifest[path] = hashed_name(path, data)
+        target = os.path.join(out_dir, manifest[path])
+
+        if not os.path.exists(target):
+            _write(target, data)
+            if posixpath.splitext(path)[1] in COMPRESSIBLE:
+                _compress(target, data)
+
+    _write(os.path.join(out_dir, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+    return manifest
+
+
+class Assets:
+    """Flask extension serving built assets and the asset_url() helper."""
+
+    def __init__(self, app=None):
+        self.manifest = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_DIR', os.path.join(app.static_folder, 'dist'))
+
+        self.app = app
+        self.directory = app.config['ASSETS_DIR']
+        self.load()
+
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
+
+    def load(self):
+        """(Re)read the manifest, if assets have been built."""
+
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def url(self, path):
+        """URL for the static file `path` (hashed, if built)."""
+
+        if path is None:
+            return path
+
+        if path.startswith('/static/'):
+            path = path[len('/static/'):]
+        elif '//' in path or path.startswith('/'):
+            return path
+
+        if path in self.manifest:
+            return url_for('assets', filename=self.manifest[path])
+
+        return url_for('static', filename=path)
+
+    def serve(self, filename):
+        """Send a built asset, precompressed if the client accepts it."""
+
+        path = safe_join(self.directory, filename)
+        if filename == MANIFEST or not os.path.isfile(path):
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, name
+                break
+
+        response = send_file(path, mimetype=mimetype, conditional=True)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+        return response
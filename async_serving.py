@@ -0,0 +1,119 @@
+"""Cooperative (gevent) serving mode for Warbler's read-heavy pages.
+
+    python async_serving.py --port 5001
+
+patches the standard library with gevent, and psycopg2 with psycogreen,
+before the app is imported, then serves it with gevent's WSGI server. Each
+request runs in a greenlet; while one waits on PostgreSQL the others carry
+on, so a single process keeps many timeline requests in flight. The
+models, templates and views are the same ones the sync workers run.
+
+Concurrency is given to the endpoints in ``ASYNC_ENDPOINTS`` (the timelines,
+profiles and likes pages and their JSON API by default), up to
+``ASYNC_READ_CONCURRENCY`` at once -- keep that within the pool's
+``DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW`` so requests wait here rather than
+time out on the pool. Anything else
+(forms, writes, login's bcrypt check) runs at most
+``ASYNC_OTHER_CONCURRENCY`` at a time; in production, route those to the
+sync workers and only the read-heavy paths to this process.
+
+Only PostgreSQL (psycopg2) gets a cooperative driver. With SQLite every
+query blocks the whole process, so this mode only helps on PostgreSQL.
+
+Needs ``pip install gevent psycogreen``.
+"""
+
+import argparse
+import os
+import sys
+
+ASYNC_ENDPOINTS = ['homepage', 'home_feed', 'show_users', 'user_feed',
+                   'users_liked_messages', 'likes_feed', 'static',
+                   'api_timeline', 'api_user', 'api_user_messages',
+                   'api_user_likes']
+
+
+def install(app):
+    """Limit concurrent requests per endpoint class, as described above.
+
+    Call after monkey-patching, so that the semaphores are gevent's.
+    """
+
+    import threading
+    from flask import g, request
+
+    app.config.setdefault('ASYNC_ENDPOINTS', ASYNC_ENDPOINTS)
+    app.config.setdefault('ASYNC_READ_CONCURRENCY', 15)
+    app.config.setdefault('ASYNC_OTHER_CONCURRENCY', 1)
+
+    reads = threading.BoundedSemaphore(app.config['ASYNC_READ_CONCURRENCY'])
+    others = threading.BoundedSemaphore(app.config['ASYNC_OTHER_CONCURRENCY'])
+    allowed = frozenset(app.config['ASYNC_ENDPOINTS'])
+
+    def take_slot():
+        slot = reads if request.endpoint in allowed else others
+        slot.acquire()
+        g.async_slot = slot
+
+    def release_slot(exc):
+        slot = g.pop('async_slot', None)
+        if slot is not None:
+            slot.release()
+
+    # first, so that nothing touches the database before a slot is held
+    app.before_request_funcs.setdefault(None, []).insert(0, take_slot)
+    app.teardown_request(release_slot)
+
+    return reads, others
+
+
+def patch():
+    """Make the standard library and psycopg2 cooperative."""
+
+    try:
+        from gevent import monkey
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        sys.exit("async serving needs gevent and psycogreen: "
+                 "pip install gevent psycogreen")
+
+    monkey.patch_all()
+    patch_psycopg()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve Warbler's read-heavy pages with gevent.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--endpoints',
+                        type=lambda s: [name for name in s.split(',') if name],
+                        help="comma-separated endpoints to serve concurrently")
+    parser.add_argument('--read-concurrency', type=int)
+    parser.add_argument('--other-concurrency', type=int)
+    args = parser.parse_args()
+
+    patch()
+
+    from gevent.pywsgi import WSGIServer
+    from app import app
+
+    for key, value in [('ASYNC_ENDPOINTS', args.endpoints),
+                       ('ASYNC_READ_CONCURRENCY', args.read_concurrency),
+                       ('ASYNC_OTHER_CONCURRENCY', args.other_concurrency)]:
+        if value is not None:
+            app.config[key] = value
+
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        print("warning: SQLite queries block the event loop; "
+              "use PostgreSQL for concurrency", file=sys.stderr)
+
+    install(app)
+
+    print(f"serving on http://{args.host}:{args.port} (pid {os.getpid()})",
+          file=sys.stderr)
+    WSGIServer((args.host, args.port), app, log=None).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
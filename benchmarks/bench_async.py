@@ -0,0 +1,218 @@
+"""Compare throughput of the sync and async (gevent) serving modes.
+
+Seeds a dataset the way bench_routes.py does, then starts two servers on
+the same database:
+
+- sync: one single-threaded WSGI process, as a sync worker serves,
+- async: async_serving.py, one gevent process,
+
+and drives the read-heavy routes on each with the same number of
+concurrent clients (logged in as a busy user), reporting throughput and
+latency side by side:
+
+    python benchmarks/bench_async.py --database-url postgresql:///warbler-bench \\
+        --users 1000 --concurrency 50 --duration 10
+
+The database is dropped and re-seeded. Only PostgreSQL has a cooperative
+driver; on the default throwaway SQLite file the two modes should match.
+Needs gevent and psycogreen for the async server.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+from bench_routes import ROOT, git_commit, percentile, pick_users, seed
+
+# Routes to load; {user} is the profile being viewed.
+ROUTES = [
+    ('home', '/'),
+    ('user_profile', '/users/{user}'),
+    ('user_likes', '/users/{user}/likes'),
+]
+
+
+def serve_sync(port):
+    """Serve the app one request at a time, like a sync worker."""
+
+    from wsgiref.simple_server import WSGIRequestHandler, make_server
+    from app import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    make_server('127.0.0.1', port, app, handler_class=QuietHandler).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, args):
+    if mode == 'sync':
+        cmd = [sys.executable, os.path.abspath(__file__), '--serve-sync', str(port)]
+    else:
+        cmd = [sys.executable, os.path.join(ROOT, 'async_serving.py'),
+               '--port', str(port),
+               '--read-concurrency', str(args.concurrency)]
+
+    proc = subprocess.Popen(cmd, cwd=ROOT)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{mode} server exited with {proc.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+
+    proc.kill()
+    raise RuntimeError(f"{mode} server didn't start")
+
+
+def load(url, cookie, concurrency, duration):
+    """GET `url` from `concurrency` threads for `duration` seconds."""
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        mine = []
+        while time.perf_counter() < deadline:
+            req = urllib.request.Request(url, headers={'Cookie': cookie})
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=30) as resp:
+                    resp.read()
+                mine.append(time.perf_counter() - t0)
+            except OSError as err:
+                with lock:
+                    errors.append(str(err))
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return dict(requests=len(latencies),
+                errors=len(errors),
+                requests_per_sec=len(latencies) / elapsed,
+                p50_ms=(percentile(latencies, 50) or 0) * 1000,
+                p95_ms=(percentile(latencies, 95) or 0) * 1000)
+
+
+def run(args):
+    from app import app, db, CURR_USER_KEY
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        print(f"seeding {args.users} users...", file=sys.stderr)
+        seed(db, args.users, args, data_dir)
+
+    viewer_id, profile_id = pick_users(db)
+    db.session.remove()
+    db.engine.dispose()
+
+    session = app.session_interface.get_signing_serializer(app).dumps(
+        {CURR_USER_KEY: viewer_id})
+    cookie = f"{app.session_cookie_name}={session}"
+
+    results = []
+
+    for mode in ('sync', 'async'):
+        port = free_port()
+        proc = start_server(mode, port, args)
+
+        try:
+            for name, path in ROUTES:
+                url = f"http://127.0.0.1:{port}{path.format(user=profile_id)}"
+                load(url, cookie, 1, 1)  # warm up
+                result = load(url, cookie, args.concurrency, args.duration)
+                result.update(mode=mode, route=name)
+                results.append(result)
+
+                print(f"{mode:<6} {name:<14} {result['requests_per_sec']:8.1f} req/s "
+                      f"p50 {result['p50_ms']:8.2f}ms p95 {result['p95_ms']:8.2f}ms "
+                      f"{result['errors']} errors", file=sys.stderr)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    return dict(commit=git_commit(),
+                created=datetime.utcnow().isoformat(),
+                database=db.engine.dialect.name,
+                users=args.users,
+                concurrency=args.concurrency,
+                duration=args.duration,
+                results=results)
+
+
+def summarize(report):
+    by_key = {(r['mode'], r['route']): r for r in report['results']}
+
+    print(f"{'route':<14} {'sync req/s':>11} {'async req/s':>12} {'speedup':>8}")
+    for name, _ in ROUTES:
+        sync, async_ = by_key[('sync', name)], by_key[('async', name)]
+        speedup = (async_['requests_per_sec'] / sync['requests_per_sec']
+                   if sync['requests_per_sec'] else float('nan'))
+        print(f"{name:<14} {sync['requests_per_sec']:11.1f} "
+              f"{async_['requests_per_sec']:12.1f} {speedup:7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare Warbler's sync and async serving modes.")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages-per-user', type=int, default=10)
+    parser.add_argument('--follows-per-user', type=int, default=20)
+    parser.add_argument('--likes-per-user', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help="concurrent clients per route")
+    parser.add_argument('--duration', type=float, default=10,
+                        help="seconds of load per route and mode")
+    parser.add_argument('--database-url',
+                        help="database to (re)seed; default: temporary SQLite")
+    parser.add_argument('-o', '--output', default='bench_async.json')
+    parser.add_argument('--serve-sync', type=int, metavar='PORT',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_sync:
+        serve_sync(args.serve_sync)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = (
+            args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+
+        report = run(args)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    summarize(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""Benchmark Warbler's read routes against growing datasets.
+
+For each dataset size this generates sample data (generator/create_csvs.py),
+loads it into a fresh schema (bulk_load.py), then drives each route through
+the Flask test client as a logged-in user, recording latency percentiles,
+throughput and SQL statements per request.
+
+Results are written as JSON tagged with the current git commit, so runs can
+be compared across commits:
+
+    python benchmarks/bench_routes.py --sizes 1000,10000 -o before.json
+    ... change things ...
+    python benchmarks/bench_routes.py --sizes 1000,10000 -o after.json \\
+        --compare before.json
+
+By default each run uses a throwaway SQLite file; pass --database-url to
+benchmark against PostgreSQL (the database is dropped and re-seeded).
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'generator')]
+
+# Routes to time; {user} is the profile being viewed.
+ROUTES = [
+    ('home', '/'),
+    ('users', '/users'),
+    ('user_profile', '/users/{user}'),
+    ('user_likes', '/users/{user}/likes'),
+    ('user_followers', '/users/{user}/followers'),
+]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class QueryCounter:
+    """Counts SQL statements sent through an engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def seed(db, size, args, data_dir):
+    """Generate and load a dataset with `size` users."""
+
+    import bulk_load
+    import counters
+    from create_csvs import generate
+
+    generate(dict(users=size,
+                  messages=size * args.messages_per_user,
+                  follows=size * args.follows_per_user,
+                  likes=size * args.likes_per_user,
+                  seed=args.seed,
+                  end=datetime(2024, 1, 1)),
+             out_dir=data_dir)
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    bulk_load.load_all(db.engine, data_dir)
+    counters.recount()
+    counters.recount_likes()
+    db.session.commit()
+
+
+def pick_users(db):
+    """The viewer (follows the most people) and a busy profile to view."""
+
+    from models import User
+
+    viewer = User.query.order_by(User.following_count.desc(), User.id).first()
+    profile = User.query.order_by(User.followers_count.desc(), User.id).first()
+    return viewer.id, profile.id
+
+
+def time_route(client, counter, url, requests, warmup):
+    """Request `url` repeatedly; returns a result dict."""
+
+    for _ in range(warmup):
+        client.get(url)
+
+    latencies = []
+    queries = 0
+    started = time.perf_counter()
+
+    for _ in range(requests):
+        counter.count = 0
+        t0 = time.perf_counter()
+        resp = client.get(url)
+        latencies.append(time.perf_counter() - t0)
+        queries += counter.count
+
+        if resp.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {resp.status_code}")
+
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    return dict(p50_ms=percentile(latencies, 50) * 1000,
+                p95_ms=percentile(latencies, 95) * 1000,
+                p99_ms=percentile(latencies, 99) * 1000,
+                mean_ms=sum(latencies) / len(latencies) * 1000,
+                requests_per_sec=requests / elapsed,
+                queries_per_request=queries / requests)
+
+
+def run(args):
+    from app import app, db, CURR_USER_KEY
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    counter = QueryCounter(db.engine)
+    results = []
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as data_dir:
+            print(f"seeding {size} users...", file=sys.stderr)
+            seed(db, size, args, data_dir)
+
+        viewer_id, profile_id = pick_users(db)
+        db.session.remove()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = viewer_id
+
+            for name, path in ROUTES:
+                url = path.format(user=profile_id)
+                result = time_route(client, counter, url,
+                                    args.requests, args.warmup)
+                result.update(route=name, url=url, users=size)
+                results.append(result)
+
+                print(f"{size:>9} {name:<16} p50 {result['p50_ms']:8.2f}ms "
+                      f"p95 {result['p95_ms']:8.2f}ms "
+                      f"p99 {result['p99_ms']:8.2f}ms "
+                      f"{result['requests_per_sec']:8.1f} req/s "
+                      f"{result['queries_per_request']:6.1f} queries",
+                      file=sys.stderr)
+
+    return dict(commit=git_commit(),
+                created=datetime.utcnow().isoformat(),
+                python=platform.python_version(),
+                database=db.engine.dialect.name,
+                requests=args.requests,
+                results=results)
+
+
+def compare(old, new):
+    """Print p50/p95 and query count changes between two result files."""
+
+    before = {(r['users'], r['route']): r for r in old['results']}
+
+    print(f"comparing {old.get('commit')} -> {new.get('commit')}")
+    for r in new['results']:
+        o = before.get((r['users'], r['route']))
+        if o is None:
+            continue
+        print(f"{r['users']:>9} {r['route']:<16} "
+              f"p50 {o['p50_ms']:8.2f} -> {r['p50_ms']:8.2f}ms  "
+              f"p95 {o['p95_ms']:8.2f} -> {r['p95_ms']:8.2f}ms  "
+              f"queries {o['queries_per_request']:5.1f} -> "
+              f"{r['queries_per_request']:5.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Warbler routes.")
+    parser.add_argument('--sizes', default='300,3000',
+                        type=lambda s: [int(n) for n in s.split(',')],
+                        help="comma-separated user counts to sweep")
+    parser.add_argument('--messages-per-user', type=int, default=10)
+    parser.add_argument('--follows-per-user', type=int, default=20)
+    parser.add_argument('--likes-per-user', type=int, default=30)
+    parser.add_argument('--requests', type=int, default=50,
+                        help="timed requests per route and size")
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url',
+                        help="database to (re)seed; default: temporary SQLite")
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    parser.add_argument('--compare', help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = (
+            args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+
+        report = run(args)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Stream CSV files into the Warbler database.
+
+Rows are never all held in memory: on PostgreSQL each file is streamed
+straight into ``COPY ... FROM STDIN``; elsewhere it is read and inserted in
+``chunk_size`` batches with executemany. Secondary (non-unique) indexes can
+be dropped for the load and rebuilt afterwards, which is much faster than
+maintaining them row by row.
+
+Run it directly to load the CSVs from generator/ into an existing schema
+(then ``flask recount`` and ``flask reindex-search`` to rebuild derived
+data; seed.py does all of this from scratch):
+
+    python bulk_load.py --dir generator --chunk-size 20000
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import DateTime, Integer, inspect
+
+from models import db, User, Message, Follows, Likes
+
+CHUNK_SIZE = 10000
+
+# CSV file name -> table, in foreign-key order
+LOAD_ORDER = [
+    ('users.csv', User.__table__),
+    ('messages.csv', Message.__table__),
+    ('follows.csv', Follows.__table__),
+    ('likes.csv', Likes.__table__),
+]
+
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                     '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+class Progress:
+    """Prints rows/sec for a load every `every` seconds and at the end."""
+
+    def __init__(self, name, every=2.0, out=sys.stderr):
+        self.name = name
+        self.every = every
+        self.out = out
+        self.rows = 0
+        self.start = self.last = time.perf_counter()
+
+    def add(self, rows, force=False):
+        self.rows += rows
+        now = time.perf_counter()
+
+        if force or now - self.last >= self.every:
+            self.last = now
+            rate = self.rows / max(now - self.start, 1e-9)
+            print(f"{self.name}: {self.rows} rows ({rate:,.0f} rows/s)",
+                  file=self.out)
+
+
+def parse_timestamp(text):
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognized timestamp: {text!r}")
+
+
+def _converters(table, columns):
+    """Per-column functions turning CSV strings into DB-API values."""
+
+    def convert(column):
+        if isinstance(column.type, DateTime):
+            parse = parse_timestamp
+        elif isinstance(column.type, Integer):
+            parse = int
+        elif column.nullable:
+            # as COPY reads an unquoted empty field
+            return lambda value: value if value != '' else None
+        else:
+            return lambda value: value
+        return lambda value: parse(value) if value != '' else None
+
+    return [convert(table.c[name]) for name in columns]
+
+
+def secondary_indexes(table):
+    """Indexes on `table` that can be dropped during a load."""
+
+    return [index for index in table.indexes if not index.unique]
+
+
+def copy_csv(connection, table, path, progress):
+    """Stream a CSV into `table` with PostgreSQL COPY."""
+
+    preparer = connection.dialect.identifier_preparer
+
+    with open(path, newline='') as f:
+        columns = next(csv.reader([f.readline()]))
+        sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+            preparer.format_table(table),
+            ', '.join(preparer.quote(col) for col in columns))
+
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(sql, f, size=1 << 20)
+            progress.add(cursor.rowcount, force=True)
+        finally:
+            cursor.close()
+
+
+def insert_csv(connection, table, path, progress, chunk_size=CHUNK_SIZE):
+    """Insert a CSV into `table` in executemany batches of `chunk_size`."""
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        converters = _converters(table, columns)
+        insert = table.insert()
+
+        while True:
+            chunk = [
+                {col: conv(value)
+                 for col, conv, value in zip(columns, converters, row)}
+                for row in islice(reader, chunk_size)
+            ]
+            if not chunk:
+                break
+
+            connection.execute(insert, chunk)
+            progress.add(len(chunk))
+
+    progress.add(0, force=True)
+
+
+def load_csv(engine, table, path, chunk_size=CHUNK_SIZE, rebuild_indexes=True):
+    """Load one CSV into `table` in its own transaction; returns row count."""
+
+    progress = Progress(table.name)
+    indexes = secondary_indexes(table) if rebuild_indexes else []
+
+    try:
+        _load_csv(engine, table, path, chunk_size, indexes, progress)
+    except Exception:
+        # SQLite commits DDL as it goes, so dropped indexes outlive the
+        # rollback
+        if indexes:
+            _restore_indexes(engine, table, indexes)
+        raise
+
+    return progress.rows
+
+
+def _load_csv(engine, table, path, chunk_size, indexes, progress):
+    with engine.begin() as connection:
+        for index in indexes:
+            index.drop(connection)
+
+        if connection.dialect.name == 'postgresql':
+            copy_csv(connection, table, path, progress)
+        else:
+            insert_csv(connection, table, path, progress, chunk_size)
+
+        for index in indexes:
+            started = time.perf_counter()
+            index.create(connection)
+            print(f"{table.name}: rebuilt {index.name} in "
+                  f"{time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        if connection.dialect.name == 'postgresql':
+            connection.execute("ANALYZE {}".format(
+                connection.dialect.identifier_preparer.format_table(table)))
+
+
+def _restore_indexes(engine, table, indexes):
+    """Create those of `indexes` that `table` no longer has."""
+
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+
+    for index in indexes:
+        if index.name not in existing:
+            index.create(engine)
+
+
+def load_all(engine, directory='generator', chunk_size=CHUNK_SIZE,
+             rebuild_indexes=True):
+    """Load every CSV in LOAD_ORDER found in `directory`."""
+
+    counts = {}
+
+    for filename, table in LOAD_ORDER:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            counts[table.name] = load_csv(engine, table, path, chunk_size,
+                                          rebuild_indexes)
+
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--dir', default='generator',
+                        help="directory holding users.csv etc.")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="rows per executemany batch (non-PostgreSQL)")
+    parser.add_argument('--keep-indexes', action='store_true',
+                        help="don't drop and rebuild secondary indexes")
+    args = parser.parse_args()
+
+    from app import app  # noqa: F401 (configures db)
+
+    load_all(db.engine, args.dir, args.chunk_size, not args.keep_indexes)
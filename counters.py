@@ -0,0 +1,87 @@
+"""Denormalized per-user counts for Warbler.
+
+Profile and home cards show how many messages, follows, followers and likes
+a user has. Rather than loading those collections to count them, the counts
+live on the ``users`` row and are adjusted by the write paths in app.py.
+
+``recount`` rebuilds them from the underlying tables, and ``recount_likes``
+does the same for per-message like counts (normally kept by like_counts.py);
+both run as the ``flask recount`` command for repairing drift (e.g. after a
+bulk load).
+
+None of these functions commit; they run inside the caller's transaction.
+"""
+
+from sqlalchemy import func, select
+
+from models import db, User, Message, Follows, Likes
+
+users = User.__table__
+messages = Message.__table__
+follows = Follows.__table__
+likes = Likes.__table__
+
+COUNTERS = ('messages_count', 'following_count',
+            'followers_count', 'likes_count')
+
+
+def bump(user_id, **deltas):
+    """Adjust counters on one user, e.g. ``bump(5, likes_count=-1)``."""
+
+    values = {}
+
+    for name, delta in deltas.items():
+        if name not in COUNTERS:
+            raise ValueError(f"Unknown counter: {name}")
+        values[name] = users.c[name] + delta
+
+    db.session.execute(users.update()
+                       .where(users.c.id == user_id)
+                       .values(**values))
+
+
+def forget_message(message_id):
+    """Adjust counters before a message (and the likes on it) is deleted."""
+
+    likers = select([likes.c.user_id]).where(likes.c.message_id == message_id)
+
+    db.session.execute(users.update()
+                       .where(users.c.id.in_(likers))
+                       .values(likes_count=users.c.likes_count - 1))
+
+
+def _count(table, column, key=users.c.id):
+    """Correlated COUNT(*) of `table` rows whose `column` is `key`."""
+
+    return (select([func.count()])
+            .select_from(table)
+            .where(column == key)
+            .as_scalar())
+
+
+def recount(user_ids=None):
+    """Recompute counters from scratch, for all users or just `user_ids`."""
+
+    stmt = users.update().values(
+        messages_count=_count(messages, messages.c.user_id),
+        following_count=_count(follows, follows.c.user_following_id),
+        followers_count=_count(follows, follows.c.user_being_followed_id),
+        likes_count=_count(likes, likes.c.user_id),
+    )
+
+    if user_ids is not None:
+        stmt = stmt.where(users.c.id.in_(user_ids))
+
+    db.session.execute(stmt)
+
+
+def recount_likes(message_ids=None):
+    """Recompute messages' like counts, for all or just `message_ids`."""
+
+    stmt = messages.update().values(
+        likes_count=_count(likes, likes.c.message_id, messages.c.id))
+
+    if message_ids is not None:
+        stmt = stmt.where(messages.c.id.in_(message_ids))
+
+    db.session.execute(stmt)
@@ -0,0 +1,180 @@
+"""Cache of rendered message cards.
+
+A message card (author avatar and name, date and text) looks the same to
+every viewer, and messages are never edited, so ``FragmentCache`` renders
+each one once and keeps the HTML in a bounded in-process LRU, optionally
+backed by a shared Redis cache so that other workers can reuse it.
+
+Entries are keyed by message id and stamped with what the card shows of its
+author (username and image) plus the template version; when the author
+changes either, the stamp no longer matches and the card is re-rendered.
+Deleted messages are dropped with ``invalidate``.
+
+The per-viewer bits are layered on afterwards: cards are cached with a
+marker where the "liked" heart goes, and ``message_card`` fills it in for
+the current viewer. The like button itself sits outside the card, in
+messages/_items.html.
+
+Config:
+
+    FRAGMENT_CACHE_SIZE     cards kept in process (10000)
+    FRAGMENT_CACHE_URL      redis:// URL of a shared cache (none)
+    FRAGMENT_CACHE_TTL      seconds cards live in the shared cache (86400)
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+from http_cache import templates_version
+
+try:
+    import redis
+except ImportError:  # only needed for FRAGMENT_CACHE_URL
+    redis = None
+
+CARD_TEMPLATE = 'messages/_card.html'
+
+# Where the viewer's heart goes in a cached card
+VIEWER_MARKER = '<!--viewer-->'
+LIKED_HEART = '<i class="bi bi-heart" style="font-style:normal">&#128155;</i>'
+
+
+class RedisBackend:
+    """Shared card storage in Redis, one key per message."""
+
+    def __init__(self, url, ttl, prefix='warbler:card:'):
+        if redis is None:
+            raise RuntimeError(
+                "FRAGMENT_CACHE_URL needs the redis package (pip install redis)")
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, message_id):
+        value = self.client.get(f"{self.prefix}{message_id}")
+        if value is None:
+            return None
+
+        stamp, _, html = value.decode('utf-8').partition('\n')
+        return stamp, html
+
+    def put(self, message_id, stamp, html):
+        self.client.set(f"{self.prefix}{message_id}", f"{stamp}\n{html}",
+                        ex=self.ttl)
+
+    def delete(self, message_id):
+        self.client.delete(f"{self.prefix}{message_id}")
+
+
+class FragmentCache:
+    """Flask extension caching rendered message cards."""
+
+    def __init__(self, app=None):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.backend = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000)
+        app.config.setdefault('FRAGMENT_CACHE_URL', None)
+        app.config.setdefault('FRAGMENT_CACHE_TTL', 86400)
+
+        self.app = app
+        self.maxsize = app.config['FRAGMENT_CACHE_SIZE']
+        self.version = templates_version(app)
+
+        if app.config['FRAGMENT_CACHE_URL']:
+            self.backend = RedisBackend(app.config['FRAGMENT_CACHE_URL'],
+                                        app.config['FRAGMENT_CACHE_TTL'])
+
+        app.jinja_env.globals['message_card'] = self.message_card
+
+    def stamp(self, msg):
+        """What the cached card for `msg` depends on besides the message."""
+
+        parts = (self.version, msg.user.username, msg.user.image_url)
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+
+    def _get_local(self, message_id, stamp):
+        with self._lock:
+            entry = self._entries.get(message_id)
+
+            if entry is None or entry[0] != stamp:
+                return None
+
+            self._entries.move_to_end(message_id)
+            return entry[1]
+
+    def _put_local(self, message_id, stamp, html):
+        with self._lock:
+            self._entries[message_id] = (stamp, html)
+            self._entries.move_to_end(message_id)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def card(self, msg):
+        """The viewer-independent HTML for `msg`, rendering it if need be."""
+
+        stamp = self.stamp(msg)
+        html = self._get_local(msg.id, stamp)
+
+        if html is None and self.backend is not None:
+            shared = self.backend.get(msg.id)
+            if shared is not None and shared[0] == stamp:
+                html = shared[1]
+                self._put_local(msg.id, stamp, html)
+
+        with self._lock:
+            if html is not None:
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        html = self.app.jinja_env.get_template(CARD_TEMPLATE).render(msg=msg)
+        self._put_local(msg.id, stamp, html)
+
+        if self.backend is not None:
+            self.backend.put(msg.id, stamp, html)
+
+        return html
+
+    def message_card(self, msg, liked=False):
+        """Jinja global: the card for `msg` with the viewer's heart filled in."""
+
+        html = self.card(msg)
+        return Markup(html.replace(VIEWER_MARKER, LIKED_HEART if liked else ''))
+
+    def invalidate(self, message_id):
+        """Forget the card for a (deleted) message."""
+
+        with self._lock:
+            self._entries.pop(message_id, None)
+
+        if self.backend is not None:
+            self.backend.delete(message_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counts of hits, misses, evictions and current size."""
+
+        with self._lock:
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        evictions=self.evictions,
+                        size=len(self._entries))
@@ -2,29 +2,59 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for capacity tests:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 50000000 --likes 80000000 --processes 8
+
+Generation runs offline and is deterministic: the same --seed, sizes and
+--end date always produce the same files, however many processes are used.
+Rows are produced in fixed-size shards by a pool of worker processes and
+streamed to disk, so memory use doesn't grow with the output.
+
+Follows and likes follow power laws: a few users are followed by (and post
+and like) far more than most, and a few messages collect most of the likes.
+
+Rows refer to users and messages by their line number, so load the files
+into empty tables (seed.py does).
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import random
+import shutil
+from datetime import datetime
+from multiprocessing import Pool
+
 from faker import Faker
-from helpers import get_random_datetime
+
+from helpers import ZipfSampler, get_random_datetime, heavy_tailed_count
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
+NUM_LIKES = 3000
 
-fake = Faker()
+# Rows per shard; each shard is generated by one worker from its own seed.
+SHARD_SIZE = 50000
 
-# Generate random profile image URLs to use for users
+# Power-law exponents for how popular users and messages are.
+FOLLOW_ALPHA = 1.0
+POST_ALPHA = 0.8
+LIKE_ALPHA = 1.1
+
+# Bcrypt hash of "password".
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Profile and header image URLs to use for users (not fetched here)
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +62,174 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
+    f"https://picsum.photos/seed/warbler{i}/1200/400"
     for i in range(1, 46)
-]
+] + ["/static/images/warbler-hero.jpg"]
+
+
+def shard_seed(seed, kind, index):
+    """A seed for one shard that doesn't depend on the process count."""
+
+    return f"{seed}:{kind}:{index}"
+
+
+def make_faker(seed):
+    fake = Faker()
+    fake.seed_instance(seed)
+    return fake
+
+
+def write_users(rng, fake, start, stop, writer, config):
+    for user_id in range(start, stop):
+        username = f"{fake.user_name()}{user_id}"
+        writer.writerow([
+            f"{username}@{fake.free_email_domain()}",
+            username,
+            rng.choice(image_urls),
+            PASSWORD,
+            fake.sentence(),
+            rng.choice(header_image_urls),
+            fake.city(),
+        ])
+
+
+def write_messages(rng, fake, start, stop, writer, config):
+    authors = ZipfSampler(config['users'], POST_ALPHA, salt=config['seed'])
+    sentences = [fake.sentence() for _ in range(2000)]
+
+    for _ in range(start, stop):
+        text = ' '.join(rng.choice(sentences)
+                        for _ in range(rng.randint(1, 3)))
+        writer.writerow([
+            text[:MAX_WARBLER_LENGTH],
+            get_random_datetime(rng=rng, now=config['end']),
+            authors(rng),
+        ])
+
+
+def write_follows(rng, fake, start, stop, writer, config):
+    """Follows for followers start..stop-1, each following distinct users."""
+
+    num_users = config['users']
+    mean = config['follows'] / num_users
+    popular = ZipfSampler(num_users, FOLLOW_ALPHA, salt=config['seed'] + 1)
+
+    for follower in range(start, stop):
+        wanted = heavy_tailed_count(rng, mean, num_users - 1)
+        followed = set()
+
+        # popular users are drawn repeatedly; stop trying after a while
+        for _ in range(wanted * 4):
+            if len(followed) >= wanted:
+                break
+            user_id = popular(rng)
+            if user_id != follower:
+                followed.add(user_id)
+
+        for user_id in sorted(followed):
+            writer.writerow([user_id, follower])
+
+
+def write_likes(rng, fake, start, stop, writer, config):
+    """Likes by users start..stop-1, each of distinct messages."""
+
+    num_messages = config['messages']
+    mean = config['likes'] / config['users']
+    popular = ZipfSampler(num_messages, LIKE_ALPHA, salt=config['seed'] + 2)
+
+    for user_id in range(start, stop):
+        wanted = heavy_tailed_count(rng, mean, num_messages)
+        liked = set()
+
+        for _ in range(wanted * 4):
+            if len(liked) >= wanted:
+                break
+            liked.add(popular(rng))
+
+        for message_id in sorted(liked):
+            writer.writerow([user_id, message_id])
+
+
+WRITERS = {
+    'users': (write_users, USERS_CSV_HEADERS),
+    'messages': (write_messages, MESSAGES_CSV_HEADERS),
+    'follows': (write_follows, FOLLOWS_CSV_HEADERS),
+    'likes': (write_likes, LIKES_CSV_HEADERS),
+}
+
+
+def run_shard(job):
+    """Write one shard to its part file (runs in a worker process)."""
+
+    kind, index, start, stop, path, config = job
+    seed = shard_seed(config['seed'], kind, index)
+    write, _ = WRITERS[kind]
+
+    with open(path, 'w', newline='') as part:
+        write(random.Random(seed), make_faker(seed),
+              start, stop, csv.writer(part), config)
+
+    return path
+
+
+def shards(kind, count, out_dir, config):
+    """Jobs covering rows (or users, for follows/likes) 1..count."""
+
+    return [
+        (kind, index, start, min(start + SHARD_SIZE, count + 1),
+         os.path.join(out_dir, f".{kind}.{index:06d}.part"), config)
+        for index, start in enumerate(range(1, count + 1, SHARD_SIZE))
+    ]
+
+
+def generate(config, out_dir='generator', processes=None):
+    """Write users.csv, messages.csv, follows.csv and likes.csv."""
+
+    sizes = dict(users=config['users'],
+                 messages=config['messages'],
+                 follows=config['users'],
+                 likes=config['users'] if config['likes'] and config['messages'] else 0)
+
+    jobs = {kind: shards(kind, size, out_dir, config)
+            for kind, size in sizes.items()}
+
+    with Pool(processes) as pool:
+        results = {kind: pool.map_async(run_shard, kind_jobs)
+                   for kind, kind_jobs in jobs.items()}
+
+        for kind, result in results.items():
+            with open(os.path.join(out_dir, f"{kind}.csv"), 'w', newline='') as out:
+                csv.writer(out).writerow(WRITERS[kind][1])
+
+                for path in result.get():
+                    with open(path, newline='') as part:
+                        shutil.copyfileobj(part, out)
+                    os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Generate Warbler sample data as CSV files.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS,
+                        help="approximate total number of follows")
+    parser.add_argument('--likes', type=int, default=NUM_LIKES,
+                        help="approximate total number of likes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', default=datetime.now().strftime('%Y-%m-%d'),
+                        help="latest message date, YYYY-MM-DD (default today)")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument('--out-dir', default='generator')
+    args = parser.parse_args()
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+    generate(dict(users=args.users,
+                  messages=args.messages,
+                  follows=args.follows,
+                  likes=args.likes,
+                  seed=args.seed,
+                  end=datetime.strptime(args.end, '%Y-%m-%d')),
+             out_dir=args.out_dir,
+             processes=args.processes)
@@ -1,14 +1,58 @@
 """Support functions for CSV generation."""
 
+import random
 from datetime import datetime
-from random import uniform
+from math import exp, gcd, log
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, rng=random, now=None):
+    """Get a random datetime within the last few years (before `now`)."""
 
-    now = datetime.now()
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    random_timestamp = rng.uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+class ZipfSampler:
+    """Draw ids 1..n where the r-th most popular id has weight 1 / r**alpha.
+
+    Ranks are drawn in O(1) by inverting the continuous power-law CDF, and
+    mapped to ids by a fixed bijection so that popular ids are scattered
+    rather than all being the lowest ones. Nothing of size n is stored.
+    """
+
+    def __init__(self, n, alpha=1.0, salt=0):
+        self.n = n
+        self.alpha = alpha
+        self.offset = salt % n
+
+        self.stride = (2654435761 + salt) % n or 1
+        while gcd(self.stride, n) != 1:
+            self.stride += 1
+
+        if alpha != 1:
+            self._top = (n + 1) ** (1 - alpha) - 1
+
+    def rank(self, rng):
+        """A rank in 1..n, small ranks far more likely."""
+
+        u = rng.random()
+
+        if self.alpha == 1:
+            r = exp(u * log(self.n + 1))
+        else:
+            r = (self._top * u + 1) ** (1 / (1 - self.alpha))
+
+        return min(max(int(r), 1), self.n)
+
+    def __call__(self, rng):
+        return ((self.rank(rng) - 1) * self.stride + self.offset) % self.n + 1
+
+
+def heavy_tailed_count(rng, mean, cap, shape=2.0):
+    """A count with the given mean and a long (Pareto) tail, at most `cap`."""
+
+    scale = mean * (shape - 1) / shape
+    return min(int(round(scale * rng.paretovariate(shape))), cap)
@@ -0,0 +1,127 @@
+"""Conditional HTTP caching for Warbler pages.
+
+Views call ``check()`` with whatever the page they are about to render
+depends on (ids and ``updated_at`` versions they have loaded anyway). That
+becomes the response's ETag, and if the client already holds that version
+``check()`` returns a 304 to send instead of rendering:
+
+    not_modified = http_cache.check((user.id, user.updated_at), public=True)
+    if not_modified:
+        return not_modified
+
+Every page shows the logged-in user in the nav bar, so the viewer is always
+part of the ETag and pages are only ever ``public`` (cacheable by shared
+proxies) for anonymous visitors. Pages that don't call ``check()`` -- forms,
+redirects, errors -- are sent with ``no-store``; static files keep Flask's
+own headers, as do built assets and proxied images (see OWN_HEADERS).
+
+A page is never validated while flashed messages are pending, since
+rendering it is what shows (and clears) them.
+
+Config:
+
+    HTTP_CACHE_VERSION   folded into every ETag; defaults to a hash of
+                         the templates and the asset manifest, so a deploy
+                         that changes either invalidates cached pages
+"""
+
+import hashlib
+import os
+
+from flask import current_app, g, request, session
+
+import assets
+
+NO_STORE = 'no-store'
+
+# Endpoints that set their own caching headers
+OWN_HEADERS = ('static', 'assets', 'image_proxy')
+
+
+def templates_version(app):
+    """A short hash of every template's contents, and of the built asset
+    names they link to."""
+
+    digest = hashlib.sha1()
+    root = os.path.join(app.root_path, app.template_folder)
+
+    manifest = os.path.join(app.config.get('ASSETS_DIR', ''), assets.MANIFEST)
+    if os.path.isfile(manifest):
+        with open(manifest, 'rb') as f:
+            digest.update(f.read())
+
+    for directory, dirs, files in sorted(os.walk(root)):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(name.encode('utf-8'))
+                digest.update(f.read())
+
+    return digest.hexdigest()[:12]
+
+
+def init_app(app):
+    app.config.setdefault('HTTP_CACHE_VERSION', templates_version(app))
+    app.after_request(add_cache_headers)
+
+
+def etag_for(parts):
+    """An opaque ETag value for `parts` (anything with a stable repr)."""
+
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def check(*parts, public=False, max_age=0, last_modified=None):
+    """Set this response's validators; a 304 response if the client is current.
+
+    `parts` are what the page depends on besides the viewer. `public` pages
+    may be stored by shared caches when nobody is logged in. `last_modified`
+    is only sent for anonymous viewers, as it can't capture per-viewer state.
+    """
+
+    if session.get('_flashes'):
+        return None
+
+    viewer = (g.user.id, g.user.username, g.user.image_url) if g.user else None
+
+    g.http_cache = dict(
+        etag=etag_for((current_app.config['HTTP_CACHE_VERSION'],
+                       request.full_path, viewer, parts)),
+        last_modified=None if g.user else last_modified,
+        public=public and not g.user,
+        max_age=max_age,
+    )
+
+    response = current_app.response_class()
+    _set_validators(response, g.http_cache)
+    response.make_conditional(request)
+
+    return response if response.status_code == 304 else None
+
+
+def _set_validators(response, cache):
+    response.set_etag(cache['etag'])
+    if cache['last_modified'] is not None:
+        response.last_modified = cache['last_modified']
+
+    visibility = 'public' if cache['public'] else 'private'
+    if cache['max_age']:
+        response.headers['Cache-Control'] = f"{visibility}, max-age={cache['max_age']}"
+    else:
+        response.headers['Cache-Control'] = f"{visibility}, no-cache"
+
+
+def add_cache_headers(response):
+    """Send validators for checked pages and no-store for everything else."""
+
+    if request.endpoint in OWN_HEADERS:
+        return response
+
+    cache = g.get('http_cache')
+
+    if cache is not None and response.status_code in (200, 304):
+        _set_validators(response, cache)
+    else:
+        response.headers['Cache-Control'] = NO_STORE
+
+    return response
@@ -0,0 +1,106 @@
+"""Cache of logged-in users' rows, so add_user_to_g needn't hit the DB.
+
+The cache holds plain column values, not ORM objects; ``load_user`` turns
+them back into a ``User`` attached to the current session without a query.
+Columns left out of the cache (the password hash, counters) are loaded on
+first access like any expired attribute.
+
+Entries live for ``ttl`` seconds, so an edit made by another process shows
+up within that window; this process drops entries itself via
+``invalidate`` when a user is edited or deleted.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+
+CACHED_COLUMNS = ('id', 'email', 'username', 'image_url',
+                  'header_image_url', 'bio', 'location')
+
+
+class IdentityCache:
+    """Thread-safe LRU mapping of user id -> column values, with a TTL."""
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Cached values for `user_id`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, values):
+        with self._lock:
+            self._entries[user_id] = (self.clock() + self.ttl, values)
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counts of hits, misses, evictions and current size."""
+
+        with self._lock:
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        evictions=self.evictions,
+                        size=len(self._entries))
+
+
+def load_user(cache, user_id):
+    """Get a session-attached User by id, via `cache` when possible.
+
+    Returns None for a deleted account, so its sessions are logged out.
+    """
+
+    if user_id is None:
+        return None
+
+    values = cache.get(user_id)
+
+    if values is None:
+        user = User.query.get(user_id)
+        if user is not None and user.deleted_at is not None:
+            # the account is being purged (see account_deletion.py)
+            return None
+        if user is not None:
+            cache.put(user_id, {col: getattr(user, col)
+                                for col in CACHED_COLUMNS})
+        return user
+
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
@@ -0,0 +1,468 @@
+"""Local proxy and thumbnail cache for users' profile images.
+
+``image_url`` and ``header_image_url`` are arbitrary external URLs. Rather
+than hotlink them at full size, templates call
+``image_src(user.image_url, 'thumb')``, which gives a signed
+``/images/thumb/<signature>?u=<url>`` URL on this site. The first request
+for a source fetches it once, makes every size in ``SIZES`` from it, and
+stores them on disk. Later requests are served from disk, with
+long-lived cache headers.
+
+URLs are signed with ``IMAGE_PROXY_KEY`` so that the proxy only fetches
+images the site itself linked to, and sources on private, loopback or
+link-local addresses are refused (users choose these URLs). Hosts are
+checked as they're connected to, and the connection goes to the address
+that was checked, so a name can't resolve to a public address for the check
+and a private one for the fetch. A source that can't be fetched, or isn't
+an image, gets the default image for its size.
+
+Resizing needs Pillow, which is in requirements.txt. Without it a warning
+is logged at startup, and the source is stored and served as it is, which
+still saves the hotlink and caches it.
+
+The disk cache is bounded by ``IMAGE_PROXY_MAX_BYTES``, evicting the least
+recently used files. Each worker process evicts by its own view of the
+cache, so with several workers the bound is approximate.
+
+Config:
+
+    IMAGE_PROXY_ENABLED         proxy external images at all (True)
+    IMAGE_PROXY_KEY             signing key (SECRET_KEY)
+    IMAGE_PROXY_DIR             cache directory (instance/image_cache)
+    IMAGE_PROXY_MAX_BYTES       disk cache size (200MB)
+    IMAGE_PROXY_MAX_SOURCE      largest source image fetched (5MB)
+    IMAGE_PROXY_TIMEOUT         seconds to wait for a source (5)
+    IMAGE_PROXY_ALLOW_PRIVATE   allow private/loopback sources (False)
+"""
+
+import base64
+import hashlib
+import hmac
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+
+from flask import abort, current_app, redirect, request, url_for
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # only needed for resizing
+    Image = None
+
+# name: ((width, height), crop to fill, default image)
+SIZES = {
+    'thumb': ((96, 96), True, '/static/images/default-pic.png'),
+    'avatar': ((200, 200), True, '/static/images/default-pic.png'),
+    'header': ((1200, 600), False, '/static/images/warbler-hero.jpg'),
+}
+
+EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif',
+              'image/webp': '.webp'}
+
+CACHE_CONTROL = 'public, max-age=2592000'
+
+# how long a source that failed isn't retried
+FAILURE_SECONDS = 300
+
+
+class ImageFetchError(Exception):
+    """The source couldn't be fetched, or isn't an image we accept."""
+
+
+def sign(key, size, url):
+    digest = hmac.new(key, f"{size}\n{url}".encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode('ascii').rstrip('=')
+
+
+def cache_key(size, url):
+    return hashlib.sha256(f"{size}\n{url}".encode('utf-8')).hexdigest()
+
+
+def check_address(host, address, allow_private=False):
+    if allow_private:
+        return
+
+    if not ipaddress.ip_address(address.split('%')[0]).is_global:
+        raise ImageFetchError(f"{host} is not a public address")
+
+
+def check_host(url, allow_private=False):
+    """Refuse non-HTTP URLs and, unless allowed, private IP address hosts.
+
+    Hosts given by name are checked when they're connected to.
+    """
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageFetchError(f"not an http(s) URL: {url}")
+
+    try:
+        ipaddress.ip_address(parts.hostname)
+    except ValueError:
+        return
+
+    check_address(parts.hostname, parts.hostname, allow_private)
+
+
+def connect(host, port, timeout, allow_private=False):
+    """A socket connected to `host`, refusing it unless all its addresses
+    are public; the address checked is the one connected to."""
+
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as err:
+        raise ImageFetchError(f"{host}: {err}")
+
+    for *_, sockaddr in addresses:
+        check_address(host, sockaddr[0], allow_private)
+
+    *_, sockaddr = addresses[0]
+    return socket.create_connection(sockaddr[:2], timeout)
+
+
+class _CheckedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, host, allow_private=False, **kw):
+        super().__init__(host, **kw)
+        self.allow_private = allow_private
+
+    def connect(self):
+        self.sock = connect(self.host, self.port, self.timeout, self.allow_private)
+
+
+class _CheckedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host, allow_private=False, context=None, **kw):
+        self.ssl_context = context or ssl.create_default_context()
+        super().__init__(host, context=self.ssl_context, **kw)
+        self.allow_private = allow_private
+
+    def connect(self):
+        sock = connect(self.host, self.port, self.timeout, self.allow_private)
+        # verified, and sent as SNI, under the name, not the address
+        self.sock = self.ssl_context.wrap_socket(sock, server_hostname=self.host)
+
+
+class _CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, allow_private):
+        super().__init__()
+        self.allow_private = allow_private
+
+    def http_open(self, req):
+        return self.do_open(_CheckedHTTPConnection, req,
+                            allow_private=self.allow_private)
+
+
+class _CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, allow_private):
+        super().__init__()
+        self.allow_private = allow_private
+
+    def https_open(self, req):
+        return self.do_open(_CheckedHTTPSConnection, req,
+                            allow_private=self.allow_private)
+
+
+class _CheckedRedirects(urllib.request.HTTPRedirectHandler):
+    """Follow redirects only to URLs we'd fetch from directly."""
+
+    def __init__(self, allow_private):
+        self.allow_private = allow_private
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_host(newurl, self.allow_private)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def fetch(url, max_bytes, timeout, allow_private=False):
+    """(bytes, content type) of the image at `url`."""
+
+    check_host(url, allow_private)
+    # no proxies: they would resolve the host themselves
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}),
+                                         _CheckedHTTPHandler(allow_private),
+                                         _CheckedHTTPSHandler(allow_private),
+                                         _CheckedRedirects(allow_private))
+    req = urllib.request.Request(url, headers={'User-Agent': 'warbler-image-proxy'})
+
+    try:
+        with opener.open(req, timeout=timeout) as resp:
+            content_type = resp.headers.get_content_type()
+            data = resp.read(max_bytes + 1)
+    except (OSError, ValueError) as err:
+        raise ImageFetchError(f"{url}: {err}")
+
+    if content_type not in EXTENSIONS:
+        raise ImageFetchError(f"{url}: not an image ({content_type})")
+    if len(data) > max_bytes:
+        raise ImageFetchError(f"{url}: larger than {max_bytes} bytes")
+
+    return data, content_type
+
+
+def resize(data, content_type, size):
+    """(bytes, content type) of the image scaled to `size` in SIZES."""
+
+    if Image is None:
+        return data, content_type
+
+    (width, height), crop, _ = SIZES[size]
+
+    # DecompressionBombError isn't an OSError: Pillow raises it for images
+    # too many pixels to decode safely, on opening or on first use
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+
+        if crop:
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.LANCZOS)
+
+        out = io.BytesIO()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image.save(out, 'PNG', optimize=True)
+            content_type = 'image/png'
+        else:
+            image.convert('RGB').save(out, 'JPEG', quality=85, optimize=True)
+            content_type = 'image/jpeg'
+    except (OSError, ValueError, Image.DecompressionBombError) as err:
+        raise ImageFetchError(f"unreadable image: {err}")
+
+    return out.getvalue(), content_type
+
+
+class DiskCache:
+    """Files under `directory`, at most `max_bytes` in all, LRU evicted."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._files = OrderedDict()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._scan()
+
+    def _scan(self):
+        """Index files already on disk, least recently used first."""
+
+        found = []
+        for directory, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                found.append((stat.st_mtime, name, path, stat.st_size))
+
+        for _, name, path, size in sorted(found):
+            self._files[name] = (path, size)
+            self.total += size
+
+        self._evict()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    def get(self, key):
+        """(bytes, content type) cached under `key`, or None."""
+
+        for content_type, ext in EXTENSIONS.items():
+            name = key + ext
+            path = self._path(name)
+
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+
+            os.utime(path)
+
+            with self._lock:
+                # it may have been written by another worker
+                if name not in self._files:
+                    self._files[name] = (path, len(data))
+                    self.total += len(data)
+                self._files.move_to_end(name)
+                self.hits += 1
+
+            return data, content_type
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, data, content_type):
+        name = key + EXTENSIONS[content_type]
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._forget(name)
+            self._files[name] = (path, len(data))
+            self.total += len(data)
+            self._evict()
+
+    def _forget(self, name):
+        entry = self._files.pop(name, None)
+        if entry is not None:
+            self.total -= entry[1]
+
+    def _evict(self):
+        while self.total > self.max_bytes and self._files:
+            name, (path, size) = self._files.popitem(last=False)
+            self.total -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return dict(files=len(self._files), bytes=self.total,
+                        max_bytes=self.max_bytes, hits=self.hits,
+                        misses=self.misses, evictions=self.evictions)
+
+
+class ImageProxy:
+    """Flask extension serving proxied, resized images."""
+
+    def __init__(self, app=None, local_url=None):
+        self._fetch_locks = {}
+        self._failures = {}
+        # guards _fetch_locks and _failures
+        self._locks_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app, local_url)
+
+    def init_app(self, app, local_url=None):
+        app.config.setdefault('IMAGE_PROXY_ENABLED', True)
+        app.config.setdefault('IMAGE_PROXY_KEY', app.config['SECRET_KEY'])
+        app.config.setdefault('IMAGE_PROXY_DIR',
+                              os.path.join(app.instance_path, 'image_cache'))
+        app.config.setdefault('IMAGE_PROXY_MAX_BYTES', 200 * 1024 * 1024)
+        app.config.setdefault('IMAGE_PROXY_MAX_SOURCE', 5 * 1024 * 1024)
+        app.config.setdefault('IMAGE_PROXY_TIMEOUT', 5)
+        app.config.setdefault('IMAGE_PROXY_ALLOW_PRIVATE', False)
+
+        if Image is None and app.config['IMAGE_PROXY_ENABLED']:
+            app.logger.warning("image proxy: Pillow isn't installed, "
+                               "so images are served unresized")
+
+        self.app = app
+        self.local_url = local_url or (lambda url: url)
+        self.cache = DiskCache(app.config['IMAGE_PROXY_DIR'],
+                               app.config['IMAGE_PROXY_MAX_BYTES'])
+
+        app.add_url_rule('/images/<size>/<sig>', 'image_proxy', self.serve)
+        app.jinja_env.globals['image_src'] = self.src
+
+    def stats(self):
+        """The disk cache's counts."""
+
+        return self.cache.stats()
+
+    @property
+    def key(self):
+        key = self.app.config['IMAGE_PROXY_KEY']
+        return key.encode('utf-8') if isinstance(key, str) else key
+
+    def src(self, url, size):
+        """URL to show the image at `url` as `size` (see SIZES)."""
+
+        if not url:
+            url = SIZES[size][2]
+
+        if url.startswith('/') or not self.app.config['IMAGE_PROXY_ENABLED']:
+            return self.local_url(url)
+
+        return url_for('image_proxy', size=size, sig=sign(self.key, size, url), u=url)
+
+    def _fetch_lock(self, url):
+        with self._locks_lock:
+            return self._fetch_locks.setdefault(url, threading.Lock())
+
+    def _load(self, size, url):
+        """The cached image, fetching and resizing its source on a miss."""
+
+        key = cache_key(size, url)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        lock = self._fetch_lock(url)
+        with lock:
+            # another request may have fetched it while we waited
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+            with self._locks_lock:
+                failed_until = self._failures.get(url, 0)
+            if failed_until > time.time():
+                raise ImageFetchError(f"{url}: failed recently")
+
+            config = self.app.config
+            try:
+                data, content_type = fetch(url, config['IMAGE_PROXY_MAX_SOURCE'],
+                                           config['IMAGE_PROXY_TIMEOUT'],
+                                           config['IMAGE_PROXY_ALLOW_PRIVATE'])
+
+                # one fetch makes every size (when they can be made)
+                sizes = list(SIZES) if Image is not None else [size]
+                for name in sizes:
+                    resized = resize(data, content_type, name)
+                    self.cache.put(cache_key(name, url), *resized)
+                    if name == size:
+                        result = resized
+            except ImageFetchError:
+                with self._locks_lock:
+                    if len(self._failures) > 10000:
+                        self._failures.clear()
+                    self._failures[url] = time.time() + FAILURE_SECONDS
+                raise
+            finally:
+                with self._locks_lock:
+                    self._fetch_locks.pop(url, None)
+
+        with self._locks_lock:
+            self._failures.pop(url, None)
+        return result
+
+    def serve(self, size, sig):
+        url = request.args.get('u', '')
+
+        if size not in SIZES or not hmac.compare_digest(sig, sign(self.key, size, url)):
+            abort(404)
+
+        try:
+            data, content_type = self._load(size, url)
+        except ImageFetchError as err:
+            current_app.logger.info("image proxy: %s", err)
+            return redirect(self.local_url(SIZES[size][2]))
+
+        response = current_app.response_class(data, mimetype=content_type)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        response.set_etag(cache_key(size, url))
+        return response.make_conditional(request)
@@ -0,0 +1,156 @@
+"""Write-behind per-message like counts.
+
+Each message's like count lives in ``messages.likes_count`` so that nothing
+counts ``likes`` rows on read. Popular messages are liked in bursts, so
+rather than updating a message row inside every like request (and making
+those requests queue on its row lock), each process collects count changes
+in a ``LikeCountBuffer`` and applies them (and the messages' "top" feed
+scores, see message_scores.py) in one batched UPDATE:
+
+- every ``LIKE_BUFFER_INTERVAL`` seconds, from a background thread,
+- as soon as ``LIKE_BUFFER_SIZE`` messages have changes pending,
+- and when the process exits.
+
+Changes still in the buffer when a process dies are lost; ``flask recount``
+rebuilds the counts from the likes table. Within a process, ``count()``
+adds pending changes so that a user sees their own like counted at once.
+
+Config (read by ``init_app``):
+
+    LIKE_BUFFER_INTERVAL    seconds between flushes; 0 disables the thread (5)
+    LIKE_BUFFER_SIZE        pending messages that force a flush (1000)
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+from sqlalchemy import bindparam
+
+from models import db, Message
+import message_scores
+
+logger = logging.getLogger('warbler.like_counts')
+
+messages = Message.__table__
+
+
+class LikeCountBuffer:
+    """Per-message like count deltas waiting to be written."""
+
+    def __init__(self, interval=5.0, max_pending=1000):
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self._deltas = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+
+        self.flushes = 0
+        self.rows_written = 0
+
+        atexit.register(self._run_once)
+
+    def init_app(self, app):
+        self.interval = app.config.get('LIKE_BUFFER_INTERVAL', self.interval)
+        self.max_pending = app.config.get('LIKE_BUFFER_SIZE', self.max_pending)
+
+    def _ensure_thread(self):
+        """Start the flushing thread for this process (again after a fork)."""
+
+        if not self.interval or self._thread_pid == os.getpid():
+            return
+
+        self._thread_pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='like-count-flusher')
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._run_once()
+
+    def _run_once(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing like counts failed")
+
+    def add(self, message_id, delta):
+        """Record a change of `delta` likes to a message (after commit)."""
+
+        with self._lock:
+            self._deltas[message_id] = self._deltas.get(message_id, 0) + delta
+            full = len(self._deltas) >= self.max_pending
+            self._ensure_thread()
+
+        if full:
+            if self._thread is not None and self._thread.is_alive():
+                self._wake.set()
+            else:
+                self.flush()
+
+    def pending(self, message_id):
+        """Change to a message's count not yet written."""
+
+        with self._lock:
+            return self._deltas.get(message_id, 0)
+
+    def count(self, msg):
+        """A message's like count, including changes not yet written."""
+
+        return msg.likes_count + self.pending(msg.id)
+
+    def flush(self):
+        """Write all pending changes in one batch; returns messages updated."""
+
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+
+        rows = [dict(message_id=message_id, delta=delta)
+                for message_id, delta in sorted(deltas.items()) if delta]
+        if not rows:
+            return 0
+
+        update = (messages.update()
+                  .where(messages.c.id == bindparam('message_id'))
+                  .values(likes_count=messages.c.likes_count + bindparam('delta')))
+
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(update, rows)
+                message_scores.apply_likes(
+                    connection, {row['message_id']: row['delta'] for row in rows})
+        except Exception:
+            # put them back to try again on the next flush
+            with self._lock:
+                for message_id, delta in deltas.items():
+                    self._deltas[message_id] = (
+                        self._deltas.get(message_id, 0) + delta)
+            raise
+
+        with self._lock:
+            self.flushes += 1
+            self.rows_written += len(rows)
+
+        return len(rows)
+
+    def discard(self):
+        """Drop pending changes (e.g. after the counts were rebuilt)."""
+
+        with self._lock:
+            self._deltas.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(pending=len(self._deltas),
+                        flushes=self.flushes,
+                        rows_written=self.rows_written)
+
+
+like_counts = LikeCountBuffer()
@@ -0,0 +1,179 @@
+"""Time-decayed like scores for the "top" home feed.
+
+A message's score is the sum over its likes of ``2 ** -(age / HALF_LIFE)``
+(its post counting as ``POST_WEIGHT`` likes), so recent likes count for
+more than old ones. Decaying every score as time passes would mean
+rewriting every row; instead each row stores the score's logarithm scaled
+to a fixed epoch,
+
+    log(sum of 2 ** ((liked_at - EPOCH) / HALF_LIFE)),
+
+which orders messages exactly as their decayed scores would at any moment
+and only changes when a like arrives: adding one is a ``logaddexp`` on a
+single row. Likes reach here through like_counts.py's write-behind buffer,
+so they're applied in batches off the request path, a few seconds late.
+
+Likes carry no timestamps, so an unlike removes the smallest contribution a
+like can have made (one given as the message was posted); the score never
+falls below the post's own weight.
+
+``top_message_ids`` reads a user's feed from ``message_scores`` alone:
+messages of theirs and the users they follow from the last
+``TOP_FEED_HOURS``, best first. ``prune`` drops rows too old for the feed
+(``flask prune-scores``, e.g. daily), and ``rebuild`` recomputes every row
+from the like counts (``flask rescore``).
+
+None of these functions commit; they run inside the caller's transaction.
+"""
+
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, or_, select
+
+from models import db, Follows, Message, MessageScore
+
+# Age at which a like counts half as much
+HALF_LIFE = timedelta(hours=6)
+
+# How far back the top feed looks
+TOP_FEED_HOURS = 48
+
+# What posting a message counts as, in likes
+POST_WEIGHT = 1.0
+
+EPOCH = datetime(2020, 1, 1)
+
+scores = MessageScore.__table__
+messages = Message.__table__
+follows = Follows.__table__
+
+
+def log_weight(when):
+    """log(2 ** ((when - EPOCH) / HALF_LIFE)): a like at `when`, in the
+    log domain."""
+
+    return (when - EPOCH) / HALF_LIFE * math.log(2)
+
+
+def logaddexp(a, b):
+    """log(exp(a) + exp(b)), without overflowing."""
+
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def logsubexp(a, b):
+    """log(exp(a) - exp(b)), or -inf if that's not positive."""
+
+    if b >= a:
+        return -math.inf
+    return a + math.log1p(-math.exp(b - a))
+
+
+def initial_score(timestamp, likes=0):
+    """Score of a message posted at `timestamp`, with `likes` counted as
+    given when it was posted."""
+
+    return log_weight(timestamp) + math.log(POST_WEIGHT + likes)
+
+
+def add_message(msg):
+    """Start scoring a flushed message."""
+
+    db.session.execute(scores.insert().values(
+        message_id=msg.id, author_id=msg.user_id, timestamp=msg.timestamp,
+        score=initial_score(msg.timestamp)))
+
+
+def apply_likes(connection, deltas, now=None):
+    """Fold like count changes ({message id: delta}) into scores, as likes
+    given (or taken back) at `now`."""
+
+    if not deltas:
+        return 0
+
+    now = now or datetime.utcnow()
+    rows = connection.execute(
+        select([scores.c.message_id, scores.c.timestamp, scores.c.score])
+        .where(scores.c.message_id.in_(list(deltas))))
+    updates = []
+
+    for message_id, timestamp, score in rows:
+        delta = deltas[message_id]
+
+        if delta > 0:
+            score = logaddexp(score, log_weight(now) + math.log(delta))
+        elif delta < 0:
+            score = max(logsubexp(score, log_weight(timestamp) + math.log(-delta)),
+                        initial_score(timestamp))
+        else:
+            continue
+
+        updates.append(dict(id=message_id, new_score=score))
+
+    if updates:
+        connection.execute(scores.update()
+                           .where(scores.c.message_id == bindparam('id'))
+                           .values(score=bindparam('new_score')),
+                           updates)
+
+    return len(updates)
+
+
+def remove_messages(message_ids):
+    """Stop scoring these messages (before they are deleted)."""
+
+    db.session.execute(
+        scores.delete().where(scores.c.message_id.in_(message_ids)))
+
+
+def top_message_ids(user_id, limit=100, hours=TOP_FEED_HOURS, now=None):
+    """Best-scored recent message ids from this user and those they follow."""
+
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=hours)
+    followed = (select([follows.c.user_being_followed_id])
+                .where(follows.c.user_following_id == user_id))
+
+    rows = db.session.execute(
+        select([scores.c.message_id])
+        .where(or_(scores.c.author_id == user_id,
+                   scores.c.author_id.in_(followed)))
+        .where(scores.c.timestamp >= cutoff)
+        .order_by(scores.c.score.desc(), scores.c.message_id.desc())
+        .limit(limit))
+
+    return [message_id for (message_id,) in rows]
+
+
+def prune(hours=TOP_FEED_HOURS, now=None):
+    """Drop scores of messages older than the feed shows."""
+
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=hours)
+
+    return db.session.execute(
+        scores.delete().where(scores.c.timestamp < cutoff)).rowcount
+
+
+def rebuild(hours=TOP_FEED_HOURS, now=None):
+    """Rescore the last `hours` of messages from their like counts, and
+    drop older ones. (Likes are counted as given at posting, so scores
+    start out at their lowest.)"""
+
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=hours)
+
+    db.session.execute(scores.delete())
+
+    recent = db.session.execute(
+        select([messages.c.id, messages.c.user_id, messages.c.timestamp,
+                messages.c.likes_count])
+        .where(messages.c.timestamp >= cutoff))
+
+    rows = [dict(message_id=message_id, author_id=author_id, timestamp=timestamp,
+                 score=initial_score(timestamp, max(likes, 0)))
+            for message_id, author_id, timestamp, likes in recent]
+
+    if rows:
+        db.session.execute(scores.insert(), rows)
+
+    return len(rows)
@@ -0,0 +1,423 @@
+"""Schema migrations for Warbler.
+
+The live schema is evolved by numbered migrations, recorded in a
+``schema_version`` table as they are applied. Each migration checks what is
+already there before changing it, so a database created by an older
+``db.create_all()`` (which has no ``schema_version`` yet) can be upgraded
+from the original schema, version 1.
+
+New databases are created straight from the models and stamped with the
+latest version. Changing a model means adding a migration here too:
+
+    @migration(12, "Add users.theme")
+    def add_user_theme(conn):
+        add_column(conn, User.__table__.c.theme)
+
+Migrations that need data rebuilt afterwards (counters, the search index)
+name it in ``backfills``; ``flask db-upgrade`` runs those once the schema
+is current.
+
+Indexes are declared on the models, each with the queries that use it in
+``info['used_by']``. On PostgreSQL they are built ``CONCURRENTLY`` so that
+writes carry on during the build. ``check_indexes`` compares the database's
+indexes with the declared ones, reporting missing, undeclared, invalid and
+(on PostgreSQL) never-scanned indexes.
+
+Run them with:
+
+    flask db-upgrade          # apply pending migrations and backfills
+    flask db-status           # current version and pending migrations
+    flask db-check-indexes    # compare indexes with the models
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Integer, MetaData, Table, Text,
+                        UniqueConstraint, inspect, select)
+from sqlalchemy.schema import CreateIndex
+
+from models import (db, DeletionJob, User, Message, MessageScore, Follows,
+                    Likes, SearchGram, Timeline, TimelineEntry)
+
+Migration = namedtuple('Migration',
+                       ['version', 'name', 'upgrade', 'backfills', 'transactional'])
+
+MIGRATIONS = []
+
+# The schema every database started from (the original models)
+BASELINE_VERSION = 1
+
+schema_metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', schema_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', Text, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def migration(version, name, backfills=(), transactional=True):
+    """Register a migration function, taking a connection."""
+
+    def register(fn):
+        assert not MIGRATIONS or MIGRATIONS[-1].version < version
+        MIGRATIONS.append(Migration(version, name, fn, tuple(backfills),
+                                    transactional))
+        return fn
+
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1].version if MIGRATIONS else BASELINE_VERSION
+
+
+##############################################################################
+# Schema helpers; each does nothing if the change is already there
+
+
+def has_table(conn, name):
+    return name in inspect(conn).get_table_names()
+
+
+def has_column(conn, table_name, column_name):
+    return any(col['name'] == column_name
+               for col in inspect(conn).get_columns(table_name))
+
+
+def has_index(conn, table_name, index_name):
+    inspector = inspect(conn)
+    names = {ix['name'] for ix in inspector.get_indexes(table_name)}
+    names |= {uq['name'] for uq in inspector.get_unique_constraints(table_name)}
+    return index_name in names
+
+
+def has_unique(conn, table_name, column_names):
+    """Is there a unique constraint or index on exactly these columns?"""
+
+    inspector = inspect(conn)
+    uniques = [ix['column_names'] for ix in inspector.get_indexes(table_name)
+               if ix['unique']]
+    uniques += [uq['column_names']
+                for uq in inspector.get_unique_constraints(table_name)]
+    return list(column_names) in uniques
+
+
+def create_table(conn, table):
+    table.create(conn, checkfirst=True)
+
+
+def add_column(conn, column):
+    """ALTER TABLE .. ADD COLUMN for a column defined on a model."""
+
+    if has_column(conn, column.table.name, column.name):
+        return
+
+    preparer = conn.dialect.identifier_preparer
+    spec = conn.dialect.ddl_compiler(conn.dialect, None).get_column_specification(column)
+    conn.execute(f"ALTER TABLE {preparer.format_table(column.table)} ADD COLUMN {spec}")
+
+
+def create_index(conn, index):
+    """Create a model's index, without blocking writes where possible."""
+
+    if has_index(conn, index.table.name, index.name):
+        return
+
+    sql = str(CreateIndex(index).compile(dialect=conn.dialect))
+
+    if conn.dialect.name == 'postgresql':
+        sql = sql.replace('INDEX', 'INDEX CONCURRENTLY', 1)
+
+    conn.execute(sql)
+
+
+def rebuild_sqlite_table(conn, table):
+    """Recreate `table` from its model, keeping its rows.
+
+    SQLite can't drop or alter constraints, so the table is renamed, made
+    afresh and copied across.
+    """
+
+    old = f"_old_{table.name}"
+    conn.execute(f'ALTER TABLE "{table.name}" RENAME TO "{old}"')
+
+    # indexes move with the renamed table; free their names for the new one
+    for index in inspect(conn).get_indexes(old):
+        conn.execute(f'DROP INDEX "{index["name"]}"')
+
+    table.create(conn)
+
+    columns = ', '.join(f'"{col["name"]}"'
+                        for col in inspect(conn).get_columns(old)
+                        if col['name'] in table.c)
+    conn.execute(f'INSERT INTO "{table.name}" ({columns}) '
+                 f'SELECT {columns} FROM "{old}"')
+    conn.execute(f'DROP TABLE "{old}"')
+
+
+##############################################################################
+# Migrations
+
+
+@migration(2, "Add denormalized user counters", backfills=['recount'])
+def add_user_counters(conn):
+    users = User.__table__
+    for name in ('messages_count', 'following_count',
+                 'followers_count', 'likes_count'):
+        add_column(conn, users.c[name])
+
+
+@migration(3, "Add user search index", backfills=['reindex-search'])
+def add_search_index(conn):
+    create_table(conn, SearchGram.__table__)
+
+
+@migration(4, "Add materialized home timelines")
+def add_timelines(conn):
+    create_table(conn, Timeline.__table__)
+    create_table(conn, TimelineEntry.__table__)
+
+
+@migration(5, "Make likes unique per user and message, not per message")
+def likes_unique_per_user(conn):
+    likes = Likes.__table__
+
+    if (has_unique(conn, 'likes', ['user_id', 'message_id'])
+            and not has_unique(conn, 'likes', ['message_id'])):
+        return
+
+    if conn.dialect.name == 'sqlite':
+        rebuild_sqlite_table(conn, likes)
+        return
+
+    for constraint in inspect(conn).get_unique_constraints('likes'):
+        if constraint['column_names'] == ['message_id']:
+            conn.execute(f'ALTER TABLE likes DROP CONSTRAINT "{constraint["name"]}"')
+
+    if not has_unique(conn, 'likes', ['user_id', 'message_id']):
+        conn.execute('ALTER TABLE likes ADD CONSTRAINT uq_likes_user_message '
+                     'UNIQUE (user_id, message_id)')
+
+
+@migration(6, "Add users.updated_at")
+def add_user_updated_at(conn):
+    column = User.__table__.c.updated_at
+
+    if conn.dialect.name != 'sqlite':
+        add_column(conn, column)
+        return
+
+    # SQLite can only add columns with a constant default
+    if not has_column(conn, 'users', 'updated_at'):
+        conn.execute('ALTER TABLE users ADD COLUMN updated_at DATETIME')
+        conn.execute('UPDATE users SET updated_at = CURRENT_TIMESTAMP')
+
+
+@migration(7, "Add messages.likes_count", backfills=['recount'])
+def add_message_likes_count(conn):
+    add_column(conn, Message.__table__.c.likes_count)
+
+
+@migration(8, "Add hot-path indexes", transactional=False)
+def add_hot_path_indexes(conn):
+    for table in (Follows.__table__, Likes.__table__, Message.__table__,
+                  TimelineEntry.__table__):
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            create_index(conn, index)
+
+
+@migration(9, "Add background account deletion")
+def add_account_deletion(conn):
+    add_column(conn, User.__table__.c.deleted_at)
+    create_table(conn, DeletionJob.__table__)
+
+
+@migration(10, "Add message scores for the top feed", backfills=['rescore'])
+def add_message_scores(conn):
+    create_table(conn, MessageScore.__table__)
+
+
+@migration(11, "Discard home timelines backfilled past their end")
+def reset_timelines(conn):
+    # follows used to backfill entries older than the rest of a timeline,
+    # leaving gaps that its readers can't see; timelines are rebuilt on the
+    # next visit home
+    conn.execute(TimelineEntry.__table__.delete())
+    conn.execute(Timeline.__table__.delete())
+
+
+##############################################################################
+# Running migrations
+
+
+def current_version(engine):
+    """The schema's version: None for an empty database."""
+
+    with engine.connect() as conn:
+        if not has_table(conn, 'users'):
+            return None
+
+        if not has_table(conn, schema_version.name):
+            return BASELINE_VERSION
+
+        version = conn.execute(select([schema_version.c.version])
+                               .order_by(schema_version.c.version.desc())
+                               .limit(1)).scalar()
+        return version or BASELINE_VERSION
+
+
+def pending(engine):
+    """Migrations not yet applied."""
+
+    version = current_version(engine)
+
+    if version is None:
+        return []
+
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def _record(conn, version, name):
+    conn.execute(schema_version.insert().values(
+        version=version, name=name, applied_at=datetime.utcnow()))
+
+
+def stamp(engine, version=None):
+    """Mark the schema as being at `version` (the latest by default),
+    e.g. after creating it from the models."""
+
+    version = version or latest_version()
+    schema_metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        conn.execute(schema_version.delete())
+        _record(conn, version, "stamped")
+
+
+def upgrade(engine, log=print):
+    """Apply pending migrations in order; returns the ones applied.
+
+    An empty database is created from the models and stamped instead.
+    """
+
+    if current_version(engine) is None:
+        log("Creating schema from models")
+        db.metadata.create_all(engine)
+        stamp(engine)
+        return []
+
+    schema_metadata.create_all(engine)
+    applied = []
+
+    for m in pending(engine):
+        log(f"Migrating to {m.version}: {m.name}")
+
+        if m.transactional or engine.dialect.name != 'postgresql':
+            with engine.begin() as conn:
+                m.upgrade(conn)
+                _record(conn, m.version, m.name)
+        else:
+            # e.g. CREATE INDEX CONCURRENTLY can't run in a transaction
+            with engine.connect() as conn:
+                m.upgrade(conn.execution_options(isolation_level='AUTOCOMMIT'))
+            with engine.begin() as conn:
+                _record(conn, m.version, m.name)
+
+        applied.append(m)
+
+    return applied
+
+
+##############################################################################
+# Index checks
+
+
+def _declared_indexes(metadata):
+    """(table, columns) -> index or constraint for every declared index."""
+
+    declared = {}
+
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            cols = tuple(col.name for col in index.columns)
+            declared[(table.name, cols)] = index
+
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                cols = tuple(col.name for col in constraint.columns)
+                declared[(table.name, cols)] = constraint
+
+        for col in table.columns:
+            if col.unique:
+                declared[(table.name, (col.name,))] = col
+
+    return declared
+
+
+def _actual_indexes(conn, tables):
+    """(table, columns) -> name for the indexes in the database."""
+
+    inspector = inspect(conn)
+    actual = {}
+
+    for table in tables:
+        if not has_table(conn, table):
+            continue
+
+        for index in inspector.get_indexes(table):
+            actual[(table, tuple(index['column_names']))] = index['name']
+        for constraint in inspector.get_unique_constraints(table):
+            actual[(table, tuple(constraint['column_names']))] = constraint['name']
+
+    return actual
+
+
+def check_indexes(engine, metadata=None):
+    """Compare the database's indexes with the models' declarations.
+
+    Returns a dict of lists: `missing` (declared, not built), `undeclared`
+    (built, not declared), and on PostgreSQL `invalid` (a failed concurrent
+    build) and `unused` (never scanned since statistics were reset).
+    """
+
+    metadata = metadata or db.metadata
+    declared = _declared_indexes(metadata)
+    tables = [table.name for table in metadata.sorted_tables]
+
+    with engine.connect() as conn:
+        actual = _actual_indexes(conn, tables)
+
+        report = dict(
+            missing=[dict(table=table, columns=list(cols),
+                          name=getattr(item, 'name', None),
+                          used_by=getattr(item, 'info', {}).get('used_by'))
+                     for (table, cols), item in sorted(declared.items(),
+                                                       key=lambda kv: kv[0])
+                     if (table, cols) not in actual],
+            undeclared=[dict(table=table, columns=list(cols), name=name)
+                        for (table, cols), name in sorted(actual.items())
+                        if (table, cols) not in declared],
+            invalid=[],
+            unused=[],
+        )
+
+        if conn.dialect.name == 'postgresql':
+            report['invalid'] = [dict(name=name) for (name,) in conn.execute(
+                "SELECT c.relname FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE NOT i.indisvalid")]
+
+            report['unused'] = [
+                dict(table=table, name=name)
+                for table, name in conn.execute(
+                    "SELECT s.relname, s.indexrelname "
+                    "FROM pg_stat_user_indexes s "
+                    "JOIN pg_index i ON i.indexrelid = s.indexrelid "
+                    "WHERE s.idx_scan = 0 AND NOT i.indisunique "
+                    "ORDER BY 1, 2")
+                if table in tables]
+
+    return report
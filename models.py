@@ -2,11 +2,13 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import literal, select
+from sqlalchemy.dialects import postgresql
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import hasher
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,9 +28,53 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key serves lookups by followed user; this index serves
+    # the reverse direction. Every index lists the queries that need it
+    # (see migrations.py, which builds them on live databases).
+    __table_args__ = (
+        db.Index('ix_follows_following',
+                 'user_following_id', 'user_being_followed_id',
+                 info={'used_by': "Follows.exists/followed_among, "
+                                  "home_messages() fallback, timeline.backfill"}),
+    )
+
     def __repr__(self):
         return f"<User #{self.user_following_id} is following User #{self.user_being_followed_id}>"
 
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`? (a single indexed lookup)"""
+
+        follow = cls.query.filter_by(user_following_id=follower_id,
+                                     user_being_followed_id=followed_id)
+        return db.session.query(follow.exists()).scalar()
+
+    @classmethod
+    def followed_among(cls, follower_id, user_ids):
+        """Which of `user_ids` does `follower_id` follow? Returns a set."""
+
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(cls.user_being_followed_id)
+                .filter(cls.user_following_id == follower_id,
+                        cls.user_being_followed_id.in_(user_ids)))
+        return {user_id for (user_id,) in rows}
+
+    @classmethod
+    def followers_among(cls, followed_id, user_ids):
+        """Which of `user_ids` follow `followed_id`? Returns a set."""
+
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(cls.user_following_id)
+                .filter(cls.user_being_followed_id == followed_id,
+                        cls.user_following_id.in_(user_ids)))
+        return {user_id for (user_id,) in rows}
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -48,9 +94,75 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
     )
 
+    # The unique constraint also serves lookups by user_id.
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id',
+                            name='uq_likes_user_message'),
+        db.Index('ix_likes_message_user', 'message_id', 'user_id',
+                 info={'used_by': "counters.forget_message/recount_likes, "
+                                  "cascades from messages"}),
+    )
+
+    @classmethod
+    def liked_among(cls, user_id, message_ids):
+        """Which of `message_ids` has `user_id` liked? Returns a set."""
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(cls.message_id)
+                .filter(cls.user_id == user_id,
+                        cls.message_id.in_(message_ids)))
+        return {message_id for (message_id,) in rows}
+
+    @classmethod
+    def add(cls, user_id, message_id):
+        """Like a message, if it exists, its author's account hasn't been
+        deleted and it isn't liked already.
+
+        A single INSERT .. SELECT that skips duplicates; returns whether a
+        like was added.
+        """
+
+        likes = cls.__table__
+        messages = Message.__table__
+        dialect = db.session.get_bind().dialect.name
+
+        if dialect == 'postgresql':
+            insert = postgresql.insert(likes)
+        else:
+            insert = likes.insert()
+
+        users = User.__table__
+        insert = insert.from_select(
+            ['user_id', 'message_id'],
+            select([literal(user_id), messages.c.id])
+            .select_from(messages.join(users, messages.c.user_id == users.c.id))
+            .where(messages.c.id == message_id)
+            .where(users.c.deleted_at.is_(None)))
+
+        if dialect == 'postgresql':
+            insert = insert.on_conflict_do_nothing(
+                index_elements=['user_id', 'message_id'])
+        elif dialect == 'sqlite':
+            insert = insert.prefix_with('OR IGNORE')
+        # (elsewhere a duplicate raises IntegrityError)
+
+        return db.session.execute(insert).rowcount == 1
+
+    @classmethod
+    def remove(cls, user_id, message_id):
+        """Unlike a message; returns whether a like was removed."""
+
+        likes = cls.__table__
+        delete = likes.delete().where((likes.c.user_id == user_id) &
+                                      (likes.c.message_id == message_id))
+
+        return db.session.execute(delete).rowcount == 1
+
 
 class User(db.Model):
     """User in the system."""
@@ -97,6 +209,55 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts, kept current by the write paths in app.py
+    # (see counters.py); `flask recount` repairs them.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Changes whenever the row does (profile edits and counter bumps alike);
+    # pages showing this user use it as a cache validator (see http_cache.py).
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # Set when the user deletes their account; the account is hidden from
+    # then on while account_deletion.py purges its rows in the background.
+
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -122,18 +283,14 @@ class User(db.Model):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     def is_followed_by(self, other_user):
-        """Is this user followed by `other_user`?"""
+        """Is this user followed by `other_user` (a User or user id)?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(getattr(other_user, 'id', other_user), self.id)
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_user` (a User or user id)?"""
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(self.id, getattr(other_user, 'id', other_user))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -142,7 +299,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -163,13 +320,21 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with an old work factor, it's replaced
+        with a fresh one (the caller commits).
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = (cls.query
+                .filter_by(username=username)
+                .filter(cls.deleted_at.is_(None))
+                .first())
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -193,7 +358,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -202,9 +367,206 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Denormalized like count, applied in batches (see like_counts.py)
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    __table_args__ = (
+        db.Index('ix_messages_user_timestamp', 'user_id', 'timestamp', 'id',
+                 info={'used_by': "user_messages(), home_messages() fallback, "
+                                  "timeline.backfill/build"}),
+    )
+
     user = db.relationship('User')
 
 
+class SearchGram(db.Model):
+    """An n-gram of one of a user's searchable fields (see user_search.py)."""
+
+    __tablename__ = 'user_search_grams'
+
+    gram = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    field = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    __table_args__ = (
+        db.Index('ix_user_search_grams_user_id', 'user_id',
+                 info={'used_by': "user_search.unindex_user"}),
+    )
+
+
+class Timeline(db.Model):
+    """Marker for a user whose home timeline has been materialized."""
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    size = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message pushed onto a user's home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_timestamp', 'user_id', 'timestamp',
+                 info={'used_by': "timeline.message_ids/trim"}),
+        db.Index('ix_timeline_entries_author', 'author_id',
+                 info={'used_by': "account_deletion.purge_timelines, "
+                                  "cascades from users"}),
+    )
+
+
+class MessageScore(db.Model):
+    """A message's time-decayed like score, for the "top" feed
+    (see message_scores.py)."""
+
+    __tablename__ = 'message_scores'
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    # the message's, copied so the feed needn't join messages
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_message_scores_author_timestamp', 'author_id', 'timestamp',
+                 info={'used_by': "message_scores.top_message_ids"}),
+    )
+
+
+class DeletionJob(db.Model):
+    """Progress of purging a deleted account (see account_deletion.py)."""
+
+    __tablename__ = 'deletion_jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # Not a foreign key: the job outlives the user's row
+    user_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    phase = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    rows_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    batches = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    # A runner holds the job until this time, so two can't purge it at once
+    claimed_by = db.Column(
+        db.Text,
+    )
+
+    claimed_until = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    def __repr__(self):
+        return f"<DeletionJob #{self.id}: user {self.user_id}, {self.phase}>"
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -0,0 +1,76 @@
+"""Keyset (cursor) pagination over (timestamp, id).
+
+Lists of messages are paged by remembering the last row shown rather than
+an OFFSET, so every page is the same index range scan however deep the
+reader scrolls. The position is handed to clients as an opaque ``before``
+token.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+PAGE_SIZE = 100
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+Page = namedtuple('Page', ['items', 'before'])
+
+
+def encode_cursor(timestamp, id):
+    """Make an opaque token pointing just past (timestamp, id)."""
+
+    raw = f"{timestamp.strftime(CURSOR_TIME_FORMAT)}|{id}".encode('ascii')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Turn a token from encode_cursor back into (timestamp, id).
+
+    Raises ValueError if the token is malformed.
+    """
+
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        stamp, id = urlsafe_b64decode(padded).decode('ascii').split('|')
+        return datetime.strptime(stamp, CURSOR_TIME_FORMAT), int(id)
+    except (TypeError, UnicodeDecodeError, ValueError) as exc:
+        raise ValueError(f"Bad cursor: {token!r}") from exc
+
+
+def older_than(timestamp_col, id_col, cursor):
+    """SQL condition for rows strictly after `cursor` in newest-first order."""
+
+    timestamp, id = cursor
+    return tuple_(timestamp_col, id_col) < tuple_(timestamp, id)
+
+
+def paginate(query, timestamp_col, id_col, cursor=None, per_page=PAGE_SIZE):
+    """Fetch one newest-first page of `query`, starting after `cursor`.
+
+    Returns a Page whose `before` token fetches the next page, or None if
+    this is the last one.
+    """
+
+    if cursor is not None:
+        query = query.filter(older_than(timestamp_col, id_col, cursor))
+
+    rows = (query
+            .order_by(timestamp_col.desc(), id_col.desc())
+            .limit(per_page + 1)
+            .all())
+
+    return page_of(rows, per_page)
+
+
+def page_of(messages, per_page=PAGE_SIZE):
+    """Build a Page from up to per_page + 1 newest-first messages."""
+
+    if len(messages) <= per_page:
+        return Page(messages, None)
+
+    messages = messages[:per_page]
+    last = messages[-1]
+    return Page(messages, encode_cursor(last.timestamp, last.id))
@@ -0,0 +1,166 @@
+"""Password hashing for Warbler, off the request thread.
+
+bcrypt is deliberately slow, so a burst of logins hashing inline would tie
+up every worker. ``PasswordHasher`` runs hashes in a process pool instead,
+with a cap on how many may be queued or running at once: past that cap
+callers get ``PasswordPoolBusy`` straight away rather than waiting. A hash
+holds its place until it finishes, even if its caller gave up waiting for
+it, since a job that has started can't be cancelled.
+
+``stats()`` reports queue depth and hash latency; the app serves it in the
+``/__pool_stats`` report.
+
+Config (read by ``init_app``):
+
+    BCRYPT_LOG_ROUNDS       bcrypt work factor for new hashes (12)
+    PASSWORD_POOL_WORKERS   pool processes; 0 hashes inline (CPU count)
+    PASSWORD_POOL_QUEUE     max hashes queued or running at once (32)
+    PASSWORD_POOL_TIMEOUT   seconds to wait for a result (10)
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when too many hashes are already queued."""
+
+
+def _hash(password, rounds):
+    salt = bcrypt.gensalt(rounds)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def hash_rounds(hashed):
+    """The work factor a bcrypt hash was made with ('$2b$12$...' -> 12)."""
+
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Hashes and checks passwords in a bounded process pool."""
+
+    def __init__(self, rounds=12, workers=None, max_queue=32, timeout=10):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_queue)
+
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def init_app(self, app):
+        config = app.config
+        self.rounds = config.get('BCRYPT_LOG_ROUNDS', self.rounds)
+        self.workers = config.get('PASSWORD_POOL_WORKERS', self.workers)
+        self.max_queue = config.get('PASSWORD_POOL_QUEUE', self.max_queue)
+        self.timeout = config.get('PASSWORD_POOL_TIMEOUT', self.timeout)
+        self._slots = threading.BoundedSemaphore(self.max_queue)
+
+    def _get_pool(self):
+        """The pool for this process (re-made after a fork)."""
+
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.rejected += 1
+            raise PasswordPoolBusy()
+
+        with self._stats_lock:
+            self.in_flight += 1
+
+        start = time.perf_counter()
+
+        if self.workers == 0:
+            try:
+                return fn(*args)
+            finally:
+                self._finished(start)
+
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except BaseException:
+            self._finished(start)
+            raise
+
+        future.add_done_callback(lambda future: self._finished(start))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # only a job still queued is cancelled; a running one keeps its
+            # slot until it's done
+            future.cancel()
+            with self._stats_lock:
+                self.timeouts += 1
+            raise PasswordPoolBusy()
+
+    def _finished(self, start):
+        """Free the slot of a hash that was started at `start`."""
+
+        elapsed = time.perf_counter() - start
+        self._slots.release()
+
+        with self._stats_lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    def hash(self, password):
+        """Hash `password` with the configured work factor."""
+
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match `hashed`?"""
+
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different work factor than configured?"""
+
+        return hash_rounds(hashed) != self.rounds
+
+    def stats(self):
+        """Queue depth and hash latency so far."""
+
+        with self._stats_lock:
+            mean = self.total_seconds / self.completed if self.completed else 0
+            return dict(in_flight=self.in_flight,
+                        max_queue=self.max_queue,
+                        completed=self.completed,
+                        rejected=self.rejected,
+                        timeouts=self.timeouts,
+                        mean_seconds=mean,
+                        max_seconds=self.max_seconds)
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,410 @@
+"""Connection pool telemetry and sizing for Warbler.
+
+Each engine's pool is made from an instrumented subclass of the pool class
+SQLAlchemy (or Flask-SQLAlchemy) would have used. Holds are tracked with
+the pool's ``checkout``, ``checkin`` and ``connect`` events; there is no
+event for the start of a checkout, so the wait is timed around the pool's
+public ``connect()``, which every engine checkout goes through. It
+records, per pool:
+
+- checkout latency: time spent waiting for a connection (including
+  opening or pinging it), and timeouts,
+- new connections opened,
+- connections in use (now, at the 95th percentile and at peak), beside
+  the pool's own idle and overflow counts,
+- how long each endpoint holds its connections, flagging holds longer than
+  ``POOL_STATS_LONG_HOLD`` (a request keeps its connection until the
+  session's transaction ends, so slow work inside it -- a bcrypt check, a
+  remote call -- keeps a connection busy and others waiting).
+
+Time spent waiting is added to the response's ``Server-Timing``, long holds
+are logged to ``warbler.pool``, and ``/__pool_stats`` reports the totals
+along with suggested pool sizes, and any other pools' stats registered with
+``add_report``.
+
+Pools are sized by the ``DB_POOL_*`` settings below, applied to every
+engine, replicas included. ``SQLALCHEMY_POOL_SIZE`` and friends, if set,
+still win. Each worker process has its own pools, so the database must
+allow ``workers * (DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW)`` connections.
+
+Config:
+
+    POOL_STATS_ENABLED      instrument pools (True)
+    POOL_STATS_REPORT       serve /__pool_stats; 404 otherwise (False)
+    POOL_STATS_LONG_HOLD    seconds a connection may be held before the
+                            hold is flagged (0.25)
+    DB_POOL_SIZE            connections kept open per pool (5)
+    DB_POOL_MAX_OVERFLOW    extra connections allowed under load (10)
+    DB_POOL_TIMEOUT         seconds to wait for a connection (10)
+    DB_POOL_RECYCLE         reconnect connections older than this; keep it
+                            under the server's idle timeout (1800)
+    DB_POOL_PRE_PING        test connections on checkout (True)
+"""
+
+import collections
+import json
+import logging
+import math
+import threading
+import time
+
+from flask import abort, g, has_request_context, jsonify, request
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+logger = logging.getLogger('warbler.pool')
+
+DEFAULTS = dict(
+    POOL_STATS_ENABLED=True,
+    POOL_STATS_REPORT=False,
+    POOL_STATS_LONG_HOLD=0.25,
+    DB_POOL_SIZE=5,
+    DB_POOL_MAX_OVERFLOW=10,
+    DB_POOL_TIMEOUT=10,
+    DB_POOL_RECYCLE=1800,
+    DB_POOL_PRE_PING=True,
+)
+
+# checkouts seen before sizes are suggested
+MIN_SAMPLES = 100
+
+# recent checkouts kept for percentiles
+SAMPLES = 1000
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _endpoint():
+    if has_request_context():
+        return request.endpoint or '<unmatched>'
+    return '<no request>'
+
+
+class PoolTelemetry:
+    """Counters for one pool."""
+
+    def __init__(self, settings, long_hold):
+        self.settings = settings
+        self.long_hold = long_hold
+
+        self._lock = threading.Lock()
+        self._held = {}
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waits = collections.deque(maxlen=SAMPLES)
+        self.in_use_samples = collections.deque(maxlen=SAMPLES)
+        self.endpoints = {}
+
+    def _endpoint_totals(self, endpoint):
+        return self.endpoints.setdefault(endpoint, dict(
+            checkouts=0, timeouts=0, wait_seconds=0.0, max_wait=0.0,
+            held_seconds=0.0, max_held=0.0, long_holds=0))
+
+    def checked_out(self, record, endpoint):
+        with self._lock:
+            self._held[id(record)] = (time.perf_counter(), endpoint)
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.in_use_samples.append(self.in_use)
+            self._endpoint_totals(endpoint)['checkouts'] += 1
+
+    def waited(self, endpoint, seconds):
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            self.waits.append(seconds)
+
+            totals = self._endpoint_totals(endpoint)
+            totals['wait_seconds'] += seconds
+            totals['max_wait'] = max(totals['max_wait'], seconds)
+
+    def connected(self):
+        with self._lock:
+            self.connects += 1
+
+    # pool event listeners
+
+    def on_connect(self, dbapi_connection, record):
+        self.connected()
+
+    def on_checkout(self, dbapi_connection, record, proxy):
+        self.checked_out(record, _endpoint())
+
+    def on_checkin(self, dbapi_connection, record):
+        endpoint, held = self.checked_in(record)
+
+        if held > self.long_hold:
+            logger.warning(json.dumps(dict(endpoint=endpoint,
+                                           held_ms=round(held * 1000, 2))))
+
+    EVENTS = ('connect', 'checkout', 'checkin')
+
+    def listen(self, pool):
+        for name in self.EVENTS:
+            event.listen(pool, name, getattr(self, f'on_{name}'))
+
+    def unlisten(self, pool):
+        for name in self.EVENTS:
+            event.remove(pool, name, getattr(self, f'on_{name}'))
+
+    def timed_out(self, endpoint):
+        with self._lock:
+            self.timeouts += 1
+            self._endpoint_totals(endpoint)['timeouts'] += 1
+
+    def checked_in(self, record):
+        """Record a connection's return; returns (endpoint, seconds held)."""
+
+        with self._lock:
+            held = self._held.pop(id(record), None)
+            if held is None:
+                return None, 0.0
+
+            started, endpoint = held
+            seconds = time.perf_counter() - started
+            self.in_use -= 1
+
+            totals = self._endpoint_totals(endpoint)
+            totals['held_seconds'] += seconds
+            totals['max_held'] = max(totals['max_held'], seconds)
+            if seconds > self.long_hold:
+                totals['long_holds'] += 1
+
+            return endpoint, seconds
+
+    def snapshot(self):
+        with self._lock:
+            return dict(
+                settings=self.settings,
+                checkouts=self.checkouts,
+                connects=self.connects,
+                timeouts=self.timeouts,
+                in_use=self.in_use,
+                peak_in_use=self.peak_in_use,
+                p95_in_use=percentile(self.in_use_samples, 95),
+                mean_wait_ms=(self.wait_seconds * 1000 / self.checkouts
+                              if self.checkouts else 0),
+                p95_wait_ms=percentile(self.waits, 95) * 1000,
+                max_wait_ms=self.max_wait * 1000,
+                endpoints=sorted(
+                    (dict(endpoint=endpoint,
+                          checkouts=t['checkouts'],
+                          timeouts=t['timeouts'],
+                          mean_wait_ms=(t['wait_seconds'] * 1000 / t['checkouts']
+                                        if t['checkouts'] else 0),
+                          max_wait_ms=t['max_wait'] * 1000,
+                          mean_held_ms=(t['held_seconds'] * 1000 / t['checkouts']
+                                        if t['checkouts'] else 0),
+                          max_held_ms=t['max_held'] * 1000,
+                          long_holds=t['long_holds'])
+                     for endpoint, t in self.endpoints.items()),
+                    key=lambda row: row['max_held_ms'], reverse=True),
+            )
+
+
+class InstrumentedPool:
+    """Mixin timing checkouts and holds of the pool class it's mixed into:
+    waits around ``connect()``, the rest from the pool's events.
+
+    Use ``instrumented(poolclass)`` to make the subclass.
+    """
+
+    long_hold = DEFAULTS['POOL_STATS_LONG_HOLD']
+
+    def __init__(self, creator, **kw):
+        super().__init__(creator, **kw)
+
+        settings = {name: kw[name] for name in
+                    ('pool_size', 'max_overflow', 'timeout', 'recycle', 'pre_ping')
+                    if name in kw}
+        self.telemetry = PoolTelemetry(settings, self.long_hold)
+        self.telemetry.listen(self)
+
+    def connect(self):
+        endpoint = _endpoint()
+        started = time.perf_counter()
+
+        try:
+            conn = super().connect()
+        except exc.TimeoutError:
+            self.telemetry.timed_out(endpoint)
+            raise
+
+        waited = time.perf_counter() - started
+        self.telemetry.waited(endpoint, waited)
+
+        if has_request_context():
+            g.pool_wait = g.get('pool_wait', 0.0) + waited
+
+        return conn
+
+    def recreate(self):
+        # the new pool is handed our listeners along with the rest of our
+        # event dispatch; keep counting into the same telemetry
+        pool = super().recreate()
+        pool.telemetry.unlisten(pool)
+        pool.telemetry = self.telemetry
+        return pool
+
+
+_instrumented = {}
+_instrumented_lock = threading.Lock()
+
+
+def instrumented(poolclass, long_hold=DEFAULTS['POOL_STATS_LONG_HOLD']):
+    """An InstrumentedPool subclass of `poolclass`."""
+
+    if issubclass(poolclass, InstrumentedPool):
+        return poolclass
+
+    with _instrumented_lock:
+        key = (poolclass, long_hold)
+        if key not in _instrumented:
+            _instrumented[key] = type(f"Instrumented{poolclass.__name__}",
+                                      (InstrumentedPool, poolclass),
+                                      dict(long_hold=long_hold))
+        return _instrumented[key]
+
+
+def configure_pool(app, url, options):
+    """Apply the sizing policy (and instrumentation) to `options`, the
+    keyword arguments an engine for `url` is about to be created with."""
+
+    config = {key: app.config.get(key, default) for key, default in DEFAULTS.items()}
+    poolclass = options.get('poolclass') or url.get_dialect().get_pool_class(url)
+
+    if issubclass(poolclass, QueuePool):
+        options.setdefault('pool_size', config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', config['DB_POOL_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+
+    # a NullPool connects afresh every time: nothing to ping or recycle
+    if not issubclass(poolclass, NullPool):
+        options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])
+        if config['DB_POOL_RECYCLE'] is not None:
+            options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+
+    if config['POOL_STATS_ENABLED']:
+        options['poolclass'] = instrumented(poolclass,
+                                            config['POOL_STATS_LONG_HOLD'])
+
+    return options
+
+
+def recommend(stats):
+    """Suggested sizes and notes for a pool, from its telemetry snapshot."""
+
+    settings = stats['settings']
+    size = settings.get('pool_size')
+    notes = []
+    suggested = None
+
+    if size is not None and stats['checkouts'] >= MIN_SAMPLES:
+        # enough connections for the usual load, overflow for the peak plus
+        # half again
+        pool_size = max(1, stats['p95_in_use'])
+        max_overflow = max(0, math.ceil(stats['peak_in_use'] * 1.5) - pool_size)
+        suggested = dict(pool_size=pool_size, max_overflow=max_overflow)
+
+        if pool_size < size / 2:
+            notes.append(f"At most {pool_size} of {size} pooled connections "
+                         "are usually in use; the pool can shrink.")
+    elif size is not None:
+        notes.append(f"Only {stats['checkouts']} checkouts so far; "
+                     f"sizes are suggested after {MIN_SAMPLES}.")
+
+    if stats['timeouts']:
+        notes.append(f"{stats['timeouts']} checkouts timed out after "
+                     f"{settings.get('timeout')}s: raise max_overflow, or hold "
+                     "connections for less time.")
+
+    if stats['p95_wait_ms'] >= 10:
+        notes.append(f"5% of checkouts waited {stats['p95_wait_ms']:.0f}ms or "
+                     "more for a connection.")
+
+    for row in stats['endpoints']:
+        if row['long_holds']:
+            notes.append(f"{row['endpoint']} held a connection for up to "
+                         f"{row['max_held_ms']:.0f}ms ({row['long_holds']} "
+                         "times); finish the transaction before slow work "
+                         "such as password hashing.")
+
+    return dict(suggested=suggested, notes=notes)
+
+
+class PoolStats:
+    """Flask extension reporting on the pools of a Flask-SQLAlchemy `db`.
+
+    The pools themselves are set up by ``configure_pool``, which `db` calls
+    as it creates each engine.
+    """
+
+    def __init__(self, app=None, db=None):
+        self.reports = {}
+
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        for key, value in DEFAULTS.items():
+            app.config.setdefault(key, value)
+
+        self.app = app
+        self.db = db
+
+        app.after_request(self._add_timing)
+        app.add_url_rule('/__pool_stats', 'pool_stats', self.report_view)
+
+    def add_report(self, name, stats):
+        """Include `stats()` in the report as `name`."""
+
+        self.reports[name] = stats
+
+    def _add_timing(self, response):
+        waited = g.get('pool_wait')
+        if waited is not None:
+            response.headers.add('Server-Timing',
+                                 f'db-pool;dur={waited * 1000:.1f};desc="pool wait"')
+        return response
+
+    def pools(self):
+        """(name, pool) for the primary database and each bind."""
+
+        binds = [None] + sorted(self.app.config.get('SQLALCHEMY_BINDS') or {})
+        return [(bind or 'primary', self.db.get_engine(self.app, bind=bind).pool)
+                for bind in binds]
+
+    def report(self):
+        rows = []
+
+        for name, pool in self.pools():
+            row = dict(name=name, pool=pool.status())
+
+            telemetry = getattr(pool, 'telemetry', None)
+            if telemetry is not None:
+                stats = telemetry.snapshot()
+                row.update(stats, recommendation=recommend(stats))
+
+            rows.append(row)
+
+        return rows
+
+    def report_view(self):
+        """JSON report of pool use (if POOL_STATS_REPORT is on)."""
+
+        if not self.app.config['POOL_STATS_REPORT']:
+            abort(404)
+
+        return jsonify(pools=self.report(),
+                       **{name: stats() for name, stats in self.reports.items()})
@@ -0,0 +1,253 @@
+"""Rate limiting for Warbler's expensive write endpoints.
+
+Every login and signup attempt costs a bcrypt hash, so a credential
+stuffing run against ``/login`` can keep every CPU busy. ``RateLimiter``
+answers over-limit requests with ``429 Too Many Requests`` and a
+``Retry-After`` header before any other request hook runs: before the
+logged-in user is loaded, before a database connection is taken and long
+before bcrypt.
+
+``RATE_LIMITS`` maps endpoints to rules of ``(scope, policy, limit,
+seconds)``. A request must pass every rule of its endpoint. Scopes are
+
+    ip          the client address (wrap the app in werkzeug's ProxyFix
+                when it runs behind a proxy)
+    username    the ``username`` form field, lowercased
+    user        the logged-in user's id, from the session
+
+and policies are
+
+    bucket      a token bucket: `limit` requests at once, refilled evenly
+                over `seconds`; absorbs bursts, caps the sustained rate
+    window      a sliding window: at most `limit` requests in any
+                `seconds`, estimated from the current and previous fixed
+                windows
+
+State lives in a SQLite file (``RATE_LIMIT_DB``), so every worker process
+on a host shares the same counts; each request checks and updates its
+rules in one transaction. If the store can't be used the request is let
+through and the error logged, since rate limiting shouldn't take the site
+down.
+
+Config (defaults set by ``init_app``):
+
+    RATE_LIMIT_ENABLED      check limits at all (True)
+    RATE_LIMIT_DB           the shared state file
+                            (instance/rate_limits.sqlite3)
+    RATE_LIMIT_METHODS      methods that are limited (POST)
+    RATE_LIMITS             endpoint -> rules (DEFAULT_LIMITS)
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import request, session
+
+logger = logging.getLogger('warbler.rate_limit')
+
+DEFAULT_LIMITS = {
+    'login': [('ip', 'bucket', 20, 60),
+              ('username', 'window', 10, 300)],
+    'signup': [('ip', 'window', 10, 3600)],
+    'messages_add': [('user', 'bucket', 30, 60)],
+}
+
+# Writes between deletions of expired state
+PURGE_EVERY = 1000
+
+
+def token_bucket(state, now, limit, seconds):
+    """(new state, retry after, expires) for one request; retry after is
+    0 if the request is allowed."""
+
+    rate = limit / seconds
+    tokens, updated = state[:2] if state else (limit, now)
+    tokens = min(limit, tokens + (now - updated) * rate)
+
+    if tokens < 1:
+        return None, (1 - tokens) / rate, None
+
+    tokens -= 1
+    return (tokens, now, 0), 0, now + (limit - tokens) / rate
+
+
+def sliding_window(state, now, limit, seconds):
+    """As token_bucket(), for a sliding window."""
+
+    window = now - now % seconds
+    start, current, previous = state if state else (window, 0, 0)
+
+    if start != window:
+        previous = current if start == window - seconds else 0
+        current = 0
+
+    weight = 1 - (now - window) / seconds
+
+    if previous * weight + current + 1 <= limit:
+        return (window, current + 1, previous), 0, window + 2 * seconds
+
+    if current + 1 > limit or not previous:
+        return None, window + seconds - now, None
+
+    # when the previous window's share has shrunk enough
+    weight_needed = (limit - current - 1) / previous
+    return None, window + seconds * (1 - weight_needed) - now, None
+
+
+POLICIES = {
+    'bucket': token_bucket,
+    'window': sliding_window,
+}
+
+
+class SQLiteStore:
+    """Rate limit state shared through a SQLite file."""
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=self.timeout,
+                               isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_limits ('
+                     'key TEXT PRIMARY KEY, a REAL, b REAL, c REAL, '
+                     'expires REAL NOT NULL)')
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def hit(self, checks, now):
+        """Count a request against `checks` of (key, policy, limit,
+        seconds), if all allow it; returns seconds to wait, or 0."""
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+
+        try:
+            updates = []
+            wait = 0
+
+            for key, policy, limit, seconds in checks:
+                row = conn.execute('SELECT a, b, c, expires FROM rate_limits '
+                                   'WHERE key = ?', (key,)).fetchone()
+                state = row[:3] if row and row[3] > now else None
+
+                state, retry_after, expires = policy(state, now, limit, seconds)
+                wait = max(wait, retry_after)
+                updates.append((key, *(state or ()), expires))
+
+            if wait:
+                conn.execute('ROLLBACK')
+                return wait
+
+            conn.executemany('INSERT OR REPLACE INTO rate_limits '
+                             '(key, a, b, c, expires) VALUES (?, ?, ?, ?, ?)',
+                             updates)
+
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                conn.execute('DELETE FROM rate_limits WHERE expires < ?', (now,))
+
+            conn.execute('COMMIT')
+            return 0
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def clear(self):
+        self._connect().execute('DELETE FROM rate_limits')
+
+
+class RateLimiter:
+    """Flask extension rejecting requests over their endpoint's limits."""
+
+    def __init__(self, app=None, session_key=None):
+        self.checked = 0
+        self.rejected = 0
+        self.errors = 0
+
+        if app is not None:
+            self.init_app(app, session_key)
+
+    def init_app(self, app, session_key=None):
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMIT_DB', os.path.join(
+            app.instance_path, 'rate_limits.sqlite3'))
+        app.config.setdefault('RATE_LIMIT_METHODS', ('POST',))
+        app.config.setdefault('RATE_LIMITS', DEFAULT_LIMITS)
+
+        self.app = app
+        self.session_key = session_key
+        self.store = SQLiteStore(app.config['RATE_LIMIT_DB'])
+
+        # ahead of every other hook, so rejecting costs no database work
+        app.before_request_funcs.setdefault(None, []).insert(0, self.check)
+
+    def scope_value(self, scope):
+        """This request's key for `scope`, or None if it has none."""
+
+        if scope == 'ip':
+            return request.remote_addr
+        if scope == 'username':
+            return request.form.get('username', '').strip().lower() or None
+        if scope == 'user':
+            return session.get(self.session_key)
+        raise ValueError(f"Unknown rate limit scope: {scope}")
+
+    def check(self):
+        config = self.app.config
+
+        if (not config['RATE_LIMIT_ENABLED']
+                or request.method not in config['RATE_LIMIT_METHODS']):
+            return None
+
+        checks = []
+
+        for scope, policy, limit, seconds in config['RATE_LIMITS'].get(
+                request.endpoint, ()):
+            value = self.scope_value(scope)
+            if value is not None:
+                checks.append((f"{request.endpoint}:{scope}:{policy}:{value}",
+                               POLICIES[policy], limit, seconds))
+
+        if not checks:
+            return None
+
+        self.checked += 1
+
+        try:
+            wait = self.store.hit(checks, time.time())
+        except sqlite3.Error:
+            self.errors += 1
+            logger.exception("Rate limit store failed; letting the request through")
+            return None
+
+        if not wait:
+            return None
+
+        self.rejected += 1
+        return ("Too many requests; please try again later.", 429,
+                {'Retry-After': str(math.ceil(wait))})
+
+    def stats(self):
+        return dict(checked=self.checked, rejected=self.rejected,
+                    errors=self.errors)
@@ -0,0 +1,113 @@
+"""Read-replica routing for Warbler.
+
+Replicas are extra Flask-SQLAlchemy binds named ``replica_*``. For each GET
+or HEAD request one replica is picked, and the session sends that request's
+reads to it; everything else goes to the primary:
+
+- flushes and INSERT/UPDATE/DELETE statements (the rest of the request
+  then stays on the primary, so it reads its own writes),
+- raw SQL, which can't be told apart,
+- every request of a user who has just written something: after a write
+  request (POST, PUT, DELETE) their reads stick to the primary for
+  ``REPLICA_STICKY_SECONDS``, so that replication lag can't hide their own
+  new message, follow or like from them.
+
+Config:
+
+    DATABASE_REPLICA_URLS   replica database URLs; become binds
+                            replica_0, replica_1, ... ([])
+    REPLICA_STICKY_SECONDS  how long writers read from the primary (5)
+"""
+
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+
+import pool_stats
+
+REPLICA_PREFIX = 'replica_'
+READ_METHODS = ('GET', 'HEAD')
+
+# session key: time until which this client reads from the primary
+STICKY_KEY = 'primary_until'
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads to the request's replica, if it has one."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not has_request_context():
+            return super().get_bind(mapper, clause)
+
+        if (self._flushing or isinstance(clause, (UpdateBase, TextClause))):
+            g.db_wrote = True
+            g.db_replica = None
+
+        replica = g.get('db_replica')
+
+        if replica is not None:
+            return get_state(self.app).db.get_engine(self.app, bind=replica)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose sessions can read from replicas, and whose engines'
+    pools are sized and instrumented by pool_stats."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        rv = super().apply_driver_hacks(app, info, options)
+        pool_stats.configure_pool(app, info, options)
+        return rv
+
+
+def replica_binds(app):
+    return sorted(key for key in (app.config.get('SQLALCHEMY_BINDS') or {})
+                  if key.startswith(REPLICA_PREFIX))
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE_REPLICA_URLS', [])
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for i, url in enumerate(app.config['DATABASE_REPLICA_URLS']):
+        binds[f"{REPLICA_PREFIX}{i}"] = url
+    app.config['SQLALCHEMY_BINDS'] = binds or None
+
+    app.before_request(choose_bind)
+    app.after_request(stick_to_primary)
+
+
+def choose_bind():
+    """Pick a replica for a read request, unless this client just wrote."""
+
+    g.db_replica = None
+
+    if request.method not in READ_METHODS:
+        return
+
+    if session.get(STICKY_KEY, 0) > time.time():
+        return
+
+    binds = replica_binds(current_app)
+    if binds:
+        g.db_replica = random.choice(binds)
+
+
+def stick_to_primary(response):
+    """After a write request, read from the primary for a while."""
+
+    if (g.get('db_wrote') and request.method not in READ_METHODS
+            and replica_binds(current_app)):
+        session[STICKY_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+
+    return response
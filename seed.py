@@ -1,20 +1,22 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+import bulk_load
+import counters
+import message_scores
+import migrations
+import user_search
 
 
 db.drop_all()
 db.create_all()
+migrations.stamp(db.engine)
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+bulk_load.load_all(db.engine, 'generator')
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+counters.recount()
+counters.recount_likes()
+user_search.reindex_all()
+message_scores.rebuild()
 
 db.session.commit()
@@ -0,0 +1,206 @@
+"""Per-request SQL statistics for Warbler.
+
+``SQLStats`` listens to SQLAlchemy engine events and, for each request,
+counts and times every statement sent to the database. Statements are
+fingerprinted (literals, bind parameters and IN lists collapsed) so that
+the same statement shape repeated many times in one request -- the usual
+sign of an N+1 query from lazy loading in a loop -- can be flagged.
+
+Each response gets ``X-SQL-Queries`` and ``X-SQL-Time`` headers (and a
+``Server-Timing`` entry), one structured log line is written per request,
+and totals per endpoint are kept for the ``/__sql_stats`` report. None of
+this needs the debug toolbar.
+
+Config:
+
+    SQL_STATS_ENABLED       record statements at all (True)
+    SQL_STATS_HEADERS       add the response headers (True)
+    SQL_STATS_REPORT        serve /__sql_stats; 404 otherwise (False)
+    SQL_STATS_N_PLUS_ONE    repeats of one shape that count as N+1 (5)
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+
+from flask import g, has_request_context, jsonify, abort, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('warbler.sql')
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def fingerprint(statement):
+    """The shape of a SQL statement, with all values replaced by '?'.
+
+    >>> fingerprint("SELECT * FROM users WHERE id IN (%(id_1)s, %(id_2)s)")
+    'SELECT * FROM users WHERE id IN (?)'
+    """
+
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _STRING.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    shape = _PARAM.sub('?', shape)
+    return _LIST.sub('(?)', shape)
+
+
+class RequestStats:
+    """Statements seen during one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = {}
+
+    def add(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        shape = fingerprint(statement)
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def repeated(self, threshold):
+        """Statement shapes run at least `threshold` times: likely N+1s."""
+
+        return {shape: count for shape, count in self.shapes.items()
+                if count >= threshold}
+
+
+class SQLStats:
+    """Flask extension recording SQL counts and timings per request."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self._listening = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_STATS_ENABLED', True)
+        app.config.setdefault('SQL_STATS_HEADERS', True)
+        app.config.setdefault('SQL_STATS_REPORT', False)
+        app.config.setdefault('SQL_STATS_N_PLUS_ONE', 5)
+
+        self.app = app
+
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+            self._listening = True
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/__sql_stats', 'sql_stats', self.report_view)
+
+    # Engine events
+
+    # The start time is kept on the statement's execution context, which
+    # goes away with it: a statement that raises never gets here again.
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        if context is not None:
+            context._sql_stats_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        if not has_request_context():
+            return
+
+        stats = g.get('sql_stats')
+        if stats is not None:
+            started = getattr(context, '_sql_stats_started', None)
+            seconds = 0.0 if started is None else time.perf_counter() - started
+            stats.add(statement, seconds)
+
+    # Request hooks
+
+    def _start_request(self):
+        if self.app.config['SQL_STATS_ENABLED']:
+            g.sql_stats = RequestStats()
+
+    def _finish_request(self, response):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+
+        config = self.app.config
+        millis = stats.seconds * 1000
+        repeated = stats.repeated(config['SQL_STATS_N_PLUS_ONE'])
+        endpoint = request.endpoint or '<unmatched>'
+
+        if config['SQL_STATS_HEADERS']:
+            response.headers['X-SQL-Queries'] = str(stats.queries)
+            response.headers['X-SQL-Time'] = f"{millis:.1f}ms"
+            response.headers.add('Server-Timing',
+                                 f'sql;dur={millis:.1f};desc="{stats.queries} queries"')
+
+        logger.log(logging.WARNING if repeated else logging.INFO,
+                   json.dumps(dict(method=request.method,
+                                   path=request.path,
+                                   endpoint=endpoint,
+                                   status=response.status_code,
+                                   queries=stats.queries,
+                                   sql_ms=round(millis, 2),
+                                   n_plus_one=repeated)))
+
+        self._record(endpoint, stats, repeated)
+        return response
+
+    # Aggregates
+
+    def _record(self, endpoint, stats, repeated):
+        with self._lock:
+            totals = self.endpoints.setdefault(endpoint, dict(
+                requests=0, queries=0, max_queries=0, sql_seconds=0.0,
+                n_plus_one={}))
+
+            totals['requests'] += 1
+            totals['queries'] += stats.queries
+            totals['max_queries'] = max(totals['max_queries'], stats.queries)
+            totals['sql_seconds'] += stats.seconds
+
+            for shape, count in repeated.items():
+                seen = totals['n_plus_one'].setdefault(
+                    shape, dict(requests=0, max_repeats=0))
+                seen['requests'] += 1
+                seen['max_repeats'] = max(seen['max_repeats'], count)
+
+    def report(self):
+        """Totals per endpoint, busiest (by SQL time) first."""
+
+        with self._lock:
+            rows = [
+                dict(endpoint=endpoint,
+                     requests=t['requests'],
+                     mean_queries=t['queries'] / t['requests'],
+                     max_queries=t['max_queries'],
+                     mean_sql_ms=t['sql_seconds'] * 1000 / t['requests'],
+                     total_sql_ms=t['sql_seconds'] * 1000,
+                     n_plus_one=[dict(statement=shape, **seen)
+                                 for shape, seen in t['n_plus_one'].items()])
+                for endpoint, t in self.endpoints.items()
+            ]
+
+        return sorted(rows, key=lambda row: row['total_sql_ms'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self.endpoints.clear()
+
+    def report_view(self):
+        """JSON report of SQL use per endpoint (if SQL_STATS_REPORT is on)."""
+
+        if not self.app.config['SQL_STATS_REPORT']:
+            abort(404)
+
+        return jsonify(endpoints=self.report())
@@ -0,0 +1,36 @@
+// Infinite scroll for message lists: when the "Older messages" link at the
+// bottom of a list scrolls into view (or is clicked), replace it with the
+// next page fragment. Without JS the link just loads the next full page.
+
+$(function () {
+  function loadMore(link) {
+    var $link = $(link);
+
+    if ($link.data('loading')) return;
+    $link.data('loading', true);
+
+    $.get($link.data('fragment')).then(function (html) {
+      $link.closest('li').replaceWith(html);
+      watch();
+    });
+  }
+
+  var observer = 'IntersectionObserver' in window && new IntersectionObserver(
+    function (entries) {
+      entries.forEach(function (entry) {
+        if (entry.isIntersecting) loadMore(entry.target);
+      });
+    });
+
+  function watch() {
+    if (!observer) return;
+    $('#messages a.load-more').each(function () { observer.observe(this); });
+  }
+
+  $('#messages').on('click', 'a.load-more', function (evt) {
+    evt.preventDefault();
+    loadMore(this);
+  });
+
+  watch();
+});
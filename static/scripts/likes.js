@@ -0,0 +1,34 @@
+// Like buttons: toggle through the JSON like API instead of posting the
+// form and reloading the timeline. Without JS the form still works.
+
+$(function () {
+  var HEART = '<i class="bi bi-heart" style="font-style:normal">&#128155;</i>';
+
+  $('#messages').on('submit', 'form.like-form', function (evt) {
+    evt.preventDefault();
+
+    var $form = $(this);
+    if ($form.data('busy')) return;
+    $form.data('busy', true);
+
+    var liked = $form.attr('data-liked') === 'true';
+
+    $.ajax({
+      url: $form.data('like-url'),
+      method: liked ? 'DELETE' : 'PUT',
+      dataType: 'json'
+    }).then(function (resp) {
+      var $item = $form.closest('li');
+
+      $form.attr('data-liked', resp.liked ? 'true' : 'false');
+      $form.find('button')
+        .toggleClass('btn-primary', resp.liked)
+        .toggleClass('btn-secondary', !resp.liked);
+
+      $item.find('.message-area .bi-heart').remove();
+      if (resp.liked) $item.find('.message-area .text-muted').first().after(HEART);
+    }).always(function () {
+      $form.data('busy', false);
+    });
+  });
+});
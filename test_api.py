@@ -0,0 +1,175 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python3 -m unittest test_api.py
+
+
+from app import app, CURR_USER_KEY, user_cache
+import json
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Follows, Likes, Message, User
+from pagination import PAGE_SIZE
+import api
+import counters
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiTestCase(TestCase):
+    """Test the JSON timeline, profile and list endpoints."""
+
+    def setUp(self):
+        """u1 has a page and a bit of messages; u2 follows u1 and likes
+        their newest message."""
+
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        u1 = User(email="u1@test.com", username="u1", password="HASHED_PASSWORD",
+                  bio="first")
+        u2 = User(email="u2@test.com", username="u2", password="HASHED_PASSWORD")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.u1_id, self.u2_id = u1.id, u2.id
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all([Message(text=f"msg {i}", user_id=self.u1_id,
+                                    timestamp=start + timedelta(minutes=i))
+                            for i in range(PAGE_SIZE + 5)])
+        db.session.add(Follows(user_following_id=self.u2_id,
+                               user_being_followed_id=self.u1_id))
+        db.session.commit()
+
+        self.newest_id = (Message.query
+                          .order_by(Message.timestamp.desc()).first().id)
+        db.session.add(Likes(user_id=self.u2_id, message_id=self.newest_id))
+        db.session.commit()
+
+        counters.recount()
+        counters.recount_likes()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def get(self, url, status=200):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status)
+        self.assertEqual(resp.mimetype, 'application/json')
+        return json.loads(resp.get_data(as_text=True))
+
+    def walk(self, url):
+        """Every message on every page of a list, and the page count."""
+
+        items = []
+        pages = 0
+
+        while url:
+            page = self.get(url)
+            items.extend(page['messages'])
+            pages += 1
+            url = page['next']
+
+        return items, pages
+
+    def test_user_messages_paged(self):
+        """Are a user's messages paged newest first by the cursor?"""
+
+        items, pages = self.walk(f'/api/users/{self.u1_id}/messages')
+
+        self.assertEqual(pages, 2)
+        self.assertEqual([item['text'] for item in items],
+                         [f"msg {i}" for i in reversed(range(PAGE_SIZE + 5))])
+        self.assertEqual(set(items[0]), {'id', 'text', 'timestamp', 'likes', 'user'})
+        self.assertEqual(items[0]['user'], dict(id=self.u1_id, username='u1',
+                                                image_url="/static/images/default-pic.png"))
+        self.assertEqual(items[0]['likes'], 1)
+        self.assertEqual(items[0]['timestamp'][:16], '2020-01-01T01:44')
+
+        self.assertEqual(self.get(f'/api/users/{self.u1_id}/messages?before=bogus',
+                                  400)['error'], "Bad cursor: 'bogus'")
+
+    def test_sparse_fields(self):
+        """Do responses hold just the requested fields, across pages?"""
+
+        items, _ = self.walk(
+            f'/api/users/{self.u1_id}/messages?fields=text,user.username')
+
+        self.assertEqual(len(items), PAGE_SIZE + 5)
+        self.assertEqual(items[0], dict(text=f"msg {PAGE_SIZE + 4}",
+                                        user=dict(username='u1')))
+        self.assertEqual(items[-1], dict(text="msg 0", user=dict(username='u1')))
+
+        page = self.get(f'/api/users/{self.u1_id}/messages?fields=id,user')
+        self.assertEqual(set(page['messages'][0]['user']), set(api.USER_FIELDS))
+
+        error = self.get(f'/api/users/{self.u1_id}/messages?fields=id,password', 400)
+        self.assertEqual(error, dict(error="Unknown field: password"))
+
+    def test_timeline(self):
+        """Is g.user's timeline served, with their likes, before and after
+        it's materialized?"""
+
+        self.assertEqual(self.get('/api/timeline', 401),
+                         dict(error="Access unauthorized."))
+
+        self.login(self.u2_id)
+
+        for _ in range(2):
+            page = self.get('/api/timeline?fields=id,liked')
+            self.assertEqual(len(page['messages']), PAGE_SIZE)
+            self.assertEqual(page['messages'][0], dict(id=self.newest_id, liked=True))
+            self.assertFalse(page['messages'][1]['liked'])
+
+        # past the first page, which the timeline was materialized from
+        items, pages = self.walk('/api/timeline?fields=id')
+        ids = [item['id'] for item in items]
+        self.assertEqual(pages, 2)
+        self.assertEqual(len(ids), PAGE_SIZE + 5)
+        self.assertEqual(ids, sorted(set(ids), reverse=True))
+        self.assertEqual(ids[0], self.newest_id)
+
+    def test_profile(self):
+        """Are profiles served with counts, and missing users 404s?"""
+
+        profile = self.get(f'/api/users/{self.u1_id}')
+        self.assertEqual(set(profile), set(api.USER_FIELDS))
+        self.assertEqual((profile['bio'], profile['messages_count'],
+                          profile['followers_count']), ('first', PAGE_SIZE + 5, 1))
+
+        self.assertEqual(self.get(f'/api/users/{self.u2_id}?fields=username,likes_count'),
+                         dict(username='u2', likes_count=1))
+
+        self.get('/api/users/9999', 404)
+        self.get('/api/users/9999/messages', 404)
+
+    def test_likes(self):
+        """Are a user's liked messages listed for logged-in viewers?"""
+
+        self.get(f'/api/users/{self.u2_id}/likes', 401)
+
+        self.login(self.u1_id)
+        page = self.get(f'/api/users/{self.u2_id}/likes?fields=id,liked')
+
+        self.assertEqual(page, dict(messages=[dict(id=self.newest_id, liked=False)],
+                                    before=None, next=None))
@@ -0,0 +1,123 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_assets.py
+
+
+from app import app, static_assets
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import render_template_string
+
+from assets import IMMUTABLE, build
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+CSS = b"""body { background: url("/static/images/bg.png"); }
+.nav { background: url('../images/bg.png'); }
+.ext { background: url(https://example.com/x.png); }
+""" * 20
+
+
+class AssetsTestCase(TestCase):
+    """Build a small static tree and serve it through the app."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.static = os.path.join(self.tmp.name, 'static')
+        self.dist = os.path.join(self.static, 'dist')
+
+        for path, data in [('images/bg.png', b'\x89PNG not really'),
+                           ('stylesheets/style.css', CSS)]:
+            os.makedirs(os.path.dirname(os.path.join(self.static, path)),
+                        exist_ok=True)
+            with open(os.path.join(self.static, path), 'wb') as f:
+                f.write(data)
+
+        self.manifest = build(self.static, self.dist)
+
+        self.directory = static_assets.directory
+        static_assets.directory = self.dist
+        static_assets.load()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        static_assets.directory = self.directory
+        static_assets.load()
+        self.tmp.cleanup()
+
+    def test_build(self):
+        """Are files copied under hashed names, with compressed variants?"""
+
+        css = self.manifest['stylesheets/style.css']
+        png = self.manifest['images/bg.png']
+
+        self.assertRegex(css, r'^stylesheets/style\.[0-9a-f]{10}\.css$')
+        self.assertTrue(os.path.isfile(os.path.join(self.dist, css + '.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.dist, png + '.gz')))
+
+        with open(os.path.join(self.dist, css), 'rb') as f:
+            built = f.read()
+
+        self.assertIn(f'url("../{png}")'.encode(), built)
+        self.assertIn(f"url('../{png}')".encode(), built)
+        self.assertIn(b'url(https://example.com/x.png)', built)
+
+        # a rebuild of unchanged files gives the same names
+        self.assertEqual(build(self.static, self.dist), self.manifest)
+
+    def test_asset_url(self):
+        """Do templates get hashed URLs for built files only?"""
+
+        with app.test_request_context():
+            urls = render_template_string(
+                "{{ asset_url('stylesheets/style.css') }} "
+                "{{ asset_url('/static/images/bg.png') }} "
+                "{{ asset_url('scripts/missing.js') }} "
+                "{{ asset_url('https://example.com/me.png') }}").split()
+
+        self.assertEqual(urls, [
+            f"/assets/{self.manifest['stylesheets/style.css']}",
+            f"/assets/{self.manifest['images/bg.png']}",
+            "/static/scripts/missing.js",
+            "https://example.com/me.png",
+        ])
+
+    def test_serve_compressed(self):
+        """Are built files immutable, and gzipped when accepted?"""
+
+        url = f"/assets/{self.manifest['stylesheets/style.css']}"
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Cache-Control'], IMMUTABLE)
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertIn(b'background', gzip.decompress(resp.data))
+
+        resp = self.client.get(url)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertIn(b'background', resp.data)
+
+    def test_serve_missing(self):
+        """Are unknown files, the manifest and paths outside 404s?"""
+
+        for url in ['/assets/nope.css', '/assets/manifest.json',
+                    '/assets/../../app.py']:
+            self.assertEqual(self.client.get(url).status_code, 404)
@@ -0,0 +1,72 @@
+"""Async serving mode tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_async_serving.py
+
+
+from unittest import TestCase
+
+from flask import Flask
+
+import async_serving
+
+
+class ConcurrencyGateTestCase(TestCase):
+    """Test the per-endpoint concurrency limits (without gevent)."""
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['ASYNC_ENDPOINTS'] = ['timeline']
+        app.config['ASYNC_READ_CONCURRENCY'] = 2
+        app.config['ASYNC_OTHER_CONCURRENCY'] = 1
+
+        self.held = {}
+
+        @app.route('/timeline')
+        def timeline():
+            self.held['timeline'] = self.free_slots()
+            return 'ok'
+
+        @app.route('/form')
+        def form():
+            self.held['form'] = self.free_slots()
+            return 'ok'
+
+        self.reads, self.others = async_serving.install(app)
+        self.client = app.test_client()
+
+    def free_slots(self):
+        """(reads, others) slots free right now."""
+
+        counts = []
+        for slot in (self.reads, self.others):
+            n = 0
+            while slot.acquire(blocking=False):
+                n += 1
+            for _ in range(n):
+                slot.release()
+            counts.append(n)
+        return tuple(counts)
+
+    def test_allowed_endpoint_uses_read_slots(self):
+        """Does an allowed endpoint take a read slot, and give it back?"""
+
+        self.client.get('/timeline')
+
+        self.assertEqual(self.held['timeline'], (1, 1))
+        self.assertEqual(self.free_slots(), (2, 1))
+
+    def test_other_endpoint_limited(self):
+        """Does any other endpoint take the other slot?"""
+
+        self.client.get('/form')
+
+        self.assertEqual(self.held['form'], (2, 0))
+        self.assertEqual(self.free_slots(), (2, 1))
+
+    def test_slot_released_on_error(self):
+        """Is a slot given back when the view fails?"""
+
+        self.client.get('/missing')
+        self.assertEqual(self.free_slots(), (2, 1))
@@ -0,0 +1,174 @@
+"""Bulk CSV loader tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_bulk_load.py
+
+
+import io
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import create_engine, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+
+import bulk_load
+from models import db, Follows, Likes, Message, User
+
+CSVS = {
+    'users.csv': [
+        "email,username,image_url,password,bio,header_image_url,location",
+        "a@test.com,alice,,HASHED,\"Hi, I'm Alice\",,Oakland",
+        "b@test.com,bob,/static/images/default-pic.png,HASHED,,,",
+        "c@test.com,carol,,HASHED,,,Reno",
+    ],
+    'messages.csv': [
+        "text,timestamp,user_id",
+        "first,2020-01-01 10:00:00.123456,1",
+        "second,2020-01-01 10:00:00,1",
+        "third,2020-01-02T08:30:00,2",
+        "fourth,2020-01-03T08:30:00.5,3",
+        "fifth,2020-01-04 00:00:00,3",
+    ],
+    'follows.csv': [
+        "user_being_followed_id,user_following_id",
+        "1,2",
+        "1,3",
+        "2,1",
+    ],
+    'likes.csv': [
+        "user_id,message_id",
+        "2,1",
+        "3,1",
+        "1,3",
+        "2,5",
+    ],
+}
+
+
+class BulkLoadTestCase(TestCase):
+    """Test executemany loading into SQLite."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+        for name, lines in CSVS.items():
+            with open(os.path.join(self.tmp.name, name), 'w', newline='') as f:
+                f.write('\n'.join(lines) + '\n')
+
+        self.engine = create_engine(
+            f"sqlite:///{os.path.join(self.tmp.name, 'load.db')}")
+        self.tables = [table for _, table in bulk_load.LOAD_ORDER]
+        db.metadata.create_all(self.engine, tables=self.tables)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def count(self, table):
+        with self.engine.connect() as conn:
+            return conn.execute(select([func.count()]).select_from(table)).scalar()
+
+    def index_names(self, table):
+        return {index['name'] for index in inspect(self.engine).get_indexes(table.name)}
+
+    def test_load_all(self):
+        """Are every file's rows loaded, across chunks, with indexes rebuilt?"""
+
+        indexes = {table.name: self.index_names(table) for table in self.tables}
+        self.assertIn('ix_messages_user_timestamp', indexes['messages'])
+
+        counts = bulk_load.load_all(self.engine, self.tmp.name, chunk_size=2)
+
+        self.assertEqual(counts, dict(users=3, messages=5, follows=3, likes=4))
+
+        for table in self.tables:
+            self.assertEqual(self.count(table), counts[table.name])
+
+        with self.engine.connect() as conn:
+            alice = conn.execute(User.__table__.select()
+                                 .where(User.username == 'alice')).first()
+            self.assertEqual(alice.bio, "Hi, I'm Alice")
+            self.assertIsNone(alice.image_url)
+
+            first = conn.execute(Message.__table__.select()
+                                 .where(Message.text == 'first')).first()
+            self.assertEqual(first.timestamp, datetime(2020, 1, 1, 10, 0, 0, 123456))
+            self.assertEqual(first.user_id, 1)
+
+        for table in self.tables:
+            self.assertEqual(self.index_names(table), indexes[table.name])
+
+    def test_keep_indexes(self):
+        """Does a load that keeps its indexes leave them in place?"""
+
+        rows = bulk_load.load_csv(self.engine, Follows.__table__,
+                                  os.path.join(self.tmp.name, 'follows.csv'),
+                                  rebuild_indexes=False)
+
+        self.assertEqual(rows, 3)
+        self.assertIn('ix_follows_following', self.index_names(Follows.__table__))
+
+    def test_failed_load_rolled_back(self):
+        """Does a file that fails part way leave its table as it was?"""
+
+        with open(os.path.join(self.tmp.name, 'likes.csv'), 'a') as f:
+            f.write("2,1\n")
+
+        with self.assertRaises(IntegrityError):
+            bulk_load.load_csv(self.engine, Likes.__table__,
+                               os.path.join(self.tmp.name, 'likes.csv'),
+                               chunk_size=2)
+
+        self.assertEqual(self.count(Likes.__table__), 0)
+        self.assertIn('ix_likes_message_user', self.index_names(Likes.__table__))
+
+
+class ConvertersTestCase(TestCase):
+    """Test turning CSV strings into column values."""
+
+    def test_parse_timestamp(self):
+        """Are the generator's formats, with and without fractions, parsed?"""
+
+        for text, expected in [
+                ('2020-02-29 23:59:59.999999', datetime(2020, 2, 29, 23, 59, 59, 999999)),
+                ('2020-02-29 23:59:59', datetime(2020, 2, 29, 23, 59, 59)),
+                ('2020-02-29T00:00:00.5', datetime(2020, 2, 29, 0, 0, 0, 500000)),
+                ('2020-02-29T00:00:00', datetime(2020, 2, 29))]:
+            self.assertEqual(bulk_load.parse_timestamp(text), expected)
+
+        for text in ('2020-02-30 00:00:00', '2020-01-01', ''):
+            with self.assertRaises(ValueError):
+                bulk_load.parse_timestamp(text)
+
+    def test_converters(self):
+        """Are empty fields NULL, as COPY loads them, except in NOT NULL
+        text columns?"""
+
+        columns = ['text', 'timestamp', 'user_id']
+        convert = bulk_load._converters(Message.__table__, columns)
+
+        self.assertEqual([conv(value) for conv, value in
+                          zip(convert, ['', '2020-01-01 00:00:00', '007'])],
+                         ['', datetime(2020, 1, 1), 7])
+        self.assertEqual([conv(value) for conv, value in zip(convert, ['x', '', ''])],
+                         ['x', None, None])
+
+        with self.assertRaises(ValueError):
+            convert[2]('1.5')
+
+        [bio] = bulk_load._converters(User.__table__, ['bio'])
+        self.assertEqual((bio(''), bio('hi')), (None, 'hi'))
+
+    def test_progress(self):
+        """Is the final row count reported?"""
+
+        out = io.StringIO()
+        progress = bulk_load.Progress('messages', every=3600, out=out)
+        progress.add(5)
+        progress.add(2, force=True)
+
+        self.assertEqual(progress.rows, 7)
+        self.assertTrue(out.getvalue().startswith("messages: 7 rows"))
@@ -0,0 +1,111 @@
+"""User counter tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python3 -m unittest test_counters.py
+
+
+from app import app, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes
+import counters
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CountersTestCase(TestCase):
+    """Test denormalized user counters."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        u1 = User(email="u1@test.com", username="u1",
+                  password="HASHED_PASSWORD")
+        u2 = User(email="u2@test.com", username="u2",
+                  password="HASHED_PASSWORD")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counts(self, user_id):
+        user = User.query.get(user_id)
+        return {name: getattr(user, name) for name in counters.COUNTERS}
+
+    def test_write_paths_keep_counts(self):
+        """Do follows, messages and likes update counters?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            c.post('/messages/new', data={"text": "hello"})
+            msg_id = Message.query.one().id
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post(f'/users/follow/{self.u2_id}')
+            c.post(f'/users/add_like/{msg_id}')
+
+            self.assertEqual(self.counts(self.u1_id),
+                             dict(messages_count=0, following_count=1,
+                                  followers_count=0, likes_count=1))
+            self.assertEqual(self.counts(self.u2_id),
+                             dict(messages_count=1, following_count=0,
+                                  followers_count=1, likes_count=0))
+
+            c.post(f'/users/stop-following/{self.u2_id}')
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            c.post(f'/messages/{msg_id}/delete')
+
+        self.assertEqual(self.counts(self.u1_id),
+                         dict(messages_count=0, following_count=0,
+                              followers_count=0, likes_count=0))
+        self.assertEqual(self.counts(self.u2_id)['messages_count'], 0)
+
+    def test_recount(self):
+        """Does recount repair counters written around the app?"""
+
+        msg = Message(text="hello", user_id=self.u2_id)
+        db.session.add(msg)
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.u1_id))
+        db.session.commit()
+        db.session.add(Likes(user_id=self.u1_id, message_id=msg.id))
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.u2_id)['followers_count'], 0)
+
+        counters.recount()
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.u1_id),
+                         dict(messages_count=0, following_count=1,
+                              followers_count=0, likes_count=1))
+        self.assertEqual(self.counts(self.u2_id),
+                         dict(messages_count=1, following_count=0,
+                              followers_count=1, likes_count=0))
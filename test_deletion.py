@@ -0,0 +1,260 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python3 -m unittest test_deletion.py
+
+
+from app import app, CURR_USER_KEY, user_cache
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, DeletionJob, Follows, Likes, Message, Timeline, TimelineEntry, User
+import account_deletion
+import counters
+import timeline
+from pagination import PAGE_SIZE
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['ACCOUNT_PURGE_IN_BACKGROUND'] = False
+app.config['ACCOUNT_PURGE_PAUSE'] = 0
+
+
+class AccountDeletionTestCase(TestCase):
+    """Test hiding and purging deleted accounts."""
+
+    def setUp(self):
+        """u1 has messages liked by u2 and u3, who follow them; u1 follows
+        and likes u2."""
+
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        users = [User.signup(f"u{n}", f"u{n}@test.com", "password", None)
+                 for n in (1, 2, 3)]
+        db.session.commit()
+        self.u1_id, self.u2_id, self.u3_id = [user.id for user in users]
+
+        u1_messages = [Message(text=f"u1 says {n}", user_id=self.u1_id)
+                       for n in range(5)]
+        u2_message = Message(text="u2 says", user_id=self.u2_id)
+        db.session.add_all(u1_messages + [u2_message])
+        db.session.add_all([
+            Follows(user_following_id=self.u2_id, user_being_followed_id=self.u1_id),
+            Follows(user_following_id=self.u3_id, user_being_followed_id=self.u1_id),
+            Follows(user_following_id=self.u1_id, user_being_followed_id=self.u2_id),
+        ])
+        db.session.commit()
+
+        self.u1_message_ids = [msg.id for msg in u1_messages]
+        self.u2_message_id = u2_message.id
+
+        db.session.add_all(
+            [Likes(user_id=self.u2_id, message_id=msg_id)
+             for msg_id in self.u1_message_ids[:3]] +
+            [Likes(user_id=self.u3_id, message_id=msg_id)
+             for msg_id in self.u1_message_ids[3:]] +
+            [Likes(user_id=self.u1_id, message_id=self.u2_message_id)])
+        db.session.commit()
+
+        counters.recount()
+        counters.recount_likes()
+        db.session.commit()
+
+        # materialize u2's timeline, which then holds u1's messages
+        self.login(self.u2_id)
+        self.client.get('/')
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def delete_u1(self):
+        self.login(self.u1_id)
+        resp = self.client.post('/users/delete')
+        self.assertEqual(resp.status_code, 302)
+        return DeletionJob.query.one().id
+
+    def counts(self):
+        """Every user's and message's counters, as stored."""
+
+        return ([(user.id, [getattr(user, name) for name in counters.COUNTERS])
+                 for user in User.query.order_by(User.id)],
+                [(msg.id, msg.likes_count)
+                 for msg in Message.query.order_by(Message.id)])
+
+    def assert_purged(self):
+        self.assertIsNone(User.query.get(self.u1_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(TimelineEntry.query
+                         .filter((TimelineEntry.author_id == self.u1_id)
+                                 | (TimelineEntry.user_id == self.u1_id))
+                         .count(), 0)
+
+        # counters were kept right batch by batch
+        kept = self.counts()
+        counters.recount()
+        counters.recount_likes()
+        db.session.commit()
+        self.assertEqual(kept, self.counts())
+
+        u2 = User.query.get(self.u2_id)
+        self.assertEqual((u2.followers_count, u2.following_count,
+                          u2.likes_count), (0, 0, 0))
+
+    def test_hidden_at_once(self):
+        """Is a deleted account hidden before anything is purged?"""
+
+        self.delete_u1()
+
+        self.assertIsNotNone(User.query.get(self.u1_id).deleted_at)
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 5)
+
+        self.login(self.u2_id)
+
+        for url in [f'/users/{self.u1_id}', f'/users/{self.u1_id}/followers',
+                    f'/messages/{self.u1_message_ids[0]}']:
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.assertEqual(self.client.post(f'/users/follow/{self.u1_id}')
+                         .status_code, 404)
+        self.assertEqual(self.client.put(
+            f'/api/messages/{self.u1_message_ids[4]}/like').status_code, 200)
+        self.assertEqual(Likes.query.filter_by(
+            user_id=self.u2_id, message_id=self.u1_message_ids[4]).count(), 0)
+
+        home = self.client.get('/').get_data(as_text=True)
+        self.assertNotIn('u1 says', home)
+
+        users = self.client.get('/users').get_data(as_text=True)
+        self.assertNotIn('@u1<', users)
+        self.assertIn('@u2<', users)
+
+        following = self.client.get(f'/users/{self.u2_id}/followers')
+        self.assertNotIn('@u1<', following.get_data(as_text=True))
+
+    def test_feed_pages_past_hidden_author(self):
+        """Do a follower's pages carry on past a deleted author's messages,
+        before the purge has taken them off timelines?"""
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all(
+            [Message(text=f"u1 later {n}", user_id=self.u1_id,
+                     timestamp=start + timedelta(minutes=2 * n + 1))
+             for n in range(PAGE_SIZE + 10)] +
+            [Message(text=f"u3 later {n}", user_id=self.u3_id,
+                     timestamp=start + timedelta(minutes=2 * n))
+             for n in range(PAGE_SIZE + 10)] +
+            [Follows(user_following_id=self.u2_id, user_being_followed_id=self.u3_id)])
+        db.session.commit()
+
+        # rebuild u2's timeline with their whole feed, u1's messages among u3's
+        db.session.query(TimelineEntry).delete()
+        db.session.query(Timeline).delete()
+        timeline.build(self.u2_id, Message.query
+                       .order_by(Message.timestamp.desc(), Message.id.desc()).all())
+        db.session.commit()
+
+        self.delete_u1()
+        self.assertGreater(TimelineEntry.query.filter_by(author_id=self.u1_id).count(), 0)
+
+        self.login(self.u2_id)
+        url = '/api/timeline?fields=text'
+        texts = []
+        while url:
+            page = self.client.get(url).json
+            texts.extend(msg['text'] for msg in page['messages'])
+            url = page['next']
+
+        self.assertEqual(texts, ["u2 says"] +
+                         [f"u3 later {n}" for n in reversed(range(PAGE_SIZE + 10))])
+
+    def test_logged_out(self):
+        """Are the account's sessions and logins refused?"""
+
+        self.delete_u1()
+
+        self.login(self.u1_id)
+        self.assertEqual(self.client.post('/messages/new', data={"text": "hi"})
+                         .status_code, 302)
+        self.assertEqual(Message.query.filter_by(text="hi").count(), 0)
+
+        resp = self.client.post('/login', data={"username": "u1",
+                                                "password": "password"})
+        self.assertIn("Invalid credentials", resp.get_data(as_text=True))
+
+    def test_purge_in_batches(self):
+        """Does a job purge every row, a batch at a time?"""
+
+        job_id = self.delete_u1()
+
+        with app.app_context():
+            self.assertEqual(account_deletion.run_pending(batch_size=2), 1)
+
+        job = DeletionJob.query.get(job_id)
+        self.assertEqual(job.phase, 'account')
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(job.claimed_until)
+        # 5 likes of u1's messages and 5 messages take 3 batches of 2 each
+        self.assertGreaterEqual(job.batches, 3 + 3 + 5)
+        self.assert_purged()
+
+    def test_resume(self):
+        """Does an interrupted job carry on where it stopped?"""
+
+        job_id = self.delete_u1()
+
+        with app.app_context():
+            self.assertFalse(account_deletion.run_job(job_id, batch_size=2,
+                                                      max_batches=3))
+
+        job = DeletionJob.query.get(job_id)
+        self.assertEqual((job.phase, job.batches), ('likes_received', 3))
+        self.assertIsNone(job.finished_at)
+        self.assertIsNone(job.claimed_by)
+        self.assertIsNotNone(User.query.get(self.u1_id))
+
+        with app.app_context():
+            self.assertEqual(account_deletion.run_pending(batch_size=2), 1)
+
+        self.assert_purged()
+
+    def test_claimed_job_skipped(self):
+        """Is a job another runner holds left alone until its lease ends?"""
+
+        job_id = self.delete_u1()
+
+        job = DeletionJob.query.get(job_id)
+        job.claimed_by = 'another runner'
+        job.claimed_until = datetime.utcnow() + timedelta(minutes=1)
+        db.session.commit()
+
+        with app.app_context():
+            self.assertFalse(account_deletion.run_job(job_id))
+        self.assertEqual(Likes.query.count(), 6)
+
+        job = DeletionJob.query.get(job_id)
+        job.claimed_until = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+
+        with app.app_context():
+            self.assertTrue(account_deletion.run_job(job_id))
+        self.assert_purged()
@@ -0,0 +1,136 @@
+"""Message card fragment cache tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_fragment_cache.py
+
+
+from app import app, fragments, user_cache, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Likes, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+HEART = '&#128155;'
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test caching and invalidating rendered message cards."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+        fragments.clear()
+
+        self.client = app.test_client()
+
+        author = User(email="author@test.com", username="author",
+                      password="HASHED_PASSWORD")
+        fan = User(email="fan@test.com", username="fan",
+                   password="HASHED_PASSWORD")
+        db.session.add_all([author, fan])
+        db.session.flush()
+
+        m1 = Message(text="first post", user_id=author.id)
+        m2 = Message(text="second post", user_id=author.id)
+        db.session.add_all([m1, m2])
+        db.session.flush()
+
+        db.session.add(Likes(user_id=fan.id, message_id=m1.id))
+        db.session.commit()
+
+        self.author_id = author.id
+        self.fan_id = fan.id
+        self.m1_id = m1.id
+        self.m2_id = m2.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def get_as(self, user_id, url):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            return c.get(url).get_data(as_text=True)
+
+    def test_cards_rendered_once(self):
+        """Are cards reused across requests and viewers?"""
+
+        before = fragments.stats()
+
+        self.client.get(f'/users/{self.author_id}')
+        self.get_as(self.fan_id, f'/users/{self.fan_id}/likes')
+        self.client.get(f'/users/{self.author_id}')
+
+        after = fragments.stats()
+        self.assertEqual(after['misses'] - before['misses'], 2)
+        self.assertEqual(after['hits'] - before['hits'], 3)
+
+    def test_viewer_heart(self):
+        """Is the liked heart per viewer, on top of the shared card?"""
+
+        db.session.add(Follows(user_following_id=self.fan_id,
+                               user_being_followed_id=self.author_id))
+        db.session.commit()
+
+        author_home = self.get_as(self.author_id, '/')
+        fan_home = self.get_as(self.fan_id, '/')
+
+        self.assertIn('first post', author_home)
+        self.assertNotIn(HEART, author_home)
+
+        # the heart lands in the card for the message the fan liked
+        self.assertEqual(fan_home.count(HEART), 1)
+        first = fan_home.index('first post')
+        self.assertLess(fan_home.rindex('message-area', 0, first),
+                        fan_home.index(HEART))
+        self.assertLess(fan_home.index(HEART), first)
+
+    def test_author_edit(self):
+        """Does changing the author's username re-render their cards?"""
+
+        self.client.get(f'/users/{self.author_id}')
+
+        author = User.query.get(self.author_id)
+        author.username = "renamed"
+        db.session.commit()
+
+        html = self.client.get(f'/users/{self.author_id}').get_data(as_text=True)
+        self.assertIn('@renamed', html)
+        self.assertNotIn('@author', html)
+
+    def test_delete_invalidates(self):
+        """Is a deleted message's card dropped?"""
+
+        self.client.get(f'/users/{self.author_id}')
+        size = fragments.stats()['size']
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+            c.post(f'/messages/{self.m2_id}/delete')
+
+        self.assertEqual(fragments.stats()['size'], size - 1)
+
+    def test_lru_bound(self):
+        """Does the cache stay within its size?"""
+
+        maxsize = fragments.maxsize
+        fragments.maxsize = 1
+        try:
+            self.client.get(f'/users/{self.author_id}')
+            self.assertEqual(fragments.stats()['size'], 1)
+        finally:
+            fragments.maxsize = maxsize
@@ -0,0 +1,130 @@
+"""Sample data generator tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_generator.py
+
+
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime
+from unittest import TestCase
+
+# the generator is run as a script, importing its helpers from its directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'generator'))
+
+import create_csvs  # noqa: E402
+from helpers import ZipfSampler, heavy_tailed_count  # noqa: E402
+
+CONFIG = dict(users=40, messages=90, follows=200, likes=150, seed=7,
+              end=datetime(2024, 1, 1))
+
+
+class GenerateTestCase(TestCase):
+    """Test that generated files depend only on the seed and sizes."""
+
+    def setUp(self):
+        self.shard_size = create_csvs.SHARD_SIZE
+        # several shards per file, so that processes split the work
+        create_csvs.SHARD_SIZE = 16
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        create_csvs.SHARD_SIZE = self.shard_size
+        self.tmp.cleanup()
+
+    def generate(self, name, processes, **config):
+        out_dir = os.path.join(self.tmp.name, name)
+        os.mkdir(out_dir)
+        create_csvs.generate(dict(CONFIG, **config), out_dir, processes)
+
+        files = {}
+        for kind in create_csvs.WRITERS:
+            with open(os.path.join(out_dir, f"{kind}.csv"), 'rb') as f:
+                files[kind] = f.read()
+
+        self.assertEqual(sorted(os.listdir(out_dir)),
+                         sorted(f"{kind}.csv" for kind in create_csvs.WRITERS))
+        return files
+
+    def lines(self, data):
+        return data.decode('utf-8').splitlines()
+
+    def test_same_seed_same_bytes(self):
+        """Do one and three processes write byte-identical files?"""
+
+        one = self.generate('one', processes=1)
+        three = self.generate('three', processes=3)
+
+        self.assertEqual(one, three)
+
+        self.assertEqual(len(self.lines(one['users'])), CONFIG['users'] + 1)
+        self.assertEqual(len(self.lines(one['messages'])), CONFIG['messages'] + 1)
+
+        other = self.generate('other', processes=1, seed=8)
+        self.assertNotEqual(other['messages'], one['messages'])
+
+    def test_rows_refer_to_existing_rows(self):
+        """Are ids in range, and follows and likes unique per user?"""
+
+        files = self.generate('refs', processes=2)
+
+        follows = [tuple(map(int, line.split(',')))
+                   for line in self.lines(files['follows'])[1:]]
+        likes = [tuple(map(int, line.split(',')))
+                 for line in self.lines(files['likes'])[1:]]
+
+        self.assertEqual(len(set(follows)), len(follows))
+        self.assertEqual(len(set(likes)), len(likes))
+        self.assertTrue(all(followed != follower for followed, follower in follows))
+        self.assertTrue(all(1 <= user_id <= CONFIG['users']
+                            for pair in follows for user_id in pair))
+        self.assertTrue(all(1 <= user_id <= CONFIG['users']
+                            and 1 <= message_id <= CONFIG['messages']
+                            for user_id, message_id in likes))
+
+
+class SamplerTestCase(TestCase):
+    """Test the power-law samplers."""
+
+    def test_zipf_ids_in_range(self):
+        """Does every rank map to a distinct id in 1..n?"""
+
+        for n, salt in [(1, 0), (10, 3), (97, 12345), (1000, 7)]:
+            sampler = ZipfSampler(n, salt=salt)
+            ids = {(rank * sampler.stride + sampler.offset) % n + 1
+                   for rank in range(n)}
+            self.assertEqual(ids, set(range(1, n + 1)))
+
+    def test_zipf_popularity(self):
+        """Is the top rank's id drawn most, and far more than the median?"""
+
+        rng = random.Random(1)
+
+        for alpha in (0.8, 1.0, 1.1):
+            sampler = ZipfSampler(500, alpha, salt=42)
+            counts = Counter(sampler(rng) for _ in range(20000))
+            top_id = sampler.offset % 500 + 1
+
+            self.assertTrue(all(1 <= id <= 500 for id in counts))
+            self.assertEqual(counts.most_common(1)[0][0], top_id)
+
+            ranked = sorted(counts.values(), reverse=True)
+            self.assertGreater(ranked[0], 10 * ranked[len(ranked) // 2])
+
+    def test_heavy_tailed_count(self):
+        """Are counts capped, near their mean, and sometimes far above it?"""
+
+        rng = random.Random(2)
+        counts = [heavy_tailed_count(rng, 20, 1000) for _ in range(20000)]
+
+        self.assertTrue(all(0 <= count <= 1000 for count in counts))
+        self.assertAlmostEqual(sum(counts) / len(counts), 20, delta=3)
+        self.assertGreater(max(counts), 100)
+
+        # the smallest count drawn is mean / 2
+        self.assertEqual({heavy_tailed_count(rng, 20, 5) for _ in range(100)}, {5})
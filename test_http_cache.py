@@ -0,0 +1,139 @@
+"""Conditional HTTP caching tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_http_cache.py
+
+
+from app import app, user_cache, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+import counters
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HTTPCacheTestCase(TestCase):
+    """Test validators, 304s and Cache-Control policies."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        u1 = User(email="u1@test.com", username="u1",
+                  password="HASHED_PASSWORD")
+        u2 = User(email="u2@test.com", username="u2",
+                  password="HASHED_PASSWORD")
+        db.session.add_all([u1, u2])
+        db.session.flush()
+
+        db.session.add(Follows(user_following_id=u1.id,
+                               user_being_followed_id=u2.id))
+        m = Message(text="hello", user_id=u2.id)
+        db.session.add(m)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m_id = m.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_public_profile(self):
+        """Is an anonymous profile public and revalidated by ETag?"""
+
+        resp = self.client.get(f'/users/{self.u2_id}')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], 'public, no-cache')
+        self.assertIn('Last-Modified', resp.headers)
+        etag = resp.headers['ETag']
+
+        resp = self.client.get(f'/users/{self.u2_id}',
+                               headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+
+        # posting changes the author's row, and so the page
+        db.session.add(Message(text="again", user_id=self.u2_id))
+        counters.bump(self.u2_id, messages_count=1)
+        db.session.commit()
+
+        resp = self.client.get(f'/users/{self.u2_id}',
+                               headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'again', resp.data)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_private_home(self):
+        """Is the home timeline private, and changed by a like?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get('/')
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+            self.assertNotIn('Last-Modified', resp.headers)
+            etag = resp.headers['ETag']
+
+            resp = c.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            c.post(f'/users/add_like/{self.m_id}')
+
+            resp = c.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_viewer_in_etag(self):
+        """Do different viewers get different ETags for the same page?"""
+
+        anon = self.client.get(f'/users/{self.u2_id}').headers['ETag']
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get(f'/users/{self.u2_id}',
+                         headers={'If-None-Match': anon})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+    def test_flashes_not_cached(self):
+        """Is a page with pending flashes rendered and not stored?"""
+
+        etag = self.client.get(f'/users/{self.u2_id}').headers['ETag']
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('success', 'Flashed!')]
+
+            resp = c.get(f'/users/{self.u2_id}',
+                         headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b'Flashed!', resp.data)
+            self.assertEqual(resp.headers['Cache-Control'], 'no-store')
+            self.assertNotIn('ETag', resp.headers)
+
+    def test_forms_not_stored(self):
+        """Are pages without validators sent no-store?"""
+
+        resp = self.client.get('/login')
+        self.assertEqual(resp.headers['Cache-Control'], 'no-store')
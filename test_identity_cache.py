@@ -0,0 +1,115 @@
+"""Identity cache tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_identity_cache.py
+
+
+from app import app, user_cache, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from models import db, User
+from identity_cache import IdentityCache, load_user
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class IdentityCacheTestCase(TestCase):
+    """Test the LRU/TTL cache itself."""
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry evicted first?"""
+
+        cache = IdentityCache(maxsize=2)
+        cache.put(1, 'one')
+        cache.put(2, 'two')
+        cache.get(1)
+        cache.put(3, 'three')
+
+        self.assertEqual(cache.get(1), 'one')
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.stats(),
+                         dict(hits=2, misses=1, evictions=1, size=2))
+
+    def test_ttl(self):
+        """Do entries expire after their TTL?"""
+
+        clock = FakeClock()
+        cache = IdentityCache(ttl=10, clock=clock)
+        cache.put(1, 'one')
+
+        clock.now = 9
+        self.assertEqual(cache.get(1), 'one')
+
+        clock.now = 10
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class LoadUserTestCase(TestCase):
+    """Test loading g.user through the cache."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        u = User(email="u1@test.com", username="u1",
+                 password="HASHED_PASSWORD", likes_count=4)
+        db.session.add(u)
+        db.session.commit()
+        self.u_id = u.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_cached_user_is_usable(self):
+        """Does a cache hit give a session-attached user?"""
+
+        load_user(user_cache, self.u_id)
+        db.session.remove()
+
+        hits = user_cache.stats()['hits']
+        user = load_user(user_cache, self.u_id)
+
+        self.assertEqual(user_cache.stats()['hits'], hits + 1)
+        self.assertIn(user, db.session)
+        self.assertEqual(user.username, "u1")
+        # uncached columns load on demand
+        self.assertEqual(user.likes_count, 4)
+
+    def test_requests_use_cache(self):
+        """Do repeated requests skip the user lookup?"""
+
+        before = user_cache.stats()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u_id
+
+            c.get(f'/users/{self.u_id}')
+            c.get(f'/users/{self.u_id}')
+
+        after = user_cache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
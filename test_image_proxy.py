@@ -0,0 +1,266 @@
+"""Image proxy tests, against a local stand-in image server."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_image_proxy.py
+
+
+from app import app, images
+import io
+import os
+import socket
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+
+from flask import render_template_string
+
+import image_proxy
+from image_proxy import (CACHE_CONTROL, DiskCache, ImageFetchError, check_host,
+                         fetch)
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def make_png():
+    """A small real PNG if Pillow is there to read it, else any bytes."""
+
+    if image_proxy.Image is None:
+        return b'\x89PNG\r\n\x1a\n' + b'\0' * 500
+
+    out = io.BytesIO()
+    image_proxy.Image.new('RGB', (300, 200), (200, 30, 30)).save(out, 'PNG')
+    return out.getvalue()
+
+
+class ImageServer:
+    """Serves /<name>.png from `files`, counting requests."""
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                name = self.path.lstrip('/')
+
+                if name not in server.files:
+                    self.send_error(404)
+                    return
+
+                content_type, data = server.files[name]
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.httpd.server_port}/{name}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ImageProxyTestCase(TestCase):
+    """Test fetching, caching and serving through the app."""
+
+    def setUp(self):
+        self.png = make_png()
+        self.server = ImageServer({
+            'a.png': ('image/png', self.png),
+            'b.png': ('image/png', self.png + b'b'),
+            'page.html': ('text/html', b'<html></html>'),
+        })
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = images.cache
+        images.cache = DiskCache(self.tmp.name, 10 * 1024 * 1024)
+        images._failures.clear()
+        app.config['IMAGE_PROXY_ALLOW_PRIVATE'] = True
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['IMAGE_PROXY_ALLOW_PRIVATE'] = False
+        images.cache = self.cache
+        self.server.close()
+        self.tmp.cleanup()
+
+    def src(self, url, size='thumb'):
+        with app.test_request_context():
+            return images.src(url, size)
+
+    def test_fetched_once(self):
+        """Is a source fetched once, then served from the disk cache?"""
+
+        url = self.src(self.server.url('a.png'))
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], CACHE_CONTROL)
+        self.assertIn(resp.mimetype, ('image/png', 'image/jpeg'))
+
+        if image_proxy.Image is None:
+            self.assertEqual(resp.data, self.png)
+        else:
+            thumb = image_proxy.Image.open(io.BytesIO(resp.data))
+            self.assertEqual(thumb.size, image_proxy.SIZES['thumb'][0])
+
+        etag = resp.headers['ETag']
+        self.assertEqual(self.client.get(url).data, resp.data)
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag})
+                         .status_code, 304)
+
+        self.assertEqual(self.server.requests, ['/a.png'])
+
+    def test_bad_signature(self):
+        """Are unsigned or tampered URLs refused without fetching?"""
+
+        url = self.src(self.server.url('a.png'))
+
+        self.assertEqual(self.client.get(url.replace('a.png', 'b.png'))
+                         .status_code, 404)
+        self.assertEqual(self.client.get(url.replace('/thumb/', '/avatar/'))
+                         .status_code, 404)
+        self.assertEqual(self.server.requests, [])
+
+    def test_failures_get_default(self):
+        """Do missing and non-image sources redirect to the default image?"""
+
+        for name in ('missing.png', 'page.html'):
+            resp = self.client.get(self.src(self.server.url(name)))
+            self.assertEqual(resp.status_code, 302)
+            self.assertIn('default-pic', resp.headers['Location'])
+
+        # failures aren't retried straight away
+        self.client.get(self.src(self.server.url('missing.png')))
+        self.assertEqual(self.server.requests, ['/missing.png', '/page.html'])
+
+    def test_decompression_bomb_gets_default(self):
+        """Does a source with too many pixels redirect to the default image?"""
+
+        if image_proxy.Image is None:
+            self.skipTest("needs Pillow")
+
+        max_pixels = image_proxy.Image.MAX_IMAGE_PIXELS
+        # Pillow refuses images over twice this many pixels
+        image_proxy.Image.MAX_IMAGE_PIXELS = 1000
+        try:
+            resp = self.client.get(self.src(self.server.url('a.png')))
+        finally:
+            image_proxy.Image.MAX_IMAGE_PIXELS = max_pixels
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn('default-pic', resp.headers['Location'])
+
+    def test_eviction(self):
+        """Does the cache stay under its size, dropping the oldest files?"""
+
+        # room for one source image (or, with Pillow, its smaller sizes)
+        images.cache = DiskCache(self.tmp.name, len(self.png) + 10)
+
+        first = self.src(self.server.url('a.png'))
+        second = self.src(self.server.url('b.png'))
+        self.client.get(first)
+        self.client.get(second)
+
+        self.assertLessEqual(images.cache.total, len(self.png) + 10)
+        self.assertGreater(images.cache.stats()['evictions'], 0)
+
+        self.client.get(first)
+        self.assertEqual(self.server.requests, ['/a.png', '/b.png', '/a.png'])
+
+    def test_src(self):
+        """Do templates get proxied URLs for external images only?"""
+
+        with app.test_request_context():
+            html = render_template_string(
+                "{{ image_src('https://example.com/me.jpg', 'avatar') }} "
+                "{{ image_src('/static/images/default-pic.png', 'avatar') }} "
+                "{{ image_src(None, 'header') }}").split()
+
+        self.assertTrue(html[0].startswith('/images/avatar/'))
+        self.assertIn('u=https', html[0])
+        self.assertEqual(html[1], '/static/images/default-pic.png')
+        self.assertEqual(html[2], '/static/images/warbler-hero.jpg')
+
+    def test_private_hosts_refused(self):
+        """Are private and non-http sources refused by default?"""
+
+        for url in ['http://127.0.0.1/x.png', 'http://10.0.0.1/x.png',
+                    'file:///etc/passwd', 'http://169.254.169.254/x.png']:
+            with self.assertRaises(ImageFetchError):
+                check_host(url)
+
+
+class ResolvingTestCase(TestCase):
+    """Test that hosts are checked at the address connected to."""
+
+    def setUp(self):
+        self.lookups = []
+        self.connects = []
+        self.answers = []
+        self.getaddrinfo = socket.getaddrinfo
+        self.create_connection = socket.create_connection
+
+        def getaddrinfo(host, port, *args, **kw):
+            self.lookups.append(host)
+            address = self.answers.pop(0)
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port))]
+
+        def create_connection(address, *args, **kw):
+            self.connects.append(address)
+            raise ConnectionRefusedError()
+
+        socket.getaddrinfo = getaddrinfo
+        socket.create_connection = create_connection
+
+    def tearDown(self):
+        socket.getaddrinfo = self.getaddrinfo
+        socket.create_connection = self.create_connection
+
+    def test_rebinding(self):
+        """Is a name resolved once, and its checked address connected to?"""
+
+        # a second lookup would get loopback
+        self.answers = ['93.184.216.34', '127.0.0.1']
+
+        with self.assertRaises(ImageFetchError):
+            fetch('http://images.example/a.png', 1000, 1)
+
+        self.assertEqual(self.lookups, ['images.example'])
+        self.assertEqual(self.connects, [('93.184.216.34', 80)])
+
+    def test_private_name_refused(self):
+        """Is a name resolving to a private address never connected to?"""
+
+        for scheme in ('http', 'https'):
+            self.answers = ['169.254.169.254']
+
+            with self.assertRaisesRegex(ImageFetchError, 'not a public address'):
+                fetch(f'{scheme}://metadata.example/a.png', 1000, 1)
+
+        self.assertEqual(self.connects, [])
@@ -0,0 +1,171 @@
+"""Like API and write-behind like count tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_like_counts.py
+
+
+from app import app, user_cache, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+from like_counts import like_counts, LikeCountBuffer
+import counters
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LikeAPITestCase(TestCase):
+    """Test the JSON like endpoint and its counts."""
+
+    def setUp(self):
+        like_counts.flush()
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        u1 = User(email="u1@test.com", username="u1",
+                  password="HASHED_PASSWORD")
+        u2 = User(email="u2@test.com", username="u2",
+                  password="HASHED_PASSWORD")
+        db.session.add_all([u1, u2])
+        db.session.flush()
+
+        m = Message(text="likeable", user_id=u2.id)
+        db.session.add(m)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m_id = m.id
+        self.url = f'/api/messages/{m.id}/like'
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_like_idempotent(self):
+        """Does PUT like once, however often it's repeated?"""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            resp = c.put(self.url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, dict(message_id=self.m_id,
+                                             liked=True, likes=1))
+
+            resp = c.put(self.url)
+            self.assertEqual(resp.json['likes'], 1)
+
+        self.assertEqual(Likes.query.filter_by(message_id=self.m_id).count(), 1)
+        self.assertEqual(User.query.get(self.u1_id).likes_count, 1)
+
+    def test_unlike_idempotent(self):
+        """Does DELETE unlike, and is a repeat harmless?"""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.put(self.url)
+
+            resp = c.delete(self.url)
+            self.assertEqual(resp.json, dict(message_id=self.m_id,
+                                             liked=False, likes=0))
+
+            resp = c.delete(self.url)
+            self.assertEqual(resp.json['likes'], 0)
+
+        self.assertEqual(Likes.query.filter_by(message_id=self.m_id).count(), 0)
+        self.assertEqual(User.query.get(self.u1_id).likes_count, 0)
+
+    def test_errors(self):
+        """Are anonymous and missing-message requests refused?"""
+
+        resp = self.client.put(self.url)
+        self.assertEqual(resp.status_code, 401)
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            resp = c.put('/api/messages/9999/like')
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(Likes.query.count(), 0)
+
+    def test_counts_written_in_batch(self):
+        """Are several likes applied to the message row by one flush?"""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.put(self.url)
+            self.login(c, self.u2_id)
+            resp = c.put(self.url)
+
+        self.assertEqual(resp.json['likes'], 2)
+
+        like_counts.flush()
+        self.assertEqual(like_counts.pending(self.m_id), 0)
+        self.assertEqual(Message.query.get(self.m_id).likes_count, 2)
+
+    def test_toggle_form(self):
+        """Does the no-JS form still toggle a like?"""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            c.post(f'/users/add_like/{self.m_id}')
+            self.assertEqual(Likes.query.count(), 1)
+
+            c.post(f'/users/add_like/{self.m_id}')
+            self.assertEqual(Likes.query.count(), 0)
+
+            resp = c.post('/users/add_like/9999')
+            self.assertEqual(resp.status_code, 404)
+
+        like_counts.flush()
+        self.assertEqual(Message.query.get(self.m_id).likes_count, 0)
+
+    def test_recount_likes(self):
+        """Does recount_likes repair drifted counts?"""
+
+        db.session.add(Likes(user_id=self.u1_id, message_id=self.m_id))
+        db.session.commit()
+
+        counters.recount_likes()
+        db.session.commit()
+
+        self.assertEqual(Message.query.get(self.m_id).likes_count, 1)
+
+
+class LikeCountBufferTestCase(TestCase):
+    """Test the buffer on its own."""
+
+    def test_deltas_combine(self):
+        """Do changes to one message accumulate until flushed?"""
+
+        buffer = LikeCountBuffer(interval=0)
+        buffer.add(1, 1)
+        buffer.add(1, 1)
+        buffer.add(2, 1)
+        buffer.add(2, -1)
+
+        self.assertEqual(buffer.pending(1), 2)
+        self.assertEqual(buffer.pending(2), 0)
+        self.assertEqual(buffer.stats()['pending'], 2)
+
+        buffer.discard()
+        self.assertEqual(buffer.flush(), 0)
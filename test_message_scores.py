@@ -0,0 +1,180 @@
+"""Top feed score tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python3 -m unittest test_message_scores.py
+
+
+from app import app, CURR_USER_KEY, fragments, rate_limiter, user_cache
+import math
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Follows, Message, MessageScore, User
+from like_counts import like_counts
+import message_scores
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ScoreMathTestCase(TestCase):
+    """Test log-domain scores against plainly decayed ones."""
+
+    def test_order_matches_decayed_sums(self):
+        """Do stored scores order messages as their decayed like sums do?"""
+
+        now = datetime(2024, 6, 1, 12)
+        hours = lambda *ago: [now - timedelta(hours=h) for h in ago]
+        messages = {'burst': hours(30, 30, 30, 30, 30),
+                    'steady': hours(20, 10, 5),
+                    'fresh': hours(1)}
+
+        def decayed(likes):
+            return sum(2 ** -((now - t) / message_scores.HALF_LIFE) for t in likes)
+
+        def stored(likes):
+            score = -math.inf
+            for t in likes:
+                score = message_scores.logaddexp(score, message_scores.log_weight(t))
+            return score
+
+        for name, likes in messages.items():
+            self.assertAlmostEqual(
+                math.exp(stored(likes) - message_scores.log_weight(now)),
+                decayed(likes))
+
+        self.assertEqual(sorted(messages, key=lambda m: stored(messages[m])),
+                         sorted(messages, key=lambda m: decayed(messages[m])))
+
+    def test_logsubexp(self):
+        a, b = math.log(5), math.log(2)
+        self.assertAlmostEqual(message_scores.logsubexp(a, b), math.log(3))
+        self.assertEqual(message_scores.logsubexp(b, a), -math.inf)
+
+
+class TopFeedTestCase(TestCase):
+    """Test scores kept by the write paths, and the top feed."""
+
+    def setUp(self):
+        like_counts.flush()
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+        fragments.clear()
+        # every test posts as the same user id
+        rate_limiter.store.clear()
+
+        self.client = app.test_client()
+
+        u1 = User(email="u1@test.com", username="u1", password="HASHED_PASSWORD")
+        u2 = User(email="u2@test.com", username="u2", password="HASHED_PASSWORD")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.u1_id, self.u2_id = u1.id, u2.id
+
+        db.session.add(Follows(user_following_id=self.u2_id,
+                               user_being_followed_id=self.u1_id))
+        db.session.commit()
+
+        self.login(self.u1_id)
+        for text in ("older but liked", "newer"):
+            self.client.post('/messages/new', data={"text": text})
+
+        self.older_id, self.newer_id = [
+            msg.id for msg in Message.query.order_by(Message.id)]
+
+    def tearDown(self):
+        like_counts.flush()
+        fragments.clear()
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def score(self, message_id):
+        db.session.expire_all()
+        return MessageScore.query.get(message_id).score
+
+    def test_scored_on_post(self):
+        """Does posting a message give it its initial score?"""
+
+        msg = Message.query.get(self.newer_id)
+        self.assertAlmostEqual(self.score(self.newer_id),
+                               message_scores.initial_score(msg.timestamp))
+        self.assertEqual(MessageScore.query.get(self.newer_id).author_id, self.u1_id)
+
+    def test_likes_raise_and_lower(self):
+        """Do likes, once flushed, raise a score, and unlikes lower it no
+        further than where it started?"""
+
+        initial = self.score(self.older_id)
+
+        self.login(self.u2_id)
+        self.client.put(f'/api/messages/{self.older_id}/like')
+        self.assertAlmostEqual(self.score(self.older_id), initial)
+
+        like_counts.flush()
+        liked = self.score(self.older_id)
+        self.assertGreater(liked, initial)
+
+        self.client.delete(f'/api/messages/{self.older_id}/like')
+        like_counts.flush()
+        self.assertLess(self.score(self.older_id), liked)
+        self.assertGreaterEqual(self.score(self.older_id), initial)
+
+    def test_top_feed(self):
+        """Is the top feed ranked by score, the home feed by time?"""
+
+        self.login(self.u2_id)
+        self.client.put(f'/api/messages/{self.older_id}/like')
+        like_counts.flush()
+
+        self.assertEqual(message_scores.top_message_ids(self.u2_id),
+                         [self.older_id, self.newer_id])
+        self.assertEqual(message_scores.top_message_ids(self.u2_id, hours=0), [])
+
+        top = self.client.get('/?feed=top').get_data(as_text=True)
+        self.assertLess(top.index("older but liked"), top.index("newer"))
+
+        latest = self.client.get('/').get_data(as_text=True)
+        self.assertLess(latest.index("newer"), latest.index("older but liked"))
+
+        api = self.client.get('/api/timeline?feed=top&fields=id').json
+        self.assertEqual(api['messages'], [dict(id=self.older_id), dict(id=self.newer_id)])
+
+    def test_deleted_message_unscored(self):
+        """Is a deleted message's score removed with it?"""
+
+        self.client.post(f'/messages/{self.newer_id}/delete')
+
+        self.assertIsNone(MessageScore.query.get(self.newer_id))
+        self.assertEqual(message_scores.top_message_ids(self.u1_id), [self.older_id])
+
+    def test_rebuild_and_prune(self):
+        """Does rebuilding rescore recent messages, and pruning drop old ones?"""
+
+        msg = Message.query.get(self.older_id)
+        msg.likes_count = 3
+        msg.timestamp = datetime.utcnow() - timedelta(hours=100)
+        db.session.commit()
+
+        self.assertEqual(message_scores.rebuild(hours=200), 2)
+        db.session.commit()
+        self.assertAlmostEqual(self.score(self.older_id),
+                               message_scores.initial_score(msg.timestamp, 3))
+
+        self.assertEqual(message_scores.prune(), 1)
+        db.session.commit()
+        self.assertEqual([score.message_id for score in MessageScore.query],
+                         [self.newer_id])
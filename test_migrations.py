@@ -0,0 +1,119 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_migrations.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine, inspect
+
+import migrations
+
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER PRIMARY KEY,
+        email TEXT NOT NULL UNIQUE,
+        username TEXT NOT NULL UNIQUE,
+        image_url TEXT,
+        header_image_url TEXT,
+        bio TEXT,
+        location TEXT,
+        password TEXT NOT NULL)""",
+    """CREATE TABLE messages (
+        id INTEGER PRIMARY KEY,
+        text VARCHAR(140) NOT NULL,
+        timestamp DATETIME NOT NULL,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE)""",
+    """CREATE TABLE follows (
+        user_being_followed_id INTEGER REFERENCES users (id) ON DELETE cascade,
+        user_following_id INTEGER REFERENCES users (id) ON DELETE cascade,
+        PRIMARY KEY (user_being_followed_id, user_following_id))""",
+    """CREATE TABLE likes (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER REFERENCES users (id) ON DELETE cascade,
+        message_id INTEGER UNIQUE REFERENCES messages (id) ON DELETE cascade)""",
+]
+
+
+class MigrationsTestCase(TestCase):
+    """Test upgrading a database made by the original models."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            f"sqlite:///{os.path.join(self.tmp.name, 'm.db')}")
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def make_baseline(self):
+        with self.engine.begin() as conn:
+            for sql in BASELINE_SCHEMA:
+                conn.execute(sql)
+
+            conn.execute("INSERT INTO users (id, email, username, password) "
+                         "VALUES (1, 'a@test.com', 'a', 'x'), "
+                         "(2, 'b@test.com', 'b', 'x')")
+            conn.execute("INSERT INTO messages (id, text, timestamp, user_id) "
+                         "VALUES (1, 'hi', '2020-01-01 00:00:00', 1)")
+            conn.execute("INSERT INTO likes (user_id, message_id) VALUES (1, 1)")
+
+    def test_upgrade_baseline(self):
+        """Does the original schema upgrade to match the models?"""
+
+        self.make_baseline()
+        self.assertEqual(migrations.current_version(self.engine), 1)
+
+        applied = migrations.upgrade(self.engine, log=lambda msg: None)
+
+        self.assertEqual([m.version for m in applied],
+                         [m.version for m in migrations.MIGRATIONS])
+        self.assertEqual(migrations.current_version(self.engine),
+                         migrations.latest_version())
+        self.assertEqual(migrations.pending(self.engine), [])
+
+        columns = {col['name'] for col in inspect(self.engine).get_columns('users')}
+        self.assertIn('followers_count', columns)
+        self.assertIn('updated_at', columns)
+
+        report = migrations.check_indexes(self.engine)
+        self.assertEqual(report['missing'], [])
+        self.assertEqual(report['undeclared'], [])
+
+        with self.engine.begin() as conn:
+            # rows survived, and a second user may now like the same message
+            conn.execute("INSERT INTO likes (user_id, message_id) VALUES (2, 1)")
+            self.assertEqual(conn.execute("SELECT count(*) FROM likes").scalar(), 2)
+            self.assertIsNotNone(conn.execute(
+                "SELECT updated_at FROM users WHERE id = 1").scalar())
+
+        self.assertEqual(migrations.upgrade(self.engine, log=lambda msg: None), [])
+
+    def test_missing_index_reported(self):
+        """Does the check report a declared index that isn't built?"""
+
+        self.make_baseline()
+        migrations.upgrade(self.engine, log=lambda msg: None)
+
+        with self.engine.begin() as conn:
+            conn.execute("DROP INDEX ix_messages_user_timestamp")
+
+        missing = migrations.check_indexes(self.engine)['missing']
+
+        self.assertEqual([ix['name'] for ix in missing],
+                         ['ix_messages_user_timestamp'])
+        self.assertIn('user_messages()', missing[0]['used_by'])
+
+    def test_empty_database(self):
+        """Is an empty database created from the models and stamped?"""
+
+        self.assertIsNone(migrations.current_version(self.engine))
+        self.assertEqual(migrations.upgrade(self.engine, log=lambda msg: None), [])
+        self.assertEqual(migrations.current_version(self.engine),
+                         migrations.latest_version())
+        self.assertEqual(migrations.check_indexes(self.engine)['missing'], [])
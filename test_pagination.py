@@ -0,0 +1,106 @@
+"""Cursor pagination tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python3 -m unittest test_pagination.py
+
+
+from app import app, CURR_USER_KEY
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User
+import pagination
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PaginationTestCase(TestCase):
+    """Test keyset pagination of message lists."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        u = User(email="u1@test.com", username="u1",
+                 password="HASHED_PASSWORD")
+        db.session.add(u)
+        db.session.commit()
+        self.u_id = u.id
+
+        # two messages share a timestamp so the id tiebreak matters
+        start = datetime(2020, 1, 1)
+        stamps = [start, start + timedelta(minutes=1),
+                  start + timedelta(minutes=1), start + timedelta(minutes=2)]
+        db.session.add_all([Message(text=f"msg {i}", user_id=u.id, timestamp=ts)
+                            for i, ts in enumerate(stamps)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_cursor_round_trip(self):
+        """Do cursors decode to what they encoded?"""
+
+        stamp = datetime(2020, 5, 6, 7, 8, 9, 1234)
+        token = pagination.encode_cursor(stamp, 42)
+
+        self.assertEqual(pagination.decode_cursor(token), (stamp, 42))
+
+        with self.assertRaises(ValueError):
+            pagination.decode_cursor("not a cursor")
+
+    def test_paginate_walks_every_message_once(self):
+        """Does following `before` visit every message exactly once?"""
+
+        query = Message.query.filter(Message.user_id == self.u_id)
+        seen = []
+        cursor = None
+
+        while True:
+            page = pagination.paginate(query, Message.timestamp, Message.id,
+                                       cursor, per_page=1)
+            seen.extend(msg.text for msg in page.items)
+            if page.before is None:
+                break
+            cursor = pagination.decode_cursor(page.before)
+
+        self.assertEqual(seen, ["msg 3", "msg 2", "msg 1", "msg 0"])
+
+    def test_feed_fragment(self):
+        """Does the fragment endpoint serve the next page?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u_id
+
+            resp = c.get(f'/users/{self.u_id}')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("msg 3", html)
+            self.assertNotIn("load-more", html)
+
+            resp = c.get(f'/feeds/users/{self.u_id}?before=bogus')
+            self.assertEqual(resp.status_code, 400)
+
+            token = pagination.encode_cursor(datetime(2020, 1, 1, 0, 1), 10**6)
+            resp = c.get(f'/feeds/users/{self.u_id}?before={token}')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("msg 1", html)
+            self.assertIn("msg 0", html)
+            self.assertNotIn("msg 3", html)
@@ -0,0 +1,132 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_passwords.py
+
+
+from app import app
+import os
+import threading
+import time
+from unittest import TestCase
+
+from models import db, User
+from passwords import PasswordHasher, PasswordPoolBusy, hash_rounds, hasher
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the pooled password hasher."""
+
+    def test_hash_and_check_in_pool(self):
+        """Do hashes made in worker processes check out?"""
+
+        pooled = PasswordHasher(rounds=4, workers=1)
+        hashed = pooled.hash("s3cret!")
+
+        self.assertEqual(hash_rounds(hashed), 4)
+        self.assertTrue(pooled.check(hashed, "s3cret!"))
+        self.assertFalse(pooled.check(hashed, "wrong!"))
+        self.assertEqual(pooled.stats()['completed'], 3)
+        self.assertEqual(pooled.stats()['in_flight'], 0)
+
+    def test_full_queue_rejects(self):
+        """Are callers turned away once the queue is full?"""
+
+        inline = PasswordHasher(rounds=4, workers=0, max_queue=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash(password, rounds):
+            started.set()
+            release.wait(5)
+            return "hashed"
+
+        worker = threading.Thread(target=inline._run,
+                                  args=(slow_hash, "pw", 4))
+        worker.start()
+        started.wait(5)
+
+        try:
+            with self.assertRaises(PasswordPoolBusy):
+                inline.hash("another")
+        finally:
+            release.set()
+            worker.join()
+
+        self.assertEqual(inline.stats()['rejected'], 1)
+
+    def test_timed_out_hash_keeps_slot(self):
+        """Does a hash its caller gave up on still count until it's done?"""
+
+        pooled = PasswordHasher(rounds=4, workers=1, max_queue=1, timeout=0.05)
+
+        with self.assertRaises(PasswordPoolBusy):
+            pooled._run(time.sleep, 0.5)
+
+        with self.assertRaises(PasswordPoolBusy):
+            pooled.hash("another")
+
+        stats = pooled.stats()
+        self.assertEqual((stats['timeouts'], stats['rejected'], stats['in_flight']),
+                         (1, 1, 1))
+
+        deadline = time.time() + 5
+        while pooled.stats()['in_flight'] and time.time() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(hash_rounds(pooled.hash("another")), 4)
+
+    def test_stats_reported(self):
+        """Are the app hasher's stats served with the pool report?"""
+
+        app.config['POOL_STATS_REPORT'] = True
+        try:
+            resp = app.test_client().get('/__pool_stats')
+        finally:
+            app.config['POOL_STATS_REPORT'] = False
+
+        self.assertEqual(set(resp.json['password_hasher']), set(hasher.stats()))
+
+
+class RehashTestCase(TestCase):
+    """Test upgrading hashes when the work factor changes."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.rounds = hasher.rounds
+        hasher.rounds = 4
+
+        User.signup(username="u1", email="u1@test.com",
+                    password="password", image_url=None)
+        db.session.commit()
+
+    def tearDown(self):
+        hasher.rounds = self.rounds
+        db.session.rollback()
+
+    def test_rehash_on_login(self):
+        """Is an old-cost hash replaced after a successful login?"""
+
+        hasher.rounds = 5
+
+        self.assertFalse(User.authenticate("u1", "wrong password"))
+        user = User.query.filter_by(username="u1").one()
+        self.assertEqual(hash_rounds(user.password), 4)
+
+        user = User.authenticate("u1", "password")
+        db.session.commit()
+
+        self.assertEqual(hash_rounds(user.password), 5)
+        self.assertTrue(User.authenticate("u1", "password"))
@@ -0,0 +1,199 @@
+"""Connection pool telemetry tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_pool_stats.py
+
+
+from app import app, pool_stats
+import os
+import sqlite3
+from unittest import TestCase
+
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+from models import db
+from pool_stats import InstrumentedPool, configure_pool, instrumented, recommend
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def make_pool(**kw):
+    poolclass = instrumented(QueuePool, long_hold=0)
+    return poolclass(lambda: sqlite3.connect(':memory:'), **kw)
+
+
+class PoolTelemetryTestCase(TestCase):
+    """Test the instrumented pool on its own."""
+
+    def test_checkouts_counted(self):
+        """Are connections in use, peaks and holds per endpoint recorded?"""
+
+        pool = make_pool(pool_size=2, max_overflow=0)
+
+        with app.test_request_context('/users'):
+            app.preprocess_request()
+            conn1 = pool.connect()
+            conn2 = pool.connect()
+            self.assertEqual(pool.telemetry.in_use, 2)
+            conn1.close()
+            conn2.close()
+
+        stats = pool.telemetry.snapshot()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['peak_in_use'], 2)
+        self.assertEqual(stats['settings']['pool_size'], 2)
+
+        [row] = stats['endpoints']
+        self.assertEqual(row['endpoint'], 'list_users')
+        self.assertEqual(row['checkouts'], 2)
+        self.assertEqual(row['long_holds'], 2)
+
+    def test_timeouts_counted(self):
+        """Is a checkout that times out on a full pool recorded?"""
+
+        pool = make_pool(pool_size=1, max_overflow=0, timeout=0.01)
+        conn = pool.connect()
+
+        with self.assertRaises(TimeoutError):
+            pool.connect()
+
+        conn.close()
+        stats = pool.telemetry.snapshot()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertGreaterEqual(stats['max_wait_ms'], 0)
+
+        self.assertIn('1 checkouts timed out', ' '.join(recommend(stats)['notes']))
+
+    def test_connects_counted(self):
+        """Are new connections counted apart from checkouts?"""
+
+        pool = make_pool(pool_size=1, max_overflow=1)
+
+        for i in range(3):
+            conn = pool.connect()
+            conn.close()
+
+        stats = pool.telemetry.snapshot()
+        self.assertEqual((stats['checkouts'], stats['connects']), (3, 1))
+
+    def test_recreated_pool_counted_once(self):
+        """Does a recreated pool (after engine.dispose()) keep counting into
+        the same telemetry, once per checkout?"""
+
+        pool = make_pool(pool_size=1, max_overflow=0)
+        conn = pool.connect()
+        conn.close()
+
+        new_pool = pool.recreate()
+        for i in range(2):
+            conn = new_pool.connect()
+            conn.close()
+
+        self.assertIs(new_pool.telemetry, pool.telemetry)
+        stats = new_pool.telemetry.snapshot()
+        self.assertEqual((stats['checkouts'], stats['in_use']), (3, 0))
+
+    def test_recommend_sizes(self):
+        """Are sizes suggested from the connections in use?"""
+
+        pool = make_pool(pool_size=10, max_overflow=10)
+
+        for i in range(100):
+            conn = pool.connect()
+            conn.close()
+
+        advice = recommend(pool.telemetry.snapshot())
+        self.assertEqual(advice['suggested'], dict(pool_size=1, max_overflow=1))
+        self.assertTrue(any('can shrink' in note for note in advice['notes']))
+
+
+class ConfigurePoolTestCase(TestCase):
+    """Test the sizing policy."""
+
+    def test_queue_pool(self):
+        """Does a pooled database get the configured sizes?"""
+
+        options = configure_pool(app, make_url('postgresql:///warbler'), {})
+
+        self.assertEqual(options['pool_size'], app.config['DB_POOL_SIZE'])
+        self.assertEqual(options['max_overflow'], app.config['DB_POOL_MAX_OVERFLOW'])
+        self.assertEqual(options['pool_timeout'], app.config['DB_POOL_TIMEOUT'])
+        self.assertEqual(options['pool_recycle'], app.config['DB_POOL_RECYCLE'])
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertTrue(issubclass(options['poolclass'], QueuePool))
+        self.assertTrue(issubclass(options['poolclass'], InstrumentedPool))
+
+    def test_explicit_settings_win(self):
+        """Do options already chosen (e.g. SQLALCHEMY_POOL_SIZE) stay?"""
+
+        options = configure_pool(app, make_url('postgresql:///warbler'),
+                                 dict(pool_size=20))
+        self.assertEqual(options['pool_size'], 20)
+
+    def test_null_pool(self):
+        """Is a NullPool instrumented but not sized?"""
+
+        options = configure_pool(app, make_url('sqlite:////tmp/x.db'),
+                                 dict(poolclass=NullPool))
+
+        self.assertNotIn('pool_size', options)
+        self.assertNotIn('pool_pre_ping', options)
+        self.assertTrue(issubclass(options['poolclass'], NullPool))
+
+
+class PoolStatsViewTestCase(TestCase):
+    """Test the report and headers on the app."""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['POOL_STATS_REPORT'] = False
+
+    def test_app_pool_instrumented(self):
+        """Are the app's checkouts recorded and timed in Server-Timing?"""
+
+        resp = self.client.get('/users')
+        self.assertIn('db-pool;dur=', resp.headers.get('Server-Timing'))
+
+        [(name, pool)] = pool_stats.pools()
+        self.assertEqual(name, 'primary')
+        self.assertIsInstance(pool, InstrumentedPool)
+        self.assertTrue(any(row['endpoint'] == 'list_users'
+                            for row in pool.telemetry.snapshot()['endpoints']))
+
+    def test_report_view(self):
+        """Is the report hidden unless enabled?"""
+
+        resp = self.client.get('/__pool_stats')
+        self.assertEqual(resp.status_code, 404)
+
+        app.config['POOL_STATS_REPORT'] = True
+        self.client.get('/users')
+
+        resp = self.client.get('/__pool_stats')
+        self.assertEqual(resp.status_code, 200)
+
+        [row] = resp.json['pools']
+        self.assertEqual(row['name'], 'primary')
+        self.assertGreater(row['checkouts'], 0)
+        self.assertIn('notes', row['recommendation'])
+
+        # the app's other counters are reported with it
+        self.assertIn('pending', resp.json['like_counts'])
+        self.assertIn('rejected', resp.json['rate_limiter'])
+        for name in ('image_cache', 'fragment_cache', 'user_cache'):
+            self.assertIn('misses', resp.json[name])
@@ -0,0 +1,111 @@
+"""Query budget tests: pages cost a fixed number of queries."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_query_budget.py
+
+
+from app import app, user_cache, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+import counters
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# Most queries each route may make, for any number of rows shown.
+BUDGETS = {
+    '/': 5,
+    '/feeds/home': 5,
+    '/users': 3,
+    '/users/{author}': 3,
+    '/users/{viewer}/likes': 2,
+    '/users/{author}/followers': 5,
+    '/users/{viewer}/following': 5,
+}
+
+
+class QueryBudgetTestCase(TestCase):
+    """Do hot pages make the same number of queries however long they are?"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def make_data(self, size):
+        """A viewer following `size` authors, each with `size` messages,
+        and liking one message from each."""
+
+        viewer = User(email="viewer@test.com", username="viewer",
+                      password="HASHED_PASSWORD")
+        db.session.add(viewer)
+
+        authors = [User(email=f"a{i}@test.com", username=f"a{i}",
+                        password="HASHED_PASSWORD")
+                   for i in range(size)]
+        db.session.add_all(authors)
+        db.session.flush()
+
+        for author in authors:
+            messages = [Message(text=f"m{i}", user_id=author.id)
+                        for i in range(size)]
+            db.session.add_all(messages)
+            db.session.flush()
+
+            db.session.add(Follows(user_following_id=viewer.id,
+                                   user_being_followed_id=author.id))
+            db.session.add(Follows(user_following_id=author.id,
+                                   user_being_followed_id=authors[0].id))
+            db.session.add(Likes(user_id=viewer.id, message_id=messages[0].id))
+
+        counters.recount()
+        db.session.commit()
+
+        return viewer.id, authors[0].id
+
+    def query_counts(self, size):
+        """Queries made by each budgeted route, once caches are warm."""
+
+        viewer_id, author_id = self.make_data(size)
+        counts = {}
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = viewer_id
+
+            for route in BUDGETS:
+                url = route.format(viewer=viewer_id, author=author_id)
+                client.get(url)
+                resp = client.get(url)
+
+                self.assertEqual(resp.status_code, 200, url)
+                counts[route] = int(resp.headers['X-SQL-Queries'])
+
+        return counts
+
+    def test_budgets(self):
+        small = self.query_counts(2)
+
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        large = self.query_counts(12)
+
+        for route, budget in BUDGETS.items():
+            self.assertEqual(small[route], large[route], route)
+            self.assertLessEqual(large[route], budget, route)
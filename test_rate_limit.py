@@ -0,0 +1,145 @@
+"""Rate limiter tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python3 -m unittest test_rate_limit.py
+
+
+from app import app, CURR_USER_KEY, rate_limiter, user_cache
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import g
+
+from models import db, Message, User
+from rate_limit import SQLiteStore, sliding_window, token_bucket
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PolicyTestCase(TestCase):
+    """Test the token bucket and sliding window arithmetic."""
+
+    def run_policy(self, policy, times, limit, seconds):
+        """Retry-after for a request at each of `times`."""
+
+        state, waits = None, []
+
+        for now in times:
+            new_state, wait, _ = policy(state, now, limit, seconds)
+            state = new_state or state
+            waits.append(wait)
+
+        return waits
+
+    def test_token_bucket(self):
+        """Does a bucket allow a burst, then refill at its rate?"""
+
+        waits = self.run_policy(token_bucket, [0, 0, 0, 0, 10, 20], 3, 60)
+
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertAlmostEqual(waits[3], 20)
+        self.assertAlmostEqual(waits[4], 10)
+        self.assertEqual(waits[5], 0)
+
+    def test_sliding_window(self):
+        """Does a window count the previous window's share?"""
+
+        waits = self.run_policy(sliding_window, [10, 20, 30, 70, 130], 3, 60)
+
+        self.assertEqual(waits[:3], [0, 0, 0])
+        # at 70, 5/6 of the previous window's 3 requests still count (until 80)
+        self.assertAlmostEqual(waits[3], 10)
+        self.assertEqual(waits[4], 0)
+
+
+class RateLimiterTestCase(TestCase):
+    """Test limits on the app's endpoints."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        u = User(email="u1@test.com", username="u1", password="HASHED_PASSWORD")
+        db.session.add(u)
+        db.session.commit()
+        self.u_id = u.id
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = rate_limiter.store
+        rate_limiter.store = SQLiteStore(os.path.join(self.tmp.name, 'limits.db'))
+
+        self.limits = app.config['RATE_LIMITS']
+        app.config['RATE_LIMITS'] = {
+            'login': [('ip', 'bucket', 5, 60), ('username', 'window', 2, 60)],
+            'messages_add': [('user', 'bucket', 2, 60)],
+        }
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['RATE_LIMITS'] = self.limits
+        rate_limiter.store = self.store
+        self.tmp.cleanup()
+        db.session.rollback()
+
+    def login(self, username):
+        return self.client.post('/login', data={"username": username,
+                                                "password": "wrong"})
+
+    def test_login_limits(self):
+        """Are logins limited per username, and per IP across usernames?"""
+
+        self.assertEqual([self.login("u1").status_code for _ in range(3)],
+                         [200, 200, 429])
+
+        # other usernames still count against the IP
+        statuses = [self.login(f"nobody{n}").status_code for n in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+    def test_rejected_early(self):
+        """Is a rejection sent before the logged-in user is loaded?"""
+
+        for _ in range(2):
+            self.login("U1 ")
+
+        with self.client:
+            resp = self.login("u1")
+            self.assertFalse(hasattr(g, 'user'))
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertGreater(int(resp.headers['Retry-After']), 0)
+        self.assertEqual(resp.headers['Cache-Control'], 'no-store')
+
+    def test_messages_per_user(self):
+        """Is posting limited per user, and are GETs left alone?"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u_id
+
+        statuses = [self.client.post('/messages/new', data={"text": "hi"}).status_code
+                    for _ in range(3)]
+
+        self.assertEqual(statuses, [302, 302, 429])
+        self.assertEqual(Message.query.count(), 2)
+        self.assertEqual(self.client.get('/messages/new').status_code, 200)
+
+    def test_disabled(self):
+        """Can limiting be switched off?"""
+
+        app.config['RATE_LIMIT_ENABLED'] = False
+        try:
+            self.assertEqual({self.login("u1").status_code for _ in range(4)}, {200})
+        finally:
+            app.config['RATE_LIMIT_ENABLED'] = True
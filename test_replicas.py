@@ -0,0 +1,109 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_replicas.py
+
+
+from app import app, user_cache, CURR_USER_KEY
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Timeline
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Route reads to a second database file standing in for a replica.
+
+    The replica holds the same rows under different usernames, so pages
+    show which database they were read from.
+    """
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.binds = app.config['SQLALCHEMY_BINDS']
+        app.config['SQLALCHEMY_BINDS'] = {
+            'replica_0': f"sqlite:///{os.path.join(self.tmp.name, 'replica.db')}"}
+
+        self.replica = db.get_engine(app, bind='replica_0')
+        db.metadata.create_all(self.replica)
+
+        for engine, name in [(db.engine, 'primary'), (self.replica, 'replica')]:
+            with engine.begin() as conn:
+                conn.execute(User.__table__.insert(), [
+                    dict(id=1, email='u1@test.com', username=f'{name}-u1',
+                         password='HASHED_PASSWORD'),
+                    dict(id=2, email='u2@test.com', username=f'{name}-u2',
+                         password='HASHED_PASSWORD'),
+                ])
+                conn.execute(Message.__table__.insert(),
+                             dict(id=1, text='hello', user_id=2))
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+        self.replica.dispose()
+        app.config['SQLALCHEMY_BINDS'] = self.binds
+        self.tmp.cleanup()
+
+    def test_reads_use_replica(self):
+        """Do anonymous GETs read from the replica?"""
+
+        resp = self.client.get('/users/2')
+        self.assertIn(b'replica-u2', resp.data)
+
+    def test_sticky_after_write(self):
+        """After a user's write, do their reads go to the primary?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.get('/users/2')
+            self.assertIn(b'replica-u2', resp.data)
+
+            resp = c.put('/api/messages/1/like')
+            self.assertEqual(resp.json['liked'], True)
+
+            resp = c.get('/users/2')
+            self.assertIn(b'primary-u2', resp.data)
+
+            # once the window has passed, back to the replica
+            with c.session_transaction() as sess:
+                sess['primary_until'] = 0
+
+            resp = c.get('/users/2')
+            self.assertIn(b'replica-u2', resp.data)
+
+    def test_writes_in_reads_go_to_primary(self):
+        """Does a GET that writes (building a timeline) write the primary?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.get('/')
+
+        self.assertIsNotNone(Timeline.query.get(1))
+
+        with self.replica.connect() as conn:
+            count = conn.execute('SELECT count(*) FROM timelines').scalar()
+        self.assertEqual(count, 0)
@@ -0,0 +1,143 @@
+"""SQL statistics tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest test_sql_stats.py
+
+
+from app import app, sql_stats
+import os
+from unittest import TestCase
+
+from flask import g
+from sqlalchemy.exc import DatabaseError
+
+from models import db, User, Message
+from sql_stats import RequestStats, fingerprint
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FingerprintTestCase(TestCase):
+    """Test statement fingerprinting."""
+
+    def test_values_collapse(self):
+        """Do statements differing only in values share a fingerprint?"""
+
+        self.assertEqual(
+            fingerprint("SELECT * FROM users\n WHERE id = 1 AND name = 'x'"),
+            fingerprint("SELECT * FROM users WHERE id = 22 AND name = 'it''s'"))
+
+        self.assertEqual(
+            fingerprint("SELECT * FROM users WHERE id IN (%(id_1)s, %(id_2)s)"),
+            "SELECT * FROM users WHERE id IN (?)")
+
+        self.assertEqual(fingerprint("SELECT * FROM users WHERE id IN (?, ?, ?)"),
+                         fingerprint("SELECT * FROM users WHERE id IN (?)"))
+
+    def test_repeated(self):
+        """Are shapes over the threshold reported?"""
+
+        stats = RequestStats()
+        for user_id in range(5):
+            stats.add(f"SELECT * FROM users WHERE id = {user_id}", 0.001)
+        stats.add("SELECT * FROM messages", 0.001)
+
+        self.assertEqual(stats.queries, 6)
+        self.assertEqual(stats.repeated(5),
+                         {"SELECT * FROM users WHERE id = ?": 5})
+
+
+class SQLStatsViewsTestCase(TestCase):
+    """Test per-request headers and the report."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        sql_stats.reset()
+
+        self.client = app.test_client()
+
+        u = User(email="u1@test.com", username="u1",
+                 password="HASHED_PASSWORD")
+        db.session.add(u)
+        db.session.commit()
+        self.u_id = u.id
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['SQL_STATS_REPORT'] = False
+
+    def test_headers(self):
+        """Does each response report its query count and time?"""
+
+        resp = self.client.get(f'/feeds/users/{self.u_id}')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(int(resp.headers['X-SQL-Queries']), 0)
+        self.assertTrue(resp.headers['X-SQL-Time'].endswith('ms'))
+        self.assertIn('sql;dur=', resp.headers['Server-Timing'])
+
+    def test_n_plus_one_reported(self):
+        """Is a per-row lazy load flagged in the report?"""
+
+        app.config['SQL_STATS_REPORT'] = True
+
+        for i in range(6):
+            u = User(email=f"a{i}@test.com", username=f"a{i}",
+                     password="HASHED_PASSWORD")
+            db.session.add(u)
+            db.session.flush()
+            db.session.add(Message(text="hi", user_id=u.id))
+        db.session.commit()
+        db.session.remove()
+
+        # run the request hooks around a per-row lazy load
+        with app.test_request_context('/feeds/home'):
+            sql_stats._start_request()
+            [msg.user.username for msg in Message.query.all()]
+            sql_stats._finish_request(app.response_class())
+
+        resp = self.client.get('/__sql_stats')
+
+        report = {row['endpoint']: row for row in resp.json['endpoints']}
+        flagged = report['home_feed']['n_plus_one']
+
+        self.assertEqual(len(flagged), 1)
+        self.assertIn('FROM users', flagged[0]['statement'])
+        self.assertEqual(flagged[0]['max_repeats'], 6)
+
+    def test_failed_statement(self):
+        """Does a statement that raises leave nothing behind on its
+        connection, and later ones counted as usual?"""
+
+        with app.test_request_context('/'), db.engine.connect() as conn:
+            sql_stats._start_request()
+
+            conn.execute("SELECT 1")
+            info = {key: list(value) if isinstance(value, list) else value
+                    for key, value in conn.info.items()}
+
+            for _ in range(3):
+                with self.assertRaises(DatabaseError):
+                    conn.execute("SELECT * FROM no_such_table")
+
+            conn.execute("SELECT 1")
+
+            self.assertEqual(conn.info, info)
+            self.assertEqual(g.sql_stats.queries, 2)
+
+    def test_report_disabled(self):
+        """Is the report hidden unless configured?"""
+
+        resp = self.client.get('/__sql_stats')
+        self.assertEqual(resp.status_code, 404)
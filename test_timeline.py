@@ -0,0 +1,245 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python3 -m unittest test_timeline.py
+
+
+from app import app, CURR_USER_KEY, fragments
+import html
+import os
+import re
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Timeline, TimelineEntry
+from pagination import PAGE_SIZE
+import timeline
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test materialized home timelines."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.u1 = User(email="u1@test.com", username="u1",
+                       password="HASHED_PASSWORD")
+        self.u2 = User(email="u2@test.com", username="u2",
+                       password="HASHED_PASSWORD")
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+
+        self.u1_id = self.u1.id
+        self.u2_id = self.u2.id
+
+        self.m1 = Message(text="u2 says hi", user_id=self.u2_id)
+        db.session.add(self.m1)
+        db.session.commit()
+
+        self.m1_id = self.m1.id
+
+        fragments.clear()
+
+    def tearDown(self):
+        fragments.clear()
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_homepage_builds_timeline(self):
+        """Does the first homepage hit materialize the timeline?"""
+
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.u1_id))
+        db.session.commit()
+
+        self.assertIsNone(timeline.message_ids(self.u1_id))
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            resp = c.get('/')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("u2 says hi", resp.get_data(as_text=True))
+        self.assertEqual(timeline.message_ids(self.u1_id), [self.m1_id])
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        """Do follows and unfollows update a built timeline?"""
+
+        timeline.build(self.u1_id, [])
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            c.post(f'/users/follow/{self.u2_id}')
+            self.assertEqual(timeline.message_ids(self.u1_id), [self.m1_id])
+
+            c.post(f'/users/stop-following/{self.u2_id}')
+            self.assertEqual(timeline.message_ids(self.u1_id), [])
+
+    def test_new_message_fans_out(self):
+        """Are new messages pushed to followers and removed on delete?"""
+
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.u1_id))
+        timeline.build(self.u1_id, [])
+        timeline.build(self.u2_id, [])
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post('/messages/new', data={"text": "fresh"})
+
+            msg = Message.query.filter_by(text="fresh").one()
+            self.assertEqual(timeline.message_ids(self.u1_id), [msg.id])
+            self.assertEqual(timeline.message_ids(self.u2_id), [msg.id])
+
+            c.post(f'/messages/{msg.id}/delete')
+
+        self.assertEqual(timeline.message_ids(self.u1_id), [])
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_sizes_follow_removals(self):
+        """Do unfollows and deleted messages shrink timeline sizes?"""
+
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.u1_id))
+        timeline.build(self.u1_id, [])
+        timeline.build(self.u2_id, [])
+        db.session.commit()
+
+        size = lambda user_id: Timeline.query.get(user_id).size
+
+        with self.client as c:
+            self.login(c, self.u2_id)
+            for text in ("one", "two"):
+                c.post('/messages/new', data={"text": text})
+
+            self.assertEqual((size(self.u1_id), size(self.u2_id)), (2, 2))
+
+            msg = Message.query.filter_by(text="one").one()
+            c.post(f'/messages/{msg.id}/delete')
+            db.session.expire_all()
+            self.assertEqual((size(self.u1_id), size(self.u2_id)), (1, 1))
+
+            self.login(c, self.u1_id)
+            c.post(f'/users/stop-following/{self.u2_id}')
+            db.session.expire_all()
+            self.assertEqual((size(self.u1_id), size(self.u2_id)), (0, 1))
+
+    def test_trim(self):
+        """Does trim cut a timeline back to its newest entries?"""
+
+        messages = [Message(text=f"msg {i}", user_id=self.u2_id)
+                    for i in range(5)]
+        db.session.add_all(messages)
+        db.session.commit()
+        ids = [msg.id for msg in messages]
+
+        timeline.build(self.u1_id, messages)
+        db.session.commit()
+
+        old_length = timeline.TIMELINE_LENGTH
+        timeline.TIMELINE_LENGTH = 2
+        try:
+            timeline.trim(self.u1_id)
+        finally:
+            timeline.TIMELINE_LENGTH = old_length
+
+        self.assertEqual(timeline.message_ids(self.u1_id),
+                         [ids[4], ids[3]])
+        self.assertEqual(Timeline.query.get(self.u1_id).size, 2)
+
+    def add_messages(self, user_id, label, minutes):
+        """Messages "<label> <minute>" posted at those minutes of 2020."""
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all([Message(text=f"{label} {m}", user_id=user_id,
+                                    timestamp=start + timedelta(minutes=m))
+                            for m in minutes])
+        db.session.commit()
+
+    def walk(self, c, link):
+        """Texts of the messages on every home page, following the `link`
+        ('href' for full pages, 'data-fragment' for list fragments)."""
+
+        texts = []
+        url = '/'
+
+        while url:
+            page = c.get(url).get_data(as_text=True)
+            texts.extend(re.findall(r'<p>((?:u1|u2|u3) \d+)</p>', page))
+            next_url = re.search(rf'class="load-more" {link}="([^"]+)"', page)
+            if next_url is None:
+                next_url = re.search(rf'{link}="([^"]+)" class="load-more"', page)
+            url = next_url and html.unescape(next_url.group(1))
+
+        return texts
+
+    def newest_first(self, *texts):
+        return sorted(texts, key=lambda text: int(text.split()[1]), reverse=True)
+
+    def test_home_pages_past_timeline(self):
+        """Do home pages carry on past the end of the materialized timeline?"""
+
+        db.session.delete(Message.query.get(self.m1_id))
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.u1_id))
+        u2_minutes = range(0, 2 * (2 * PAGE_SIZE + 50), 2)
+        self.add_messages(self.u2_id, "u2", u2_minutes)
+        self.add_messages(self.u1_id, "u1", range(1, 20, 2))
+
+        expected = self.newest_first(*[f"u2 {m}" for m in u2_minutes],
+                                     *[f"u1 {m}" for m in range(1, 20, 2)])
+        self.assertEqual(len(expected), 2 * PAGE_SIZE + 60)
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            self.assertEqual(self.walk(c, 'href'), expected)
+            self.assertEqual(len(timeline.message_ids(self.u1_id, limit=1000)),
+                             PAGE_SIZE)
+            self.assertEqual(self.walk(c, 'data-fragment'), expected)
+
+    def test_backfill_keeps_timeline_complete(self):
+        """Does a backfill leave no gaps among other authors' messages?"""
+
+        db.session.delete(Message.query.get(self.m1_id))
+        u3 = User(email="u3@test.com", username="u3", password="HASHED_PASSWORD")
+        db.session.add(u3)
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.u1_id))
+        db.session.commit()
+        u3_id = u3.id
+
+        self.add_messages(self.u2_id, "u2", range(0, 300, 2))
+        self.add_messages(u3_id, "u3", range(1, 300, 2))
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.get('/')
+            c.post(f'/users/follow/{u3_id}')
+
+            self.assertEqual(self.walk(c, 'href'),
+                             self.newest_first(*[f"u2 {m}" for m in range(0, 300, 2)],
+                                               *[f"u3 {m}" for m in range(1, 300, 2)]))
@@ -164,3 +164,27 @@ class UserModelTestCase(TestCase):
 
         self.assertEqual(auth, signed_up_user)
         self.assertFalse(auth2)
+
+    def test_follow_membership_batches(self):
+        """Do followed_among/followers_among answer for a whole list at once"""
+
+        users = [User(email=f"test{i}@test.com",
+                      username=f"testuser{i}",
+                      password="HASHED_PASSWORD") for i in range(4)]
+        db.session.add_all(users)
+        db.session.commit()
+
+        u0, u1, u2, u3 = [u.id for u in users]
+
+        db.session.add_all([
+            Follows(user_being_followed_id=u1, user_following_id=u0),
+            Follows(user_being_followed_id=u2, user_following_id=u0),
+            Follows(user_being_followed_id=u0, user_following_id=u2),
+        ])
+        db.session.commit()
+
+        self.assertEqual(Follows.followed_among(u0, [u1, u2, u3]), {u1, u2})
+        self.assertEqual(Follows.followers_among(u0, [u1, u2, u3]), {u2})
+        self.assertEqual(Follows.followed_among(u0, []), set())
+        self.assertTrue(users[0].is_following(u1))
+        self.assertFalse(users[0].is_followed_by(users[1]))
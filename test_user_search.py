@@ -0,0 +1,103 @@
+"""User search tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python3 -m unittest test_user_search.py
+
+
+from app import app
+import os
+from unittest import TestCase
+
+from models import db, User
+import user_search
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+
+class UserSearchTestCase(TestCase):
+    """Test the trigram user search index."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        for username, bio in [("bobcat", None),
+                              ("rebobbed", None),
+                              ("bob", None),
+                              ("alice", "friends with bob"),
+                              ("carol", "likes 100%_real cats")]:
+            db.session.add(User(email=f"{username}@test.com",
+                                username=username,
+                                bio=bio,
+                                password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        user_search.reindex_all()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def usernames(self, q, **kwargs):
+        users, more = user_search.search_users(q, **kwargs)
+        return [u.username for u in users]
+
+    def test_ranking(self):
+        """Are exact, prefix, substring and bio matches ranked in order?"""
+
+        self.assertEqual(self.usernames("BOB"),
+                         ["bob", "bobcat", "rebobbed", "alice"])
+
+    def test_short_query_matches_prefix(self):
+        """Do queries shorter than a trigram match username prefixes?"""
+
+        self.assertEqual(self.usernames("bo"), ["bob", "bobcat"])
+
+    def test_like_wildcards_are_literal(self):
+        """Are % and _ in the query matched literally?"""
+
+        self.assertEqual(self.usernames("0%_r"), ["carol"])
+        self.assertEqual(self.usernames("0%%r"), [])
+
+    def test_pages(self):
+        """Are results split into pages?"""
+
+        users, more = user_search.search_users("bob", per_page=3)
+        self.assertTrue(more)
+
+        users, more = user_search.search_users("bob", page=2, per_page=3)
+        self.assertEqual([u.username for u in users], ["alice"])
+        self.assertFalse(more)
+
+    def test_index_user_tracks_edits(self):
+        """Does reindexing a user replace their old grams?"""
+
+        user = User.query.filter_by(username="bobcat").one()
+        user.username = "tiger"
+        user_search.index_user(user)
+        db.session.commit()
+
+        self.assertEqual(self.usernames("cat"), ["carol"])
+        self.assertEqual(self.usernames("tig"), ["tiger"])
+
+    def test_list_users_route(self):
+        """Does /users search and page?"""
+
+        resp = self.client.get('/users?q=bob')
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@bobcat", html)
+        self.assertNotIn("@carol", html)
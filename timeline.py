@@ -0,0 +1,225 @@
+"""Materialized home timelines for Warbler.
+
+Each user's home feed is kept as a list of message ids in
+``timeline_entries``. New messages are pushed ("fanned out") onto the
+author's and followers' timelines when they are written, so serving ``/``
+is a bounded id lookup instead of a query across everyone the user follows.
+
+A timeline holds every message of the feed down to its oldest entry, but
+not necessarily anything older: it is built from the first page, trimmed to
+its newest entries, and a follow only backfills what is newer than its
+oldest entry. Callers continue past the end of a timeline by querying
+followed users' messages directly.
+
+A user without a row in ``timelines`` has no materialized feed yet; callers
+fall back to querying messages directly and can then ``build`` it.
+
+None of these functions commit; they run inside the caller's transaction.
+"""
+
+from sqlalchemy import literal, or_, select
+
+from models import db, Follows, Message, Timeline, TimelineEntry, User
+from pagination import older_than
+
+# Entries kept per user once a timeline is trimmed.
+TIMELINE_LENGTH = 800
+
+# How far past TIMELINE_LENGTH a timeline may grow before it is trimmed.
+TIMELINE_SLACK = 200
+
+# Messages copied onto a timeline when its owner follows someone.
+BACKFILL_LENGTH = 100
+
+entries = TimelineEntry.__table__
+timelines = Timeline.__table__
+users = User.__table__
+
+
+def has_timeline(user_id):
+    """Has a timeline been materialized for this user?"""
+
+    return Timeline.query.get(user_id) is not None
+
+
+def build(user_id, messages):
+    """Materialize a timeline for `user_id` from already-loaded `messages`:
+    the newest of their feed, newest first."""
+
+    db.session.add(Timeline(user_id=user_id, size=len(messages)))
+    db.session.flush()
+
+    if messages:
+        db.session.execute(entries.insert(), [
+            dict(user_id=user_id,
+                 message_id=msg.id,
+                 author_id=msg.user_id,
+                 timestamp=msg.timestamp)
+            for msg in messages
+        ])
+
+
+def message_ids(user_id, cursor=None, limit=100):
+    """Return newest-first message ids on this user's timeline.
+
+    With a (timestamp, id) `cursor`, start just after that message. Fewer
+    than `limit` ids means the timeline has run out, not the feed.
+
+    Returns None if the user has no materialized timeline.
+    """
+
+    keys = message_keys(user_id, cursor, limit)
+
+    return None if keys is None else [message_id for _, message_id in keys]
+
+
+def message_keys(user_id, cursor=None, limit=100):
+    """As message_ids(), but (timestamp, id) pairs.
+
+    Messages of deleted accounts are left out: their entries stay until the
+    account's purge reaches them, and counting them would cut a page short.
+    """
+
+    timeline = Timeline.query.get(user_id)
+
+    if timeline is None:
+        return None
+
+    if timeline.size > TIMELINE_LENGTH + TIMELINE_SLACK:
+        trim(user_id)
+
+    query = (select([entries.c.timestamp, entries.c.message_id])
+             .select_from(entries.join(users, users.c.id == entries.c.author_id))
+             .where(entries.c.user_id == user_id)
+             .where(users.c.deleted_at.is_(None))
+             .order_by(entries.c.timestamp.desc(), entries.c.message_id.desc())
+             .limit(limit))
+
+    if cursor is not None:
+        query = query.where(
+            older_than(entries.c.timestamp, entries.c.message_id, cursor))
+
+    return [tuple(row) for row in db.session.execute(query)]
+
+
+def fan_out(msg):
+    """Push a flushed message onto its author's and followers' timelines."""
+
+    followers = (select([Follows.user_following_id])
+                 .where(Follows.user_being_followed_id == msg.user_id))
+    readers = or_(timelines.c.user_id == msg.user_id,
+                  timelines.c.user_id.in_(followers))
+
+    db.session.execute(entries.insert().from_select(
+        ['user_id', 'message_id', 'author_id', 'timestamp'],
+        select([timelines.c.user_id,
+                literal(msg.id),
+                literal(msg.user_id),
+                literal(msg.timestamp, db.DateTime)])
+        .where(readers)))
+
+    db.session.execute(timelines.update()
+                       .where(readers)
+                       .values(size=timelines.c.size + 1))
+
+
+def backfill(follower_id, followed_id):
+    """Copy recent messages of `followed_id` onto the follower's timeline.
+
+    Messages older than the timeline's oldest entry are left to the query
+    past its end. If more than BACKFILL_LENGTH are newer, the timeline is
+    cut back to the oldest one copied, so that it stays complete.
+    """
+
+    if not has_timeline(follower_id):
+        return
+
+    oldest = db.session.execute(
+        select([entries.c.timestamp, entries.c.message_id])
+        .where(entries.c.user_id == follower_id)
+        .order_by(entries.c.timestamp, entries.c.message_id)
+        .limit(1)).first()
+
+    recent = (select([literal(follower_id),
+                      Message.id,
+                      Message.user_id,
+                      Message.timestamp])
+              .where(Message.user_id == followed_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc()))
+
+    if oldest is not None:
+        recent = recent.where(~older_than(Message.timestamp, Message.id, oldest))
+
+    result = db.session.execute(entries.insert().from_select(
+        ['user_id', 'message_id', 'author_id', 'timestamp'],
+        recent.limit(BACKFILL_LENGTH)))
+
+    if result.rowcount == BACKFILL_LENGTH:
+        cutoff = db.session.execute(
+            recent.with_only_columns([Message.timestamp, Message.id])
+            .offset(BACKFILL_LENGTH - 1)
+            .limit(1)).first()
+
+        db.session.execute(entries.delete()
+                           .where(entries.c.user_id == follower_id)
+                           .where(older_than(entries.c.timestamp,
+                                             entries.c.message_id, cutoff)))
+
+    _update_size(follower_id)
+
+
+def unfollow(follower_id, followed_id):
+    """Remove messages of `followed_id` from the follower's timeline."""
+
+    result = db.session.execute(entries.delete().where(
+        (entries.c.user_id == follower_id)
+        & (entries.c.author_id == followed_id)))
+
+    db.session.execute(timelines.update()
+                       .where(timelines.c.user_id == follower_id)
+                       .values(size=timelines.c.size - result.rowcount))
+
+
+def remove_message(message_id):
+    """Remove a message from every timeline it was pushed to."""
+
+    readers = (select([entries.c.user_id])
+               .where(entries.c.message_id == message_id))
+
+    db.session.execute(timelines.update()
+                       .where(timelines.c.user_id.in_(readers))
+                       .values(size=timelines.c.size - 1))
+    db.session.execute(
+        entries.delete().where(entries.c.message_id == message_id))
+
+
+def trim(user_id):
+    """Cut a timeline back to its newest TIMELINE_LENGTH entries."""
+
+    cutoff = db.session.execute(
+        select([entries.c.timestamp, entries.c.message_id])
+        .where(entries.c.user_id == user_id)
+        .order_by(entries.c.timestamp.desc(), entries.c.message_id.desc())
+        .offset(TIMELINE_LENGTH)
+        .limit(1)).first()
+
+    if cutoff is not None:
+        timestamp, message_id = cutoff
+        db.session.execute(entries.delete().where(
+            (entries.c.user_id == user_id)
+            & ((entries.c.timestamp < timestamp)
+               | ((entries.c.timestamp == timestamp)
+                  & (entries.c.message_id <= message_id)))))
+
+    _update_size(user_id)
+
+
+def _update_size(user_id):
+    size = db.session.execute(
+        select([db.func.count()])
+        .select_from(entries)
+        .where(entries.c.user_id == user_id)).scalar()
+
+    db.session.execute(timelines.update()
+                       .where(timelines.c.user_id == user_id)
+                       .values(size=size))
@@ -0,0 +1,144 @@
+"""Trigram search over users for Warbler.
+
+``LIKE '%q%'`` can't use a B-tree index, so every search scanned the whole
+users table. Instead each user's username, bio and location are broken into
+lowercase trigrams stored in ``user_search_grams``. A search looks up the
+query's trigrams to find candidate users, then checks and ranks just those:
+
+    exact username  >  username prefix  >  username substring  >  bio/location
+
+Queries shorter than a trigram match username prefixes, which are indexed
+as their own 'prefix' grams.
+
+``index_user`` must be called whenever a user's searchable fields change;
+``flask reindex-search`` rebuilds the index for everyone.
+"""
+
+from sqlalchemy import case, func, or_, select
+
+from models import db, User, SearchGram
+
+GRAM_SIZE = 3
+
+SEARCHABLE_FIELDS = ('username', 'bio', 'location')
+
+PER_PAGE = 60
+
+grams_table = SearchGram.__table__
+
+
+def grams(text):
+    """The set of lowercase trigrams in `text`."""
+
+    text = (text or '').lower()
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def prefixes(text):
+    """Lowercase prefixes of `text` too short to be trigrams."""
+
+    text = (text or '').lower()
+    return {text[:n] for n in range(1, GRAM_SIZE) if len(text) >= n}
+
+
+def _rows(user):
+    for field in SEARCHABLE_FIELDS:
+        for gram in grams(getattr(user, field)):
+            yield dict(gram=gram, field=field, user_id=user.id)
+
+    for gram in prefixes(user.username):
+        yield dict(gram=gram, field='prefix', user_id=user.id)
+
+
+def index_user(user):
+    """(Re)index a flushed user's searchable fields."""
+
+    unindex_user(user.id)
+
+    rows = list(_rows(user))
+    if rows:
+        db.session.execute(grams_table.insert(), rows)
+
+
+def unindex_user(user_id):
+    """Drop a user from the search index."""
+
+    db.session.execute(
+        grams_table.delete().where(grams_table.c.user_id == user_id))
+
+
+def reindex_all(batch_size=1000):
+    """Rebuild the whole search index, `batch_size` users at a time."""
+
+    db.session.execute(grams_table.delete())
+
+    last_id = 0
+    while True:
+        users = (User.query
+                 .filter(User.id > last_id)
+                 .order_by(User.id)
+                 .limit(batch_size)
+                 .all())
+        if not users:
+            break
+
+        rows = [row for user in users for row in _rows(user)]
+        if rows:
+            db.session.execute(grams_table.insert(), rows)
+
+        last_id = users[-1].id
+
+
+def _escape_like(text):
+    return (text.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_'))
+
+
+def _candidates(q):
+    """Subquery of ids of users that may match `q`."""
+
+    query_grams = grams(q)
+
+    if not query_grams:
+        return (select([grams_table.c.user_id])
+                .where(grams_table.c.field == 'prefix')
+                .where(grams_table.c.gram == q))
+
+    # a user is a candidate if one field contains every trigram of q
+    return (select([grams_table.c.user_id])
+            .where(grams_table.c.gram.in_(query_grams))
+            .where(grams_table.c.field != 'prefix')
+            .group_by(grams_table.c.user_id, grams_table.c.field)
+            .having(func.count() == len(query_grams)))
+
+
+def search_users(q, page=1, per_page=PER_PAGE):
+    """Find users matching `q`, best matches first.
+
+    Returns (users, more) where `more` says whether there is a next page.
+    """
+
+    q = q.lower()
+    pattern = _escape_like(q)
+
+    username = func.lower(User.username)
+    contains = f"%{pattern}%"
+
+    rank = case([
+        (username == q, 0),
+        (username.like(f"{pattern}%", escape='\\'), 1),
+        (username.like(contains, escape='\\'), 2),
+    ], else_=3)
+
+    users = (User.query
+             .filter(User.id.in_(_candidates(q)))
+             .filter(or_(username.like(contains, escape='\\'),
+                         func.lower(User.bio).like(contains, escape='\\'),
+                         func.lower(User.location).like(contains, escape='\\')))
+             .order_by(rank, User.username)
+             .offset((page - 1) * per_page)
+             .limit(per_page + 1)
+             .all())
+
+    return users[:per_page], len(users) > per_page